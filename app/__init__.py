@@ -36,6 +36,7 @@ def create_app(config_name=None):
     from app.routes.orders import orders_bp
     from app.routes.payments import payments_bp
     from app.routes.health import health_bp
+    from app.routes.media import media_bp
 
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(products_bp, url_prefix='/api/products')
@@ -43,6 +44,27 @@ def create_app(config_name=None):
     app.register_blueprint(orders_bp, url_prefix='/api/orders')
     app.register_blueprint(payments_bp, url_prefix='/api/payments')
     app.register_blueprint(health_bp)
+    app.register_blueprint(media_bp, url_prefix=app.config.get('MEDIA_URL_PREFIX', '/media'))
+    
+    # Response cache for catalog reads
+    from app.utils.cache import init_cache
+    init_cache(app)
+    
+    # Encoded product JSON spliced into list responses
+    from app.utils.fragments import init_fragments
+    init_fragments(app)
+    
+    # Build the in-process search index if that backend is selected
+    from app.search import init_search
+    init_search(app)
+    
+    # View buffer and background refresh of popularity scores
+    from app.utils.popularity import init_popularity
+    init_popularity(app)
+    
+    # Nightly "frequently bought together" rebuild
+    from app.utils.related import init_related
+    init_related(app)
     
     # Error handlers
     @app.errorhandler(404)
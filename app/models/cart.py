@@ -1,7 +1,17 @@
 from app import db
+from app.models.product import Product
+from app.schemas.cart import MAX_CART_QUANTITY
+from sqlalchemy import and_, case, exists, false, func, literal, literal_column, or_, select, true
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import selectinload
 from datetime import datetime
 import uuid
 
+# Compact product card embedded in cart items (PRODUCT_FIELDS keys)
+CART_PRODUCT_FIELDS = ('id', 'name', 'slug', 'sku', 'price', 'is_active', 'is_in_stock', 'primary_image')
+
 class Cart(db.Model):
     """Shopping cart model"""
     __tablename__ = 'carts'
@@ -91,19 +101,89 @@ class Cart(db.Model):
         CartItem.query.filter_by(cart_id=self.id).delete()
         self.updated_at = datetime.utcnow()
     
-    def to_dict(self):
-        """Convert cart to dictionary"""
+    def to_dict(self, serialize_product=None):
+        """Convert cart to dictionary; ``serialize_product`` overrides Product.to_dict for items"""
+        # Items and all three totals in one pass over the loaded items
+        items = []
+        total_items = 0
+        subtotal = 0
+        total_weight = 0
+        updated_at = self.updated_at
+        for item in self.items:
+            items.append(item.to_dict(serialize_product))
+            total_items += item.quantity
+            subtotal += item.total_price
+            if item.product is not None and item.product.weight:
+                total_weight += float(item.product.weight) * item.quantity
+            # Adds only write the item row (see CartItem.upsert)
+            updated_at = max(updated_at, item.updated_at)
+        
         return {
             'id': self.id,
             'user_id': self.user_id,
-            'total_items': self.total_items,
-            'subtotal': float(self.subtotal),
-            'total_weight': self.total_weight,
-            'items': [item.to_dict() for item in self.items],
+            'total_items': total_items,
+            'subtotal': float(subtotal),
+            'total_weight': total_weight,
+            'items': items,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'updated_at': updated_at.isoformat()
         }
     
+    @staticmethod
+    def empty_dict(user_id):
+        """Dictionary of a cart that has not been created yet"""
+        return {
+            'id': None,
+            'user_id': user_id,
+            'total_items': 0,
+            'subtotal': 0.0,
+            'total_weight': 0,
+            'items': [],
+            'created_at': None,
+            'updated_at': None
+        }
+    
+    @staticmethod
+    def summary(user_id):
+        """Item count, subtotal and weight of a user's cart from one aggregate query"""
+        lines, total_items, subtotal, total_weight = db.session.query(
+            func.count(CartItem.id),
+            func.coalesce(func.sum(CartItem.quantity), 0),
+            func.coalesce(func.sum(CartItem.price * CartItem.quantity), 0),
+            func.coalesce(func.sum(Product.weight * CartItem.quantity), 0)
+        ).select_from(CartItem).join(
+            Cart, Cart.id == CartItem.cart_id
+        ).join(
+            Product, Product.id == CartItem.product_id
+        ).filter(Cart.user_id == user_id).one()
+        return {
+            'lines': lines,
+            'total_items': int(total_items),
+            'subtotal': round(float(subtotal), 2),
+            'total_weight': float(total_weight)
+        }
+    
+    @staticmethod
+    def eager_load_options():
+        """Loader options that batch items, products and images for to_dict()"""
+        return [
+            selectinload(Cart.items)
+            .selectinload(CartItem.product)
+            .options(*Product.eager_load_options())
+        ]
+    
+    @staticmethod
+    def card_load_options():
+        """
+        Loader options for serializing with CART_PRODUCT_FIELDS: items joined
+        to the columns of their products in one query, then the images.
+        """
+        return [
+            selectinload(Cart.items)
+            .joinedload(CartItem.product, innerjoin=True)
+            .options(*Product.load_options(CART_PRODUCT_FIELDS, Product.weight, Product.updated_at))
+        ]
+    
     def __repr__(self):
         return f'<Cart {self.user.email} - {self.total_items} items>'
 
@@ -125,6 +205,21 @@ class CartItem(db.Model):
     # Unique constraint to prevent duplicate items in same cart
     __table_args__ = (db.UniqueConstraint('cart_id', 'product_id', name='unique_cart_product'),)
     
+    @classmethod
+    def upsert(cls, user_id, product_id, quantity):
+        """
+        Add ``quantity`` of a product to a user's cart with one statement.
+        
+        The item is inserted, or its quantity increased, only if the user
+        has a cart, the product is active and the new total is at most
+        MAX_CART_QUANTITY and fits the stock of inventory-tracked products;
+        the check and the write are one
+        atomic statement, so concurrent adds cannot oversell or trip the
+        unique_cart_product constraint. Returns whether anything was written.
+        """
+        upsert = _UPSERTS[db.session.get_bind().dialect.name]
+        return upsert(user_id, product_id, quantity, str(uuid.uuid4()), datetime.utcnow())
+    
     @property
     def total_price(self):
         """Calculate total price for this cart item"""
@@ -140,12 +235,13 @@ class CartItem(db.Model):
         """Check if product price has changed since adding to cart"""
         return self.price != self.current_product_price
     
-    def to_dict(self):
+    def to_dict(self, serialize_product=None):
         """Convert cart item to dictionary"""
+        serialize_product = serialize_product or Product.to_dict
         return {
             'id': self.id,
             'product_id': self.product_id,
-            'product': self.product.to_dict() if self.product else None,
+            'product': serialize_product(self.product) if self.product else None,
             'quantity': self.quantity,
             'price': float(self.price),
             'current_price': float(self.current_product_price),
@@ -157,3 +253,93 @@ class CartItem(db.Model):
     
     def __repr__(self):
         return f'<CartItem {self.product.name if self.product else "Unknown"} x{self.quantity}>'
+
+# Columns written by CartItem.upsert, in the order its SELECT produces them
+_UPSERT_COLUMNS = ('id', 'cart_id', 'product_id', 'quantity', 'price', 'created_at', 'updated_at')
+
+def _fits_stock(products, quantity):
+    return or_(products.c.track_inventory == false(), products.c.inventory_quantity >= quantity)
+
+def _upsert_source(user_id, product_id, quantity, item_id, now):
+    """The new item row, produced only when the cart exists and the product can be added"""
+    carts = Cart.__table__
+    products = Product.__table__
+    # Labelled apart from the cart_items columns (see _upsert_mysql)
+    values = (
+        literal(item_id, db.String(36)),
+        carts.c.id,
+        products.c.id,
+        literal(quantity, db.Integer),
+        products.c.price,
+        literal(now, db.DateTime),
+        literal(now, db.DateTime)
+    )
+    return select(
+        *(value.label(f'new_{name}') for name, value in zip(_UPSERT_COLUMNS, values))
+    ).select_from(carts.join(products, true())).where(
+        carts.c.user_id == user_id,
+        products.c.id == product_id,
+        products.c.is_active == true(),
+        _fits_stock(products, quantity)
+    )
+
+def _total_fits(added):
+    """Whether the conflicting item's quantity plus ``added`` stays within MAX_CART_QUANTITY and its product's stock"""
+    stock = Product.__table__.alias('stock')
+    # The conflicting row is referenced by name: the upsert clause has no
+    # enclosing SELECT the subquery could correlate with
+    quantity = literal_column('cart_items.quantity', db.Integer)
+    product_id = literal_column('cart_items.product_id', db.String(36))
+    return and_(
+        quantity + added <= MAX_CART_QUANTITY,
+        exists().where(stock.c.id == product_id, _fits_stock(stock, quantity + added))
+    )
+
+def _upsert_on_conflict(insert):
+    """INSERT ... SELECT ... ON CONFLICT DO UPDATE ... WHERE ... RETURNING (PostgreSQL, SQLite)"""
+    def upsert(user_id, product_id, quantity, item_id, now):
+        items = CartItem.__table__
+        statement = insert(items).from_select(
+            _UPSERT_COLUMNS, _upsert_source(user_id, product_id, quantity, item_id, now)
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['cart_id', 'product_id'],
+            set_={
+                'quantity': items.c.quantity + statement.excluded.quantity,
+                'updated_at': statement.excluded.updated_at
+            },
+            where=_total_fits(literal_column('excluded.quantity', db.Integer))
+        ).returning(items.c.id)
+        return db.session.execute(statement).first() is not None
+    return upsert
+
+def _mysql_upsert_statement(user_id, product_id, quantity, item_id, now):
+    """INSERT ... SELECT ... ON DUPLICATE KEY UPDATE with the stock check in the assignments"""
+    items = CartItem.__table__
+    # The SELECT joins carts and products, which have updated_at too: read
+    # it from a derived table so the update clause only sees cart_items
+    source = _upsert_source(user_id, product_id, quantity, item_id, now).subquery('new_item')
+    statement = mysql_insert(items).from_select(_UPSERT_COLUMNS, select(source))
+    fits = _total_fits(statement.inserted.quantity)
+    # Assignments run left to right: updated_at must be checked against the old quantity
+    statement = statement.on_duplicate_key_update([
+        ('updated_at', case((fits, statement.inserted.updated_at), else_=items.c.updated_at)),
+        ('quantity', case((fits, items.c.quantity + statement.inserted.quantity), else_=items.c.quantity)),
+    ])
+    return statement
+
+def _upsert_mysql(user_id, product_id, quantity, item_id, now):
+    items = CartItem.__table__
+    statement = _mysql_upsert_statement(user_id, product_id, quantity, item_id, now)
+    # Affected rows (with CLIENT_FOUND_ROWS): 0 nothing selected, 2 updated,
+    # 1 inserted or refused by the stock check -- only the new id tells them apart
+    written = db.session.execute(statement).rowcount
+    if written != 1:
+        return written == 2
+    return db.session.execute(select(items.c.id).where(items.c.id == item_id)).first() is not None
+
+_UPSERTS = {
+    'postgresql': _upsert_on_conflict(postgresql_insert),
+    'sqlite': _upsert_on_conflict(sqlite_insert),
+    'mysql': _upsert_mysql,
+}
@@ -1,4 +1,5 @@
 from app import db
+from sqlalchemy.orm import selectinload
 from datetime import datetime
 import uuid
 from enum import Enum
@@ -194,6 +195,11 @@ class Order(db.Model):
         
         return data
     
+    @staticmethod
+    def eager_load_options():
+        """Loader options that batch the order items used by to_dict()"""
+        return [selectinload(Order.items)]
+    
     def __repr__(self):
         return f'<Order {self.order_number}>'
 
@@ -1,7 +1,12 @@
 from app import db
+from sqlalchemy import DDL, event, func, inspect, literal, literal_column, or_, select, true
+from sqlalchemy.orm import load_only, selectinload
 from datetime import datetime
 import uuid
 
+# Text search configuration used by the PostgreSQL full-text index
+SEARCH_TS_CONFIG = 'simple'
+
 class Category(db.Model):
     """Product category model"""
     __tablename__ = 'categories'
@@ -41,12 +46,149 @@ class Category(db.Model):
         
         return data
     
+    @staticmethod
+    def build_tree(categories, root_id=None):
+        """Nest category dicts under their parents; categories must be pre-sorted"""
+        nodes = {}
+        for category in categories:
+            nodes[category.id] = category.to_dict()
+            nodes[category.id]['children'] = []
+        
+        roots = []
+        for category in categories:
+            node = nodes[category.id]
+            if category.id == root_id or (root_id is None and category.parent_id is None):
+                roots.append(node)
+            elif category.parent_id in nodes:
+                nodes[category.parent_id]['children'].append(node)
+            # Nodes under an inactive parent are left out of the tree
+        return roots
+    
     def __repr__(self):
         return f'<Category {self.name}>'
 
+class CategoryClosure(db.Model):
+    """Transitive closure of the category tree: one row per (ancestor, descendant) pair"""
+    __tablename__ = 'category_closure'
+    
+    ancestor_id = db.Column(db.String(36), db.ForeignKey('categories.id'), primary_key=True)
+    descendant_id = db.Column(db.String(36), db.ForeignKey('categories.id'), primary_key=True, index=True)
+    depth = db.Column(db.Integer, nullable=False)  # 0 for the self link
+    
+    @classmethod
+    def subtree_ids(cls, category_id):
+        """Query of the ids of a category and all its descendants"""
+        return db.session.query(cls.descendant_id).filter(cls.ancestor_id == category_id)
+    
+    @classmethod
+    def insert_node(cls, connection, category_id, parent_id):
+        """Link a new category to itself and to every ancestor of its parent"""
+        table = cls.__table__
+        connection.execute(table.insert().values(
+            ancestor_id=category_id, descendant_id=category_id, depth=0
+        ))
+        if parent_id:
+            connection.execute(table.insert().from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(
+                    table.c.ancestor_id,
+                    literal(category_id, db.String(36)),
+                    table.c.depth + 1
+                ).where(table.c.descendant_id == parent_id)
+            ))
+    
+    @classmethod
+    def move_node(cls, connection, category_id, parent_id):
+        """Re-link a category's subtree under a new parent (or make it a root)"""
+        table = cls.__table__
+        subtree = [row.descendant_id for row in connection.execute(
+            select(table.c.descendant_id).where(table.c.ancestor_id == category_id)
+        )]
+        
+        # Drop links from the old ancestors into the subtree
+        connection.execute(table.delete().where(
+            table.c.descendant_id.in_(subtree),
+            table.c.ancestor_id.notin_(subtree)
+        ))
+        
+        if parent_id:
+            above = table.alias('above')
+            below = table.alias('below')
+            connection.execute(table.insert().from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(
+                    above.c.ancestor_id,
+                    below.c.descendant_id,
+                    above.c.depth + below.c.depth + 1
+                ).select_from(
+                    # Every ancestor of the new parent x every node of the subtree
+                    above.join(below, true())
+                ).where(
+                    above.c.descendant_id == parent_id,
+                    below.c.ancestor_id == category_id
+                )
+            ))
+    
+    @classmethod
+    def delete_node(cls, connection, category_id):
+        """Remove every link pointing at a category"""
+        table = cls.__table__
+        connection.execute(table.delete().where(
+            or_(table.c.descendant_id == category_id, table.c.ancestor_id == category_id)
+        ))
+    
+    @classmethod
+    def rebuild(cls):
+        """Recompute the whole closure table from Category.parent_id"""
+        parents = dict(db.session.query(Category.id, Category.parent_id).all())
+        rows = []
+        for category_id in parents:
+            ancestor_id, depth = category_id, 0
+            while ancestor_id is not None:
+                rows.append({'ancestor_id': ancestor_id, 'descendant_id': category_id, 'depth': depth})
+                ancestor_id, depth = parents.get(ancestor_id), depth + 1
+        
+        db.session.execute(cls.__table__.delete())
+        if rows:
+            db.session.execute(cls.__table__.insert(), rows)
+        db.session.commit()
+    
+    def __repr__(self):
+        return f'<CategoryClosure {self.ancestor_id} -> {self.descendant_id} ({self.depth})>'
+
+# Keep the closure table in step with every Category write
+@event.listens_for(Category, 'after_insert')
+def _category_inserted(mapper, connection, target):
+    CategoryClosure.insert_node(connection, target.id, target.parent_id)
+
+@event.listens_for(Category, 'after_update')
+def _category_updated(mapper, connection, target):
+    if inspect(target).attrs.parent_id.history.has_changes():
+        CategoryClosure.move_node(connection, target.id, target.parent_id)
+
+@event.listens_for(Category, 'before_delete')
+def _category_deleted(mapper, connection, target):
+    CategoryClosure.delete_node(connection, target.id)
+
 class Product(db.Model):
     """Product model"""
     __tablename__ = 'products'
+    __table_args__ = (
+        # Serves sort_by=popularity (with the id tie-breaker) as an index scan
+        db.Index('ix_products_popularity', 'popularity_score', 'id'),
+        # Listing access paths: equality filters first, then the sort key and
+        # the id tie-breaker so a page is read in order without a sort step.
+        # Price ranges use the price-ordered indexes.
+        db.Index('ix_products_active_created', 'is_active', 'created_at', 'id'),
+        db.Index('ix_products_active_price', 'is_active', 'price', 'id'),
+        db.Index('ix_products_active_name', 'is_active', 'name', 'id'),
+        db.Index('ix_products_category_created', 'category_id', 'is_active', 'created_at', 'id'),
+        db.Index('ix_products_category_price', 'category_id', 'is_active', 'price', 'id'),
+        db.Index('ix_products_category_name', 'category_id', 'is_active', 'name', 'id'),
+        db.Index('ix_products_featured_created', 'is_featured', 'is_active', 'created_at', 'id'),
+        # Incremental refresh of the in-process search and suggest indexes
+        db.Index('ix_products_updated', 'updated_at'),
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(200), nullable=False)
@@ -76,6 +218,11 @@ class Product(db.Model):
     is_featured = db.Column(db.Boolean, default=False, nullable=False)
     is_digital = db.Column(db.Boolean, default=False, nullable=False)
     
+    # Popularity, refreshed in the background (see app/utils/popularity.py).
+    # The server defaults fill existing rows when init_db.py adds the columns.
+    view_count = db.Column(db.Integer, default=0, server_default=db.text('0'), nullable=False)
+    popularity_score = db.Column(db.Float(precision=53), default=0, server_default=db.text('0'), nullable=False)
+    
     # Relationships
     category_id = db.Column(db.String(36), db.ForeignKey('categories.id'), nullable=False)
     images = db.relationship('ProductImage', backref='product', lazy=True, cascade='all, delete-orphan')
@@ -110,44 +257,125 @@ class Product(db.Model):
             return False
         return self.inventory_quantity <= self.low_stock_threshold
     
-    def to_dict(self, include_images=True):
-        """Convert product to dictionary"""
-        data = {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'short_description': self.short_description,
-            'sku': self.sku,
-            'slug': self.slug,
-            'price': float(self.price),
-            'compare_price': float(self.compare_price) if self.compare_price else None,
-            'is_on_sale': self.is_on_sale,
-            'discount_percentage': self.discount_percentage,
-            'track_inventory': self.track_inventory,
-            'inventory_quantity': self.inventory_quantity,
-            'is_in_stock': self.is_in_stock,
-            'is_low_stock': self.is_low_stock,
-            'weight': float(self.weight) if self.weight else None,
-            'dimensions': self.dimensions,
-            'meta_title': self.meta_title,
-            'meta_description': self.meta_description,
-            'is_active': self.is_active,
-            'is_featured': self.is_featured,
-            'is_digital': self.is_digital,
-            'category_id': self.category_id,
-            'category': self.category.to_dict() if self.category else None,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
-        }
-        
-        if include_images:
-            data['images'] = [img.to_dict() for img in self.images]
+    @property
+    def primary_image(self):
+        """Image flagged as primary, else the first one by sort order"""
+        if not self.images:
+            return None
+        for image in self.images:
+            if image.is_primary:
+                return image
+        return min(self.images, key=lambda image: image.sort_order)
+    
+    def to_dict(self, include_images=True, fields=None):
+        """Convert product to dictionary, optionally limited to the given PRODUCT_FIELDS keys"""
+        if fields is None:
+            fields = PRODUCT_PROJECTIONS['full']
+            if not include_images:
+                fields = [field for field in fields if field != 'images']
+        return {field: PRODUCT_FIELDS[field][0](self) for field in fields}
+    
+    @staticmethod
+    def eager_load_options():
+        """Loader options that batch the relationships used by to_dict()"""
+        return [
+            selectinload(Product.category),
+            selectinload(Product.images)
+        ]
+    
+    @staticmethod
+    def resolve_fields(fieldset=None, include=None, default='full'):
+        """Expand ?fields= (keys or a projection name) plus ?include= into the keys to serialize"""
+        names = (fieldset or default).split(',') + (include.split(',') if include else [])
+        keys = []
+        for name in names:
+            for key in PRODUCT_PROJECTIONS.get(name, (name,)):
+                if key not in keys:
+                    keys.append(key)
+        return tuple(keys)
+    
+    @staticmethod
+    def load_options(fields, *columns):
+        """Loader options that read only the columns and relationships ``fields`` need"""
+        names = {'id'}
+        relationships = set()
+        for field in fields:
+            names.update(PRODUCT_FIELDS[field][1])
+            if PRODUCT_FIELDS[field][2]:
+                relationships.add(PRODUCT_FIELDS[field][2])
         
-        return data
+        options = [load_only(*[getattr(Product, name) for name in sorted(names)], *columns)]
+        options.extend(selectinload(getattr(Product, name)) for name in sorted(relationships))
+        return options
     
     def __repr__(self):
         return f'<Product {self.name}>'
 
+# Serializable product keys, in to_dict() order:
+# key -> (serializer, columns it reads, relationship it needs loaded)
+PRODUCT_FIELDS = {
+    'id': (lambda p: p.id, ('id',), None),
+    'name': (lambda p: p.name, ('name',), None),
+    'description': (lambda p: p.description, ('description',), None),
+    'short_description': (lambda p: p.short_description, ('short_description',), None),
+    'sku': (lambda p: p.sku, ('sku',), None),
+    'slug': (lambda p: p.slug, ('slug',), None),
+    'price': (lambda p: float(p.price), ('price',), None),
+    'compare_price': (lambda p: float(p.compare_price) if p.compare_price else None, ('compare_price',), None),
+    'is_on_sale': (lambda p: p.is_on_sale, ('price', 'compare_price'), None),
+    'discount_percentage': (lambda p: p.discount_percentage, ('price', 'compare_price'), None),
+    'track_inventory': (lambda p: p.track_inventory, ('track_inventory',), None),
+    'inventory_quantity': (lambda p: p.inventory_quantity, ('inventory_quantity',), None),
+    'is_in_stock': (lambda p: p.is_in_stock, ('track_inventory', 'inventory_quantity'), None),
+    'is_low_stock': (lambda p: p.is_low_stock, ('track_inventory', 'inventory_quantity', 'low_stock_threshold'), None),
+    'weight': (lambda p: float(p.weight) if p.weight else None, ('weight',), None),
+    'dimensions': (lambda p: p.dimensions, ('dimensions',), None),
+    'meta_title': (lambda p: p.meta_title, ('meta_title',), None),
+    'meta_description': (lambda p: p.meta_description, ('meta_description',), None),
+    'is_active': (lambda p: p.is_active, ('is_active',), None),
+    'is_featured': (lambda p: p.is_featured, ('is_featured',), None),
+    'is_digital': (lambda p: p.is_digital, ('is_digital',), None),
+    'category_id': (lambda p: p.category_id, ('category_id',), None),
+    'category': (lambda p: p.category.to_dict() if p.category else None, ('category_id',), 'category'),
+    'created_at': (lambda p: p.created_at.isoformat(), ('created_at',), None),
+    'updated_at': (lambda p: p.updated_at.isoformat(), ('updated_at',), None),
+    'images': (lambda p: [img.to_dict() for img in p.images], (), 'images'),
+    'primary_image': (lambda p: p.primary_image.to_dict() if p.primary_image else None, (), 'images'),
+}
+
+# Named field sets for ?fields=; listings default to the slim card
+PRODUCT_PROJECTIONS = {
+    'card': ('id', 'name', 'slug', 'price', 'primary_image'),
+    'full': tuple(field for field in PRODUCT_FIELDS if field != 'primary_image'),
+    'flat': tuple(field for field, (_, _, relationship) in PRODUCT_FIELDS.items() if relationship is None),
+}
+
+class JobWatermark(db.Model):
+    """Point up to which a background job has processed its input"""
+    __tablename__ = 'job_watermarks'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    processed_until = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<JobWatermark {self.name} {self.processed_until}>'
+
+class RelatedProduct(db.Model):
+    """Precomputed "bought together" neighbour of a product (see app/utils/related.py)"""
+    __tablename__ = 'related_products'
+
+    # The primary key serves a product's neighbours in order as one index range
+    product_id = db.Column(db.String(36), db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    position = db.Column(db.Integer, primary_key=True)  # 1 = strongest
+    related_product_id = db.Column(
+        db.String(36), db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False, index=True
+    )
+    score = db.Column(db.Float(precision=53), nullable=False)  # Cosine similarity of the order sets
+    orders = db.Column(db.Integer, nullable=False)  # Orders containing both products
+
+    def __repr__(self):
+        return f'<RelatedProduct {self.product_id} #{self.position} {self.related_product_id}>'
+
 class ProductImage(db.Model):
     """Product image model"""
     __tablename__ = 'product_images'
@@ -158,6 +386,8 @@ class ProductImage(db.Model):
     alt_text = db.Column(db.String(200), nullable=True)
     sort_order = db.Column(db.Integer, default=0, nullable=False)
     is_primary = db.Column(db.Boolean, default=False, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of an uploaded original
+    variants = db.Column(db.JSON, nullable=True)  # Resized copies of an upload: name -> URL
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
     def to_dict(self):
@@ -168,8 +398,87 @@ class ProductImage(db.Model):
             'alt_text': self.alt_text,
             'sort_order': self.sort_order,
             'is_primary': self.is_primary,
+            'variants': self.variants,
             'created_at': self.created_at.isoformat()
         }
     
     def __repr__(self):
         return f'<ProductImage {self.product.name} - {self.sort_order}>'
+
+def search_document():
+    """tsvector expression matching the PostgreSQL GIN index on products"""
+    document = None
+    for field in (Product.name, Product.short_description, Product.description, Product.sku):
+        part = func.coalesce(field, literal_column("''"))
+        document = part if document is None else document.op('||')(literal_column("' '")).op('||')(part)
+    return func.to_tsvector(literal_column(f"'{SEARCH_TS_CONFIG}'"), document)
+
+# Native full-text indexes backing catalog search (see app/search)
+_SEARCH_INDEX_DDL = {
+    'mysql': [
+        'CREATE FULLTEXT INDEX ft_products_search '
+        'ON products (name, short_description, description, sku)'
+    ],
+    'postgresql': [
+        'CREATE INDEX ix_products_search ON products USING GIN ('
+        f"to_tsvector('{SEARCH_TS_CONFIG}', "
+        "coalesce(name, '') || ' ' || coalesce(short_description, '') || ' ' || "
+        "coalesce(description, '') || ' ' || coalesce(sku, '')))"
+    ],
+    # External-content FTS5 table keyed by the implicit rowid of products. The
+    # id primary key is text, so VACUUM may renumber those rowids and leave
+    # the table pointing at the wrong rows; run `flask rebuild-search-index`
+    # after a VACUUM
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+        "name, short_description, description, sku, "
+        "content='products', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+        "INSERT INTO products_fts(rowid, name, short_description, description, sku) "
+        "VALUES (new.rowid, new.name, new.short_description, new.description, new.sku); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, short_description, description, sku) "
+        "VALUES ('delete', old.rowid, old.name, old.short_description, old.description, old.sku); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, short_description, description, sku) "
+        "VALUES ('delete', old.rowid, old.name, old.short_description, old.description, old.sku); "
+        "INSERT INTO products_fts(rowid, name, short_description, description, sku) "
+        "VALUES (new.rowid, new.name, new.short_description, new.description, new.sku); END",
+    ],
+}
+
+_SEARCH_INDEX_NAMES = {'mysql': 'ft_products_search', 'postgresql': 'ix_products_search'}
+
+_SQLITE_FTS5_TRIGGERS = ('products_fts_ai', 'products_fts_ad', 'products_fts_au')
+
+def has_search_index(connection):
+    """Whether the native full-text index of the connection's dialect exists on products"""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        names = connection.execute(db.text(
+            "SELECT name FROM sqlite_master WHERE name = 'products_fts' OR type = 'trigger'"
+        )).scalars().all()
+        return {'products_fts', *_SQLITE_FTS5_TRIGGERS} <= set(names)
+    name = _SEARCH_INDEX_NAMES.get(dialect)
+    if name is None:
+        return False
+    return any(index['name'] == name for index in inspect(connection).get_indexes('products'))
+
+def create_search_index(connection):
+    """Create the native full-text index of the connection's dialect and fill it from existing rows"""
+    for statement in _SEARCH_INDEX_DDL.get(connection.dialect.name, []):
+        connection.execute(db.text(statement))
+    rebuild_search_index(connection)
+
+def rebuild_search_index(connection):
+    """Re-read every product into the SQLite FTS5 table (the other indexes are maintained by the database)"""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(db.text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+
+@event.listens_for(Product.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    create_search_index(connection)
+
+event.listen(Product.__table__, 'before_drop', DDL(
+    'DROP TABLE IF EXISTS products_fts'
+).execute_if(dialect='sqlite'))
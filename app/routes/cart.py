@@ -1,26 +1,60 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import get_jwt_identity
 from marshmallow import ValidationError
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only
 from app import db
-from app.models.cart import Cart, CartItem
+from app.models.cart import Cart, CartItem, CART_PRODUCT_FIELDS
 from app.models.product import Product
-from app.schemas.cart import AddToCartSchema, UpdateCartItemSchema
+from app.schemas.cart import AddToCartSchema, UpdateCartItemSchema, CartBatchSchema, MAX_CART_QUANTITY
 from app.utils.auth import token_required, get_current_user, sanitize_input
+from app.utils.fragments import product_json, json_response
+from app.utils.cache import cached_json, make_cache_key, invalidate
+from app.utils.conditional import make_etag, conditional_json
 
 cart_bp = Blueprint('cart', __name__)
 
 # Schema instances
 add_to_cart_schema = AddToCartSchema()
 update_cart_item_schema = UpdateCartItemSchema()
+cart_batch_schema = CartBatchSchema()
 
-def get_or_create_cart(user):
-    """Get or create cart for user"""
-    cart = Cart.query.filter_by(user_id=user.id).first()
-    if not cart:
-        cart = Cart(user_id=user.id)
-        db.session.add(cart)
+def find_cart(user_id):
+    """User's cart with items, products and images batched for serialization, or None"""
+    return Cart.query.options(*Cart.card_load_options()).populate_existing().filter_by(user_id=user_id).first()
+
+def create_cart(user_id):
+    """Create the user's cart (on the first add); a concurrent creation is not an error"""
+    try:
+        db.session.add(Cart(user_id=user_id))
         db.session.commit()
-    return cart
+    except IntegrityError:
+        db.session.rollback()
+
+def find_item(user_id, item_id):
+    """One of the user's cart items, or None"""
+    return CartItem.query.join(Cart).filter(CartItem.id == item_id, Cart.user_id == user_id).first()
+
+def cart_changed(user_id):
+    """Drop the user's cached cart aggregates after a write"""
+    invalidate(f'cart:{user_id}')
+
+def summary_response(user_id, name, serialize):
+    """Response built from Cart.summary(), through the per-user cache when enabled"""
+    def load():
+        payload = serialize(Cart.summary(user_id))
+        return make_etag('cart', name, user_id, payload), lambda: payload
+    
+    if current_app.config.get('CART_SUMMARY_CACHE_ENABLED', False):
+        return cached_json(make_cache_key(f'cart:{name}:{user_id}'), [f'cart:{user_id}'], load)
+    return conditional_json(*load())
+
+def serialize_cart(cart, user_id):
+    """Cart dictionary with each item's product as a compact (cached) card"""
+    if cart is None:
+        return Cart.empty_dict(user_id)
+    return cart.to_dict(lambda product: product_json(product, CART_PRODUCT_FIELDS))
 
 @cart_bp.route('', methods=['GET'])
 @token_required
@@ -30,12 +64,12 @@ def get_cart():
         user = get_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
+        user_id = user.id
         
-        cart = get_or_create_cart(user)
-        
-        return jsonify({
-            'cart': cart.to_dict()
-        }), 200
+        # Reads never create the cart; a user without one has an empty cart
+        return json_response({
+            'cart': serialize_cart(find_cart(user_id), user_id)
+        }, 200)
         
     except Exception as e:
         return jsonify({'error': 'Failed to get cart'}), 500
@@ -48,73 +82,171 @@ def add_to_cart():
         user = get_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
+        user_id = user.id
         
         # Validate input data
         data = sanitize_input(request.get_json())
         validated_data = add_to_cart_schema.load(data)
+        product_id = validated_data['product_id']
+        quantity = validated_data['quantity']
         
-        # Check if product exists and is active
-        product = Product.query.get(validated_data['product_id'])
-        if not product:
-            return jsonify({'error': 'Product not found'}), 404
-        
-        if not product.is_active:
-            return jsonify({'error': 'Product is not available'}), 400
-        
-        # Check inventory if tracking is enabled
-        if product.track_inventory:
-            if product.inventory_quantity < validated_data['quantity']:
-                return jsonify({
+        # Insert or increase the item, checking availability and stock, in one statement
+        added = CartItem.upsert(user_id, product_id, quantity)
+        if not added:
+            db.session.rollback()
+            
+            # Nothing was written: find out why
+            product = db.session.get(Product, product_id)
+            if not product:
+                return jsonify({'error': 'Product not found'}), 404
+            
+            if not product.is_active:
+                return jsonify({'error': 'Product is not available'}), 400
+            
+            # First add: create the cart and try again
+            if not Cart.query.filter_by(user_id=user_id).first():
+                create_cart(user_id)
+                added = CartItem.upsert(user_id, product_id, quantity)
+        
+        if not added:
+            db.session.rollback()
+            current_in_cart = db.session.query(CartItem.quantity).join(Cart).filter(
+                Cart.user_id == user_id, CartItem.product_id == product_id
+            ).scalar()
+            if current_in_cart and current_in_cart + quantity > MAX_CART_QUANTITY:
+                error = {'error': 'Quantity exceeds the maximum', 'max_quantity': MAX_CART_QUANTITY}
+            else:
+                error = {
                     'error': 'Insufficient inventory',
                     'available_quantity': product.inventory_quantity
-                }), 400
+                }
+            if current_in_cart:
+                error['current_in_cart'] = current_in_cart
+            return jsonify(error), 400
+        
+        db.session.commit()
+        cart_changed(user_id)
         
-        # Get or create cart
-        cart = get_or_create_cart(user)
+        return json_response({
+            'message': 'Item added to cart successfully',
+            'cart': serialize_cart(find_cart(user_id), user_id)
+        }, 200)
         
-        # Check if item already exists in cart
-        existing_item = CartItem.query.filter_by(
-            cart_id=cart.id,
-            product_id=product.id
-        ).first()
+    except ValidationError as e:
+        return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to add item to cart'}), 500
+
+@cart_bp.route('/items:batch', methods=['POST'])
+@token_required
+def batch_cart_items():
+    """Add or set the quantities of many products at once, all or nothing"""
+    try:
+        user = get_current_user()
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        user_id = user.id
         
-        if existing_item:
-            # Check total quantity after adding
-            new_quantity = existing_item.quantity + validated_data['quantity']
+        # Validate input data
+        data = sanitize_input(request.get_json())
+        operations = cart_batch_schema.load(data)['items']
+        product_ids = list(dict.fromkeys(operation['product_id'] for operation in operations))
+        
+        # One query for every product and one for the cart's matching items
+        products = {
+            product.id: product
+            for product in Product.query.options(load_only(
+                Product.id, Product.price, Product.is_active, Product.track_inventory, Product.inventory_quantity
+            )).filter(Product.id.in_(product_ids))
+        }
+        # Nothing is written before the whole batch is validated
+        cart = Cart.query.filter_by(user_id=user_id).first()
+        items = {}
+        if cart:
+            items = {
+                item.product_id: item
+                for item in CartItem.query.filter(
+                    CartItem.cart_id == cart.id, CartItem.product_id.in_(product_ids)
+                ).with_for_update()
+            }
+        
+        # Resulting quantity of each product, operations applied in order
+        quantities = {product_id: items[product_id].quantity if product_id in items else 0 for product_id in product_ids}
+        errors = []
+        for index, operation in enumerate(operations):
+            product_id = operation['product_id']
+            if operation['action'] == 'set':
+                quantities[product_id] = operation['quantity']
+            else:
+                quantities[product_id] += operation['quantity']
             
-            if product.track_inventory and new_quantity > product.inventory_quantity:
-                return jsonify({
+            product = products.get(product_id)
+            if not product:
+                errors.append({'index': index, 'product_id': product_id, 'error': 'Product not found'})
+            elif quantities[product_id] > MAX_CART_QUANTITY:
+                errors.append({
+                    'index': index,
+                    'product_id': product_id,
+                    'error': 'Quantity exceeds the maximum',
+                    'max_quantity': MAX_CART_QUANTITY
+                })
+            elif not product.is_active and quantities[product_id] > 0:
+                errors.append({'index': index, 'product_id': product_id, 'error': 'Product is not available'})
+            elif product.track_inventory and quantities[product_id] > product.inventory_quantity:
+                errors.append({
+                    'index': index,
+                    'product_id': product_id,
                     'error': 'Insufficient inventory',
-                    'available_quantity': product.inventory_quantity,
-                    'current_in_cart': existing_item.quantity
-                }), 400
-            
-            existing_item.quantity = new_quantity
-            existing_item.updated_at = datetime.utcnow()
-            item = existing_item
-        else:
-            # Create new cart item
-            item = CartItem(
-                cart_id=cart.id,
-                product_id=product.id,
-                quantity=validated_data['quantity'],
-                price=product.price
-            )
-            db.session.add(item)
-
-        cart.updated_at = datetime.utcnow()
+                    'available_quantity': product.inventory_quantity
+                })
+        
+        if errors:
+            db.session.rollback()
+            return jsonify({'error': 'Cart not changed', 'items': errors}), 400
+        
+        # Apply every change, creating the cart if needed, in one transaction
+        now = datetime.utcnow()
+        if not cart and any(quantities.values()):
+            # A concurrent creation fails the flush and is reported as a conflict
+            cart = Cart(user_id=user_id)
+            db.session.add(cart)
+            db.session.flush()
+        for product_id, quantity in quantities.items():
+            item = items.get(product_id)
+            if item is None:
+                if quantity > 0:
+                    db.session.add(CartItem(
+                        cart_id=cart.id,
+                        product_id=product_id,
+                        quantity=quantity,
+                        price=products[product_id].price
+                    ))
+            elif quantity == 0:
+                db.session.delete(item)
+            elif quantity != item.quantity:
+                item.quantity = quantity
+                item.updated_at = now
+        
+        if cart:
+            cart.updated_at = now
         db.session.commit()
+        cart_changed(user_id)
         
-        return jsonify({
-            'message': 'Item added to cart successfully',
-            'cart': cart.to_dict()
-        }), 200
+        return json_response({
+            'message': 'Cart updated successfully',
+            'cart': serialize_cart(find_cart(user_id), user_id)
+        }, 200)
         
     except ValidationError as e:
         return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
+    except IntegrityError:
+        # Another request created the cart or added one of these products in the meantime
+        db.session.rollback()
+        return jsonify({'error': 'Cart changed concurrently, please retry'}), 409
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': 'Failed to add item to cart'}), 500
+        return jsonify({'error': 'Failed to update cart'}), 500
 
 @cart_bp.route('/update/<item_id>', methods=['PUT'])
 @token_required
@@ -124,18 +256,17 @@ def update_cart_item(item_id):
         user = get_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
+        user_id = user.id
         
         # Validate input data
         data = sanitize_input(request.get_json())
         validated_data = update_cart_item_schema.load(data)
         
-        # Get cart
-        cart = get_or_create_cart(user)
-        
         # Find cart item
-        item = CartItem.query.filter_by(id=item_id, cart_id=cart.id).first()
+        item = find_item(user_id, item_id)
         if not item:
             return jsonify({'error': 'Cart item not found'}), 404
+        cart = item.cart
         
         # If quantity is 0, remove item
         if validated_data['quantity'] == 0:
@@ -154,11 +285,12 @@ def update_cart_item(item_id):
 
         cart.updated_at = datetime.utcnow()
         db.session.commit()
+        cart_changed(user_id)
         
-        return jsonify({
+        return json_response({
             'message': 'Cart item updated successfully',
-            'cart': cart.to_dict()
-        }), 200
+            'cart': serialize_cart(find_cart(user_id), user_id)
+        }, 200)
         
     except ValidationError as e:
         return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
@@ -174,23 +306,23 @@ def remove_cart_item(item_id):
         user = get_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
-        
-        # Get cart
-        cart = get_or_create_cart(user)
+        user_id = user.id
         
         # Find cart item
-        item = CartItem.query.filter_by(id=item_id, cart_id=cart.id).first()
+        item = find_item(user_id, item_id)
         if not item:
             return jsonify({'error': 'Cart item not found'}), 404
+        cart = item.cart
         
         db.session.delete(item)
         cart.updated_at = datetime.utcnow()
         db.session.commit()
+        cart_changed(user_id)
         
-        return jsonify({
+        return json_response({
             'message': 'Item removed from cart successfully',
-            'cart': cart.to_dict()
-        }), 200
+            'cart': serialize_cart(find_cart(user_id), user_id)
+        }, 200)
         
     except Exception as e:
         db.session.rollback()
@@ -204,19 +336,22 @@ def clear_cart():
         user = get_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
+        user_id = user.id
         
         # Get cart
-        cart = get_or_create_cart(user)
+        cart = Cart.query.filter_by(user_id=user_id).first()
         
         # Delete all cart items
-        CartItem.query.filter_by(cart_id=cart.id).delete()
-        cart.updated_at = datetime.utcnow()
-        db.session.commit()
+        if cart:
+            CartItem.query.filter_by(cart_id=cart.id).delete()
+            cart.updated_at = datetime.utcnow()
+            db.session.commit()
+            cart_changed(user_id)
         
-        return jsonify({
+        return json_response({
             'message': 'Cart cleared successfully',
-            'cart': cart.to_dict()
-        }), 200
+            'cart': serialize_cart(find_cart(user_id), user_id)
+        }, 200)
         
     except Exception as e:
         db.session.rollback()
@@ -225,21 +360,26 @@ def clear_cart():
 @cart_bp.route('/count', methods=['GET'])
 @token_required
 def get_cart_count():
-    """Get cart item count"""
+    """Get cart item count (one aggregate query; nothing is loaded)"""
     try:
-        user = get_current_user()
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
-        cart = get_or_create_cart(user)
-        
-        return jsonify({
-            'count': cart.total_items
-        }), 200
+        # The token identity is enough: an unknown user simply has no cart
+        return summary_response(get_jwt_identity(), 'count', lambda summary: {
+            'count': summary['total_items']
+        })
         
     except Exception as e:
         return jsonify({'error': 'Failed to get cart count'}), 500
 
+@cart_bp.route('/summary', methods=['GET'])
+@token_required
+def get_cart_summary():
+    """Get cart item count, subtotal and weight (one aggregate query)"""
+    try:
+        return summary_response(get_jwt_identity(), 'summary', lambda summary: summary)
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to get cart summary'}), 500
+
 @cart_bp.route('/validate', methods=['POST'])
 @token_required
 def validate_cart():
@@ -248,13 +388,14 @@ def validate_cart():
         user = get_current_user()
         if not user:
             return jsonify({'error': 'User not found'}), 404
+        user_id = user.id
         
-        cart = get_or_create_cart(user)
+        cart = find_cart(user_id)
         
         issues = []
         updated_items = []
         
-        for item in cart.items:
+        for item in (cart.items if cart else []):
             item_issues = []
             
             # Check if product still exists and is active
@@ -290,13 +431,14 @@ def validate_cart():
         if updated_items:
             cart.updated_at = datetime.utcnow()
             db.session.commit()
+            cart_changed(user_id)
         
-        return jsonify({
+        return json_response({
             'valid': len(issues) == 0,
             'issues': issues,
             'updated_items': updated_items,
-            'cart': cart.to_dict()
-        }), 200
+            'cart': serialize_cart(find_cart(user_id), user_id)
+        }, 200)
         
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,57 @@
+"""
+Serving of uploaded media (product images and their variants)
+"""
+import os
+import re
+from flask import Blueprint, current_app, request, abort
+from werkzeug.security import safe_join
+from werkzeug.utils import send_from_directory
+from app.utils.media import MEDIA_TYPES, media_root
+
+media_bp = Blueprint('media', __name__)
+
+# ab/cd/<sha256>[-variant].<ext>: the bytes behind such a name never change
+CONTENT_HASHED = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(-[a-z0-9_]+)?\.[a-z]+$')
+
+@media_bp.route('/<path:filename>', methods=['GET', 'HEAD'])
+def get_media(filename):
+    """
+    Serve an uploaded file.
+
+    By default the file is sent by the app: werkzeug answers Range and
+    conditional requests, and the WSGI file wrapper lets gunicorn use
+    sendfile(). With MEDIA_SENDFILE set, only headers are sent and a proxy
+    in front (X-Sendfile for Apache/lighttpd, X-Accel-Redirect for nginx)
+    streams the file. Content-hashed names are cached for good.
+    """
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else None
+    if extension not in MEDIA_TYPES:
+        abort(404)
+
+    immutable = CONTENT_HASHED.match(filename) is not None
+    max_age = current_app.config.get('MEDIA_MAX_AGE', 31536000) if immutable else 0
+    sendfile = current_app.config.get('MEDIA_SENDFILE')
+
+    if sendfile == 'X-Accel-Redirect':
+        path = safe_join(media_root(), filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = current_app.response_class(mimetype=MEDIA_TYPES[extension])
+        prefix = current_app.config.get('MEDIA_ACCEL_PREFIX', '/protected-media').rstrip('/')
+        response.headers['X-Accel-Redirect'] = f'{prefix}/{filename}'
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    else:
+        response = send_from_directory(
+            media_root(), filename, request.environ,
+            mimetype=MEDIA_TYPES[extension],
+            max_age=max_age,
+            use_x_sendfile=sendfile == 'X-Sendfile',
+            response_class=current_app.response_class
+        )
+
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
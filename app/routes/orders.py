@@ -10,6 +10,7 @@ from app.schemas.order import (
     CreateOrderSchema, UpdateOrderStatusSchema, OrderSearchSchema
 )
 from app.utils.auth import token_required, admin_required, get_current_user, sanitize_input
+from app.utils.cache import invalidate
 
 orders_bp = Blueprint('orders', __name__)
 
@@ -45,7 +46,7 @@ def create_order():
         validated_data = create_order_schema.load(data)
         
         # Get user's cart
-        cart = Cart.query.filter_by(user_id=user.id).first()
+        cart = Cart.query.options(*Cart.eager_load_options()).filter_by(user_id=user.id).first()
         if not cart or not cart.items:
             return jsonify({'error': 'Cart is empty'}), 400
         
@@ -122,9 +123,11 @@ def create_order():
                 cart_item.product.inventory_quantity -= cart_item.quantity
         
         # Clear cart
+        stock_tags = [f'product:{item.product_id}' for item in cart.items]
         CartItem.query.filter_by(cart_id=cart.id).delete()
         
         db.session.commit()
+        invalidate('products', f'cart:{user.id}', *stock_tags)
         
         return jsonify({
             'message': 'Order created successfully',
@@ -151,7 +154,7 @@ def get_orders():
         validated_params = order_search_schema.load(args)
         
         # Build query
-        query = Order.query.filter_by(user_id=user.id)
+        query = Order.query.options(*Order.eager_load_options()).filter_by(user_id=user.id)
         
         # Apply filters
         if validated_params.get('status'):
@@ -273,7 +276,9 @@ def cancel_order(order_id):
             if product and product.track_inventory:
                 product.inventory_quantity += item.quantity
         
+        stock_tags = [f'product:{item.product_id}' for item in order.items]
         db.session.commit()
+        invalidate('products', *stock_tags)
         
         return jsonify({
             'message': 'Order cancelled successfully',
@@ -295,7 +300,7 @@ def get_all_orders():
         validated_params = order_search_schema.load(args)
         
         # Build query
-        query = Order.query
+        query = Order.query.options(*Order.eager_load_options())
         
         # Apply filters (same as user orders but without user_id filter)
         if validated_params.get('status'):
@@ -388,6 +393,7 @@ def update_order_status(order_id):
             order.admin_notes = validated_data['admin_notes']
 
         # Handle status-specific logic
+        stock_tags = []
         if order.status == OrderStatus.SHIPPED and old_status != OrderStatus.SHIPPED:
             order.shipped_at = datetime.utcnow()
         elif order.status == OrderStatus.DELIVERED and old_status != OrderStatus.DELIVERED:
@@ -398,8 +404,10 @@ def update_order_status(order_id):
                 product = Product.query.get(item.product_id)
                 if product and product.track_inventory:
                     product.inventory_quantity += item.quantity
+            stock_tags = ['products'] + [f'product:{item.product_id}' for item in order.items]
 
         db.session.commit()
+        invalidate(*stock_tags)
 
         return jsonify({
             'message': 'Order status updated successfully',
@@ -1,13 +1,29 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from marshmallow import ValidationError
-from sqlalchemy import or_, and_
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import get_input_stream
+from datetime import datetime
+from sqlalchemy import or_, and_, case, func
 from app import db
-from app.models.product import Product, Category, ProductImage
+from app.models.product import Product, Category, CategoryClosure, ProductImage, RelatedProduct
 from app.schemas.product import (
     ProductSchema, ProductUpdateSchema, CategorySchema, 
-    ProductSearchSchema, ProductImageSchema
+    ProductSearchSchema, ProductImageSchema, CategoryProductsSchema, ProductFacetSchema,
+    ProductFieldsSchema, BulkProductUpdateSchema, ProductExportSchema, ProductBatchSchema,
+    ProductSuggestSchema, ProductRelatedSchema
 )
 from app.utils.auth import token_required, admin_required, get_current_user, sanitize_input
+from app.search import (
+    get_search_backend, get_suggest_index, index_product, index_products, unindex_product, index_categories
+)
+from app.utils.cache import cached_json, make_cache_key, invalidate
+from app.utils.conditional import make_etag, conditional_json
+from app.utils.popularity import record_view
+from app.utils.fragments import product_json, evict_products
+from app.utils.bulk import IMPORT_FORMATS, IMPORT_CONTENT_TYPES, import_products, bulk_update_products
+from app.utils.export import EXPORT_FORMATS, export_lines
+from app.utils.media import UnsupportedImageError, store_upload, media_url, generate_variants
+from app.utils.pagination import InvalidCursorError, encode_cursor, decode_cursor, apply_keyset, iter_keyset
 
 products_bp = Blueprint('products', __name__)
 
@@ -17,16 +33,39 @@ product_update_schema = ProductUpdateSchema()
 category_schema = CategorySchema()
 product_search_schema = ProductSearchSchema()
 product_image_schema = ProductImageSchema()
+product_image_upload_schema = ProductImageSchema(exclude=('image_url',))
+category_products_schema = CategoryProductsSchema()
+product_facet_schema = ProductFacetSchema()
+product_fields_schema = ProductFieldsSchema()
+bulk_product_update_schema = BulkProductUpdateSchema()
+product_export_schema = ProductExportSchema()
+product_batch_schema = ProductBatchSchema()
+product_suggest_schema = ProductSuggestSchema()
+product_related_schema = ProductRelatedSchema()
+
+# Cursor value types for the keyset sort keys
+CURSOR_KINDS = {
+    'created_at': 'datetime',
+    'updated_at': 'datetime',
+    'price': 'decimal',
+    'name': None,
+    'popularity': None
+}
+
+# Rows fetched per round trip when streaming a category's products
+CATEGORY_STREAM_BATCH = 500
 
 # Category endpoints
 @products_bp.route('/categories', methods=['GET'])
 def get_categories():
     """Get all categories"""
     try:
-        categories = Category.query.filter_by(is_active=True).order_by(Category.sort_order, Category.name).all()
-        return jsonify({
-            'categories': [cat.to_dict() for cat in categories]
-        }), 200
+        def load():
+            categories = Category.query.filter_by(is_active=True).order_by(Category.sort_order, Category.name).all()
+            etag = make_etag('categories', *[(cat.id, cat.updated_at) for cat in categories])
+            return etag, lambda: {'categories': [cat.to_dict() for cat in categories]}
+        
+        return cached_json(make_cache_key('categories'), ['categories'], load)
     except Exception as e:
         return jsonify({'error': 'Failed to get categories'}), 500
 
@@ -55,6 +94,8 @@ def create_category():
         category = Category(**validated_data)
         db.session.add(category)
         db.session.commit()
+        invalidate('categories')
+        index_categories()
         
         return jsonify({
             'message': 'Category created successfully',
@@ -67,20 +108,110 @@ def create_category():
         db.session.rollback()
         return jsonify({'error': 'Failed to create category'}), 500
 
+@products_bp.route('/categories/tree', methods=['GET'])
+def get_category_tree():
+    """Get all active categories as a nested tree"""
+    try:
+        def load():
+            categories = Category.query.filter_by(is_active=True).order_by(Category.sort_order, Category.name).all()
+            etag = make_etag('category-tree', *[(cat.id, cat.parent_id, cat.updated_at) for cat in categories])
+            return etag, lambda: {'categories': Category.build_tree(categories)}
+        
+        return cached_json(make_cache_key('categories:tree'), ['categories'], load)
+    except Exception as e:
+        return jsonify({'error': 'Failed to get category tree'}), 500
+
+@products_bp.route('/categories/<category_id>/tree', methods=['GET'])
+def get_category_subtree(category_id):
+    """Get a category and all its active descendants as a nested tree"""
+    try:
+        def load():
+            categories = Category.query.join(
+                CategoryClosure, CategoryClosure.descendant_id == Category.id
+            ).filter(
+                CategoryClosure.ancestor_id == category_id,
+                Category.is_active == True
+            ).order_by(CategoryClosure.depth, Category.sort_order, Category.name).all()
+            if not categories or categories[0].id != category_id:
+                return None
+            
+            etag = make_etag('category-subtree', *[(cat.id, cat.parent_id, cat.updated_at) for cat in categories])
+            return etag, lambda: {'category': Category.build_tree(categories, root_id=category_id)[0]}
+        
+        response = cached_json(make_cache_key(f'categories:tree:{category_id}'), ['categories'], load)
+        if response is None:
+            return jsonify({'error': 'Category not found'}), 404
+        return response
+    except Exception as e:
+        return jsonify({'error': 'Failed to get category tree'}), 500
+
 @products_bp.route('/categories/<category_id>', methods=['GET'])
 def get_category(category_id):
-    """Get category by ID"""
+    """Get category by ID with a page of its active products"""
     try:
-        category = Category.query.get(category_id)
-        if not category:
-            return jsonify({'error': 'Category not found'}), 404
+        params = category_products_schema.load(request.args.to_dict())
+        params.update(category_id=category_id, is_active=True)
         
-        return jsonify({
-            'category': category.to_dict(include_products=True)
-        }), 200
+        if params.pop('stream'):
+            category = Category.query.filter_by(id=category_id).first()
+            if not category:
+                return jsonify({'error': 'Category not found'}), 404
+            return stream_category(category, params)
+        
+        cache_key = make_cache_key(f'category:{category_id}', params)
+        
+        def load():
+            category = Category.query.filter_by(id=category_id).first()
+            if not category:
+                return None
+            
+            products_etag, serialize_products = list_products(params, cache_key)
+            
+            def serialize():
+                listing = serialize_products()
+                data = category.to_dict()
+                data['products'] = listing['products']
+                return {'category': data, 'pagination': listing['pagination']}
+            
+            return make_etag(products_etag, category.updated_at), serialize
+        
+        response = cached_json(cache_key, ['products', 'categories', f'category:{category_id}'], load)
+        if response is None:
+            return jsonify({'error': 'Category not found'}), 404
+        return response
+    except InvalidCursorError as e:
+        return jsonify({'error': str(e)}), 400
+    except ValidationError as e:
+        return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
     except Exception as e:
         return jsonify({'error': 'Failed to get category'}), 500
 
+def stream_category(category, params):
+    """
+    Stream a category with all its matching products as one JSON document.
+
+    Products are read in keyset pages of CATEGORY_STREAM_BATCH and written
+    out as they are serialized, so memory stays bounded by the batch size.
+    """
+    query, _ = build_product_query(params)
+    fields = Product.resolve_fields(params.get('fieldset'), params.get('include'), default='card')
+    sort_by, order_field = product_order_field(params.get('sort_by'))
+    query = query.options(*Product.load_options(fields, order_field))
+    
+    # Open the category object and splice in the products array
+    head = current_app.json.dumps({'category': category.to_dict()})
+    
+    def generate():
+        yield head[:-2] + ',"products":['
+        separator = ''
+        products = iter_keyset(query, Product.id, order_field, params['sort_order'], CATEGORY_STREAM_BATCH)
+        for product in products:
+            yield separator + product_json(product, fields)
+            separator = ','
+        yield ']}}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 @products_bp.route('/categories/<category_id>', methods=['PUT'])
 @admin_required
 def update_category(category_id):
@@ -111,11 +242,25 @@ def update_category(category_id):
             if existing:
                 return jsonify({'error': 'Category name already exists'}), 400
         
+        # Validate the new parent; a category cannot move under its own subtree
+        if validated_data.get('parent_id'):
+            parent = Category.query.get(validated_data['parent_id'])
+            if not parent:
+                return jsonify({'error': 'Parent category not found'}), 404
+            
+            in_subtree = CategoryClosure.query.filter_by(
+                ancestor_id=category_id, descendant_id=parent.id
+            ).first()
+            if in_subtree:
+                return jsonify({'error': 'Category cannot be moved under itself or its subcategories'}), 400
+        
         # Update category fields
         for field, value in validated_data.items():
             setattr(category, field, value)
         
         db.session.commit()
+        invalidate('categories', 'products', f'category:{category_id}')
+        index_categories()
         
         return jsonify({
             'message': 'Category updated successfully',
@@ -147,6 +292,8 @@ def delete_category(category_id):
         
         db.session.delete(category)
         db.session.commit()
+        invalidate('categories', f'category:{category_id}')
+        index_categories()
         
         return jsonify({
             'message': 'Category deleted successfully'
@@ -157,6 +304,157 @@ def delete_category(category_id):
         return jsonify({'error': 'Failed to delete category'}), 500
 
 # Product endpoints
+def build_product_query(params):
+    """Build the filtered (and searched) product query for validated search params"""
+    query = Product.query
+    
+    # Apply filters
+    if params.get('is_active') is not None:
+        query = query.filter(Product.is_active == params['is_active'])
+    
+    if params.get('category_id'):
+        if params.get('include_subcategories'):
+            query = query.join(
+                CategoryClosure, CategoryClosure.descendant_id == Product.category_id
+            ).filter(CategoryClosure.ancestor_id == params['category_id'])
+        else:
+            query = query.filter(Product.category_id == params['category_id'])
+    
+    if params.get('is_featured') is not None:
+        query = query.filter(Product.is_featured == params['is_featured'])
+    
+    if params.get('min_price') is not None:
+        query = query.filter(Product.price >= params['min_price'])
+    
+    if params.get('max_price') is not None:
+        query = query.filter(Product.price <= params['max_price'])
+    
+    if params.get('in_stock'):
+        query = query.filter(
+            or_(
+                Product.track_inventory == False,
+                Product.inventory_quantity > 0
+            )
+        )
+    
+    # Apply search
+    relevance = None
+    if params.get('q'):
+        query, relevance = get_search_backend().apply(query, params['q'])
+    
+    return query, relevance
+
+def product_version(product, fields=None):
+    """Row versions a serialized product depends on (product, and category if embedded)"""
+    if fields is not None and 'category' not in fields:
+        return (product.id, product.updated_at)
+    return (
+        product.id,
+        product.updated_at,
+        product.category.updated_at if product.category else None
+    )
+
+def product_order_field(sort_by):
+    """Map a sort_by value to (cursor sort key, column); created_at is the fallback"""
+    if sort_by == 'name':
+        return sort_by, Product.name
+    if sort_by == 'price':
+        return sort_by, Product.price
+    if sort_by == 'updated_at':
+        return sort_by, Product.updated_at
+    if sort_by == 'popularity':
+        return sort_by, Product.popularity_score
+    # created_at or relevance without a query
+    return 'created_at', Product.created_at
+
+def list_products(params, etag_key=''):
+    """
+    Run a product listing for validated search params.
+
+    Returns ``(etag, serialize)``: the ETag is derived from the versions of
+    the rows on the page, so a 304 can be sent before any serialization.
+    """
+    query, relevance = build_product_query(params)
+    fields = Product.resolve_fields(params.get('fieldset'), params.get('include'), default='card')
+    
+    # Apply sorting
+    sort_by = params.get('sort_by', 'created_at')
+    sort_order = params.get('sort_order', 'desc')
+    
+    if sort_by == 'relevance' and relevance is not None:
+        # Best matches first; ties broken by id for a stable order
+        if params.get('cursor') or params['pagination'] == 'cursor':
+            raise InvalidCursorError('Cursor pagination is not available for relevance sort')
+        sort_order = 'desc'
+        order_field = relevance
+    else:
+        sort_by, order_field = product_order_field(sort_by)
+    
+    # Read only the columns the fieldset needs, plus the ETag and sort keys
+    extra_columns = [Product.updated_at]
+    if order_field is not relevance:
+        extra_columns.append(order_field)
+    query = query.options(*Product.load_options(fields, *extra_columns))
+    
+    per_page = params.get('per_page', 20)
+    
+    # Keyset pagination: seek past the cursor row, no COUNT or OFFSET
+    if params.get('cursor') or params['pagination'] == 'cursor':
+        after = None
+        if params.get('cursor'):
+            after = decode_cursor(
+                params['cursor'], sort_by, sort_order,
+                CURSOR_KINDS.get(sort_by)
+            )
+        
+        query = apply_keyset(query, order_field, Product.id, sort_order, after)
+        products = query.limit(per_page + 1).all()
+        has_next = len(products) > per_page
+        products = products[:per_page]
+        
+        next_cursor = None
+        if has_next:
+            last = products[-1]
+            next_cursor = encode_cursor(sort_by, sort_order, getattr(last, order_field.key), last.id)
+        
+        etag = make_etag(etag_key, next_cursor, *[product_version(product, fields) for product in products])
+        return etag, lambda: {
+            'products': [product_json(product, fields) for product in products],
+            'pagination': {
+                'per_page': per_page,
+                'has_next': has_next,
+                'next_cursor': next_cursor
+            }
+        }
+    
+    # The id tie-breaker follows the sort direction so (…, sort key, id) indexes return pages in order
+    query = apply_keyset(query, order_field, Product.id, sort_order)
+    
+    # Apply pagination
+    page = params.get('page', 1)
+    
+    paginated = query.paginate(
+        page=page,
+        per_page=per_page,
+        error_out=False
+    )
+    
+    etag = make_etag(
+        etag_key, paginated.total,
+        *[product_version(product, fields) for product in paginated.items]
+    )
+    return etag, lambda: {
+        'products': [product_json(product, fields) for product in paginated.items],
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total': paginated.total,
+            'pages': paginated.pages,
+            'has_next': paginated.has_next,
+            'has_prev': paginated.has_prev
+        }
+    }
+
 @products_bp.route('', methods=['GET'])
 def get_products():
     """Get products with search and filtering"""
@@ -165,89 +463,96 @@ def get_products():
         args = request.args.to_dict()
         validated_params = product_search_schema.load(args)
         
-        # Build query
-        query = Product.query
+        cache_key = make_cache_key('products', validated_params)
+        return cached_json(cache_key, ['products'], lambda: list_products(validated_params, cache_key))
         
-        # Apply filters
-        if validated_params.get('is_active') is not None:
-            query = query.filter(Product.is_active == validated_params['is_active'])
-        
-        if validated_params.get('category_id'):
-            query = query.filter(Product.category_id == validated_params['category_id'])
-        
-        if validated_params.get('is_featured') is not None:
-            query = query.filter(Product.is_featured == validated_params['is_featured'])
-        
-        if validated_params.get('min_price') is not None:
-            query = query.filter(Product.price >= validated_params['min_price'])
-        
-        if validated_params.get('max_price') is not None:
-            query = query.filter(Product.price <= validated_params['max_price'])
-        
-        if validated_params.get('in_stock'):
-            query = query.filter(
-                or_(
-                    Product.track_inventory == False,
-                    Product.inventory_quantity > 0
-                )
-            )
-        
-        # Apply search
-        if validated_params.get('q'):
-            search_term = f"%{validated_params['q']}%"
-            query = query.filter(
-                or_(
-                    Product.name.ilike(search_term),
-                    Product.description.ilike(search_term),
-                    Product.short_description.ilike(search_term),
-                    Product.sku.ilike(search_term)
-                )
-            )
-        
-        # Apply sorting
-        sort_by = validated_params.get('sort_by', 'created_at')
-        sort_order = validated_params.get('sort_order', 'desc')
-        
-        if sort_by == 'name':
-            order_field = Product.name
-        elif sort_by == 'price':
-            order_field = Product.price
-        elif sort_by == 'updated_at':
-            order_field = Product.updated_at
-        else:  # created_at or popularity
-            order_field = Product.created_at
-        
-        if sort_order == 'desc':
-            query = query.order_by(order_field.desc())
-        else:
-            query = query.order_by(order_field.asc())
+    except InvalidCursorError as e:
+        return jsonify({'error': str(e)}), 400
+    except ValidationError as e:
+        return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
+    except Exception as e:
+        return jsonify({'error': 'Failed to get products'}), 500
+
+def compute_facets(params):
+    """
+    Count the products matching the search params per requested facet.
+
+    Every facet comes out of one grouped aggregate over the filtered query:
+    rows are grouped by category (when requested) and the other facets are
+    conditional sums, added up across the groups.
+    """
+    query, _ = build_product_query(params)
+    requested = params['facets']
+    bounds = current_app.config.get('FACET_PRICE_BUCKETS', [])
+    
+    in_stock = or_(Product.track_inventory == False, Product.inventory_quantity > 0)
+    sums = [func.count(Product.id)]
+    if 'in_stock' in requested:
+        sums.append(func.sum(case((in_stock, 1), else_=0)))
+    if 'featured' in requested:
+        sums.append(func.sum(case((Product.is_featured == True, 1), else_=0)))
+    if 'price' in requested:
+        lower = 0
+        for upper in bounds:
+            sums.append(func.sum(case((and_(Product.price >= lower, Product.price < upper), 1), else_=0)))
+            lower = upper
+        sums.append(func.sum(case((Product.price >= lower, 1), else_=0)))
+    
+    if 'category' in requested:
+        rows = query.outerjoin(Category, Category.id == Product.category_id).with_entities(
+            Product.category_id, Category.name, *sums
+        ).group_by(Product.category_id, Category.name).all()
+        groups = [tuple(row[2:]) for row in rows]
+    else:
+        rows = []
+        groups = [tuple(query.with_entities(*sums).one())]
+    
+    # Add the per-group sums up; SUM over no rows is NULL
+    totals = [sum(group[i] or 0 for group in groups) for i in range(len(sums))]
+    
+    facets = {}
+    position = 1
+    if 'category' in requested:
+        facets['category'] = sorted(
+            ({'category_id': row[0], 'name': row[1], 'count': row[2]} for row in rows),
+            key=lambda item: (-item['count'], item['name'] or '')
+        )
+    if 'in_stock' in requested:
+        facets['in_stock'] = {'in_stock': totals[position], 'out_of_stock': totals[0] - totals[position]}
+        position += 1
+    if 'featured' in requested:
+        facets['featured'] = {'featured': totals[position], 'not_featured': totals[0] - totals[position]}
+        position += 1
+    if 'price' in requested:
+        edges = [0] + list(bounds) + [None]
+        facets['price'] = [
+            {'min': edges[i], 'max': edges[i + 1], 'count': totals[position + i]}
+            for i in range(len(edges) - 1)
+        ]
+    
+    return {'total': totals[0], 'facets': facets}
+
+@products_bp.route('/facets', methods=['GET'])
+def get_product_facets():
+    """Get facet counts for the products matching the search filters"""
+    try:
+        args = request.args.to_dict()
+        validated_params = product_facet_schema.load(args)
         
-        # Apply pagination
-        page = validated_params.get('page', 1)
-        per_page = validated_params.get('per_page', 20)
+        cache_key = make_cache_key('facets', validated_params)
         
-        paginated = query.paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False
-        )
+        def load():
+            payload = compute_facets(validated_params)
+            return make_etag(cache_key, payload), lambda: payload
         
-        return jsonify({
-            'products': [product.to_dict() for product in paginated.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': paginated.total,
-                'pages': paginated.pages,
-                'has_next': paginated.has_next,
-                'has_prev': paginated.has_prev
-            }
-        }), 200
+        if current_app.config.get('FACET_CACHE_ENABLED', True):
+            return cached_json(cache_key, ['products', 'categories'], load)
+        return conditional_json(*load())
         
     except ValidationError as e:
         return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
     except Exception as e:
-        return jsonify({'error': 'Failed to get products'}), 500
+        return jsonify({'error': 'Failed to get facets'}), 500
 
 @products_bp.route('', methods=['POST'])
 @admin_required
@@ -284,6 +589,8 @@ def create_product():
             db.session.add(image)
         
         db.session.commit()
+        index_product(product)
+        invalidate('products')
         
         return jsonify({
             'message': 'Product created successfully',
@@ -296,20 +603,212 @@ def create_product():
         db.session.rollback()
         return jsonify({'error': 'Failed to create product'}), 500
 
+@products_bp.route('/import', methods=['POST'])
+@admin_required
+def bulk_import_products():
+    """Create or update products from a streamed CSV or JSONL body (admin only)"""
+    fmt = request.args.get('format') or IMPORT_CONTENT_TYPES.get(request.mimetype)
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': 'Send text/csv or application/x-ndjson, or set format=csv|jsonl'}), 400
+    
+    try:
+        # Read the body as it arrives, with its own (larger) size limit
+        stream = get_input_stream(
+            request.environ,
+            max_content_length=current_app.config.get('IMPORT_MAX_CONTENT_LENGTH')
+        )
+        report = import_products(
+            stream, fmt,
+            chunk_size=current_app.config.get('IMPORT_CHUNK_SIZE', 500),
+            max_errors=current_app.config.get('IMPORT_MAX_ERRORS', 1000)
+        )
+        
+        if report.created or report.updated:
+            index_products(report.product_ids)
+            invalidate('products')
+            evict_products(*report.product_ids)
+        
+        return jsonify({
+            'message': 'Import finished',
+            **report.to_dict()
+        }), 200
+        
+    except RequestEntityTooLarge:
+        db.session.rollback()
+        invalidate('products')
+        return jsonify({'error': 'Import body too large; rows before the limit were imported'}), 413
+    except UnicodeDecodeError:
+        db.session.rollback()
+        invalidate('products')
+        return jsonify({'error': 'Import body must be UTF-8; rows before the invalid bytes were imported'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to import products'}), 500
+
+@products_bp.route('/bulk-update', methods=['POST'])
+@admin_required
+def bulk_update():
+    """Update price/inventory of many products by SKU in one transaction (admin only)"""
+    try:
+        data = sanitize_input(request.get_json())
+        validated_data = bulk_product_update_schema.load(data)
+        
+        updated_ids, not_found = bulk_update_products(
+            validated_data['items'],
+            chunk_size=current_app.config.get('BULK_UPDATE_CHUNK_SIZE', 1000)
+        )
+        db.session.commit()
+        
+        if updated_ids:
+            invalidate('products', *[f'product:{product_id}' for product_id in updated_ids])
+            evict_products(*updated_ids)
+        
+        return jsonify({
+            'message': 'Bulk update applied',
+            'updated': len(updated_ids),
+            'not_found': not_found
+        }), 200
+        
+    except ValidationError as e:
+        return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to apply bulk update'}), 500
+
+@products_bp.route('/export', methods=['GET'])
+@admin_required
+def export_products():
+    """Stream the (filtered) catalog as NDJSON or CSV (admin only)"""
+    try:
+        params = product_export_schema.load(request.args.to_dict())
+    except ValidationError as e:
+        return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
+    
+    fmt = params['export_format']
+    # CSV rows default to the columns without nested objects
+    fields = Product.resolve_fields(
+        params.get('fieldset'), params.get('include'),
+        default='full' if fmt == 'ndjson' else 'flat'
+    )
+    
+    query, _ = build_product_query(params)
+    # Paged by primary key, which keeps the dump stable without a sort step
+    query = query.options(*Product.load_options(fields))
+    
+    filename = f"catalog-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(export_lines(query, fields, fmt, current_app.config.get('EXPORT_BATCH_SIZE', 1000))),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@products_bp.route('/suggest', methods=['GET'])
+def suggest_products():
+    """Typeahead suggestions for a prefix: popular products and matching categories"""
+    try:
+        params = product_suggest_schema.load(request.args.to_dict())
+        products, categories = get_suggest_index().suggest(params['prefix'], params['limit'])
+        return jsonify({'products': products, 'categories': categories}), 200
+    except ValidationError as e:
+        return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
+    except Exception as e:
+        return jsonify({'error': 'Failed to get suggestions'}), 500
+
+@products_bp.route('/batch', methods=['GET'])
+def get_products_batch():
+    """Get many products by ids, SKUs or slugs in request order, with the keys not found"""
+    try:
+        params = product_batch_schema.load(request.args.to_dict())
+        fields = Product.resolve_fields(params.get('fieldset'), params.get('include'))
+        lookup, values = params['lookup'], params['values']
+        column = getattr(Product, lookup)
+
+        def load():
+            # One IN query; images and category come from select-in loads
+            products = Product.query.options(
+                *Product.load_options(fields, Product.updated_at, column)
+            ).filter(column.in_(values)).all()
+            by_key = {getattr(product, lookup): product for product in products}
+            found = [by_key[value] for value in values if value in by_key]
+            missing = [value for value in values if value not in by_key]
+            etag = make_etag('product-batch', fields, missing, *[product_version(product, fields) for product in found])
+            return etag, lambda: {
+                'products': [product_json(product, fields) for product in found],
+                'missing': missing
+            }
+
+        return cached_json(make_cache_key('products:batch', params), ['products'], load)
+    except ValidationError as e:
+        return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
+    except Exception as e:
+        return jsonify({'error': 'Failed to get products'}), 500
+
 @products_bp.route('/<product_id>', methods=['GET'])
 def get_product(product_id):
     """Get product by ID"""
     try:
-        product = Product.query.get(product_id)
-        if not product:
+        params = product_fields_schema.load(request.args.to_dict())
+        fields = Product.resolve_fields(params.get('fieldset'), params.get('include'))
+        loaded = {}
+        
+        def load():
+            product = Product.query.options(
+                *Product.load_options(fields, Product.updated_at, Product.category_id)
+            ).filter_by(id=product_id).first()
+            if not product:
+                return None
+            loaded['category_id'] = product.category_id
+            etag = make_etag('product', fields, product_version(product, fields))
+            return etag, lambda: {'product': product.to_dict(fields=fields)}
+        
+        response = cached_json(
+            make_cache_key(f'product:{product_id}', params),
+            lambda payload: [f'product:{product_id}', f"category:{loaded['category_id']}"],
+            load
+        )
+        if response is None:
             return jsonify({'error': 'Product not found'}), 404
         
-        return jsonify({
-            'product': product.to_dict()
-        }), 200
+        record_view(product_id)
+        return response
+    except ValidationError as e:
+        return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
     except Exception as e:
         return jsonify({'error': 'Failed to get product'}), 500
 
+@products_bp.route('/<product_id>/related', methods=['GET'])
+def get_related_products(product_id):
+    """Get products frequently bought together with a product (precomputed, best first)"""
+    try:
+        params = product_related_schema.load(request.args.to_dict())
+        fields = Product.resolve_fields(params.get('fieldset'), params.get('include'), default='card')
+        
+        def load():
+            # One range read of the related_products primary key, joined to the neighbours
+            related = Product.query.options(
+                *Product.load_options(fields, Product.updated_at)
+            ).join(
+                RelatedProduct, RelatedProduct.related_product_id == Product.id
+            ).filter(
+                RelatedProduct.product_id == product_id,
+                Product.is_active == True
+            ).order_by(RelatedProduct.position).limit(params['limit']).all()
+            if not related and not db.session.query(Product.query.filter_by(id=product_id).exists()).scalar():
+                return None
+            etag = make_etag('product-related', fields, *[product_version(product, fields) for product in related])
+            return etag, lambda: {'products': [product_json(product, fields) for product in related]}
+        
+        response = cached_json(
+            make_cache_key(f'product:{product_id}:related', params), ['products', 'related'], load
+        )
+        if response is None:
+            return jsonify({'error': 'Product not found'}), 404
+        return response
+    except ValidationError as e:
+        return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
+    except Exception as e:
+        return jsonify({'error': 'Failed to get related products'}), 500
+
 @products_bp.route('/<product_id>', methods=['PUT'])
 @admin_required
 def update_product(product_id):
@@ -352,6 +851,9 @@ def update_product(product_id):
                 setattr(product, field, value)
         
         db.session.commit()
+        index_product(product)
+        invalidate('products', f'product:{product_id}')
+        evict_products(product_id)
         
         return jsonify({
             'message': 'Product updated successfully',
@@ -375,6 +877,9 @@ def delete_product(product_id):
 
         db.session.delete(product)
         db.session.commit()
+        unindex_product(product_id)
+        invalidate('products', f'product:{product_id}')
+        evict_products(product_id)
 
         return jsonify({
             'message': 'Product deleted successfully'
@@ -385,6 +890,12 @@ def delete_product(product_id):
         return jsonify({'error': 'Failed to delete product'}), 500
 
 # Product image endpoints
+def touch_product(product_id):
+    """Bump a product's updated_at so ETags and caches see image changes"""
+    Product.query.filter_by(id=product_id).update(
+        {'updated_at': datetime.utcnow()}, synchronize_session=False
+    )
+
 @products_bp.route('/<product_id>/images', methods=['POST'])
 @admin_required
 def add_product_image(product_id):
@@ -394,8 +905,18 @@ def add_product_image(product_id):
         if not product:
             return jsonify({'error': 'Product not found'}), 404
 
-        data = sanitize_input(request.get_json())
-        validated_data = product_image_schema.load(data)
+        upload = None
+        if request.mimetype == 'multipart/form-data':
+            # Uploaded file: stored by content hash, variants rendered in the background
+            upload = request.files.get('file')
+            if upload is None:
+                return jsonify({'error': 'No file uploaded'}), 400
+            validated_data = product_image_upload_schema.load(sanitize_input(request.form.to_dict()))
+            content_hash, relative_path = store_upload(upload.stream)
+            validated_data.update(image_url=media_url(relative_path), content_hash=content_hash)
+        else:
+            data = sanitize_input(request.get_json())
+            validated_data = product_image_schema.load(data)
 
         # If this is set as primary, unset other primary images
         if validated_data.get('is_primary', False):
@@ -403,13 +924,21 @@ def add_product_image(product_id):
 
         image = ProductImage(product_id=product_id, **validated_data)
         db.session.add(image)
+        product.updated_at = datetime.utcnow()  # Images are part of the product's version
         db.session.commit()
+        invalidate('products', f'product:{product_id}')
+        evict_products(product_id)
+
+        if upload is not None:
+            generate_variants(image.id, content_hash, relative_path)
 
         return jsonify({
             'message': 'Image added successfully',
             'image': image.to_dict()
         }), 201
 
+    except UnsupportedImageError as e:
+        return jsonify({'error': str(e)}), 400
     except ValidationError as e:
         return jsonify({'error': 'Validation failed', 'details': e.messages}), 400
     except Exception as e:
@@ -438,7 +967,10 @@ def update_product_image(product_id, image_id):
         for field, value in validated_data.items():
             setattr(image, field, value)
 
+        touch_product(product_id)
         db.session.commit()
+        invalidate('products', f'product:{product_id}')
+        evict_products(product_id)
 
         return jsonify({
             'message': 'Image updated successfully',
@@ -461,7 +993,10 @@ def delete_product_image(product_id, image_id):
             return jsonify({'error': 'Image not found'}), 404
 
         db.session.delete(image)
+        touch_product(product_id)
         db.session.commit()
+        invalidate('products', f'product:{product_id}')
+        evict_products(product_id)
 
         return jsonify({
             'message': 'Image deleted successfully'
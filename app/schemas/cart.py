@@ -1,13 +1,35 @@
-from marshmallow import Schema, fields, validate, validates, ValidationError
+from marshmallow import Schema, fields, validate, validates, validates_schema, ValidationError
+
+# Largest quantity of one product in a cart
+MAX_CART_QUANTITY = 999
 
 class AddToCartSchema(Schema):
     """Schema for adding item to cart"""
     product_id = fields.Str(required=True, validate=validate.Length(min=36, max=36))
-    quantity = fields.Int(required=True, validate=validate.Range(min=1, max=999))
+    quantity = fields.Int(required=True, validate=validate.Range(min=1, max=MAX_CART_QUANTITY))
 
 class UpdateCartItemSchema(Schema):
     """Schema for updating cart item quantity"""
-    quantity = fields.Int(required=True, validate=validate.Range(min=0, max=999))
+    quantity = fields.Int(required=True, validate=validate.Range(min=0, max=MAX_CART_QUANTITY))
+
+class CartBatchOperationSchema(Schema):
+    """Schema for one operation of a batch cart change"""
+    product_id = fields.Str(required=True, validate=validate.Length(min=36, max=36))
+    quantity = fields.Int(required=True, validate=validate.Range(min=0, max=MAX_CART_QUANTITY))
+    action = fields.Str(missing='add', validate=validate.OneOf(['add', 'set']))  # Add to, or replace, the quantity in the cart
+    
+    @validates_schema
+    def validate_quantity(self, data, **kwargs):
+        if data.get('action', 'add') == 'add' and data.get('quantity') == 0:
+            raise ValidationError('Quantity to add must be at least 1', 'quantity')
+
+class CartBatchSchema(Schema):
+    """Schema for a batch cart change, applied all or nothing"""
+    items = fields.List(
+        fields.Nested(CartBatchOperationSchema),
+        required=True,
+        validate=validate.Length(min=1, max=100)
+    )
 
 class CartItemSchema(Schema):
     """Schema for cart item response"""
@@ -1,4 +1,5 @@
-from marshmallow import Schema, fields, validate, validates, ValidationError
+from marshmallow import Schema, fields, validate, validates, validates_schema, post_load, ValidationError
+from app.models.product import PRODUCT_FIELDS, PRODUCT_PROJECTIONS
 
 class CategorySchema(Schema):
     """Schema for category"""
@@ -64,21 +65,43 @@ class ProductUpdateSchema(ProductSchema):
     price = fields.Decimal(places=2, validate=validate.Range(min=0))
     category_id = fields.Str(validate=validate.Length(min=36, max=36))
 
-class ProductSearchSchema(Schema):
+class ProductFieldsSchema(Schema):
+    """Schema for sparse product fieldsets (?fields= and ?include=)"""
+    fieldset = fields.Str(data_key='fields', allow_none=True, validate=validate.Length(max=500))  # Keys or a projection
+    include = fields.Str(allow_none=True, validate=validate.Length(max=500))  # Keys added to the fieldset
+    
+    @validates('fieldset')
+    def validate_fieldset(self, value):
+        self._check_fields(value, PRODUCT_PROJECTIONS)
+    
+    @validates('include')
+    def validate_include(self, value):
+        self._check_fields(value, {})
+    
+    @staticmethod
+    def _check_fields(value, projections):
+        unknown = [name for name in value.split(',') if name not in PRODUCT_FIELDS and name not in projections]
+        if unknown:
+            raise ValidationError(f"Unknown fields: {', '.join(unknown)}")
+
+class ProductSearchSchema(ProductFieldsSchema):
     """Schema for product search parameters"""
     q = fields.Str(allow_none=True, validate=validate.Length(max=200))  # Search query
     category_id = fields.Str(allow_none=True, validate=validate.Length(min=36, max=36))
+    include_subcategories = fields.Bool(missing=False)  # Match category_id and its descendants
     min_price = fields.Decimal(allow_none=True, places=2, validate=validate.Range(min=0))
     max_price = fields.Decimal(allow_none=True, places=2, validate=validate.Range(min=0))
     is_featured = fields.Bool(allow_none=True)
     is_active = fields.Bool(missing=True)
     in_stock = fields.Bool(allow_none=True)
     sort_by = fields.Str(allow_none=True, validate=validate.OneOf([
-        'name', 'price', 'created_at', 'updated_at', 'popularity'
+        'name', 'price', 'created_at', 'updated_at', 'popularity', 'relevance'
     ]))
     sort_order = fields.Str(missing='asc', validate=validate.OneOf(['asc', 'desc']))
     page = fields.Int(missing=1, validate=validate.Range(min=1))
     per_page = fields.Int(missing=20, validate=validate.Range(min=1, max=100))
+    pagination = fields.Str(missing='offset', validate=validate.OneOf(['offset', 'cursor']))
+    cursor = fields.Str(allow_none=True, validate=validate.Length(max=500))  # Opaque keyset cursor
     
     @validates('max_price')
     def validate_price_range(self, value):
@@ -86,3 +109,100 @@ class ProductSearchSchema(Schema):
             min_price = self.context.get('min_price')
             if min_price is not None and value < min_price:
                 raise ValidationError('Max price must be greater than min price')
+
+class ProductFacetSchema(ProductSearchSchema):
+    """Schema for facet counts: the search filters plus the facets to compute"""
+    FACETS = ('category', 'price', 'in_stock', 'featured')
+    
+    facets = fields.Str(missing=','.join(FACETS))  # Comma-separated facet names
+    
+    class Meta:
+        exclude = ('sort_by', 'sort_order', 'page', 'per_page', 'pagination', 'cursor', 'fieldset', 'include')
+    
+    @validates('facets')
+    def validate_facets(self, value):
+        unknown = [name for name in value.split(',') if name not in self.FACETS]
+        if unknown:
+            raise ValidationError(f"Unknown facets: {', '.join(unknown)}")
+    
+    @post_load
+    def normalize_facets(self, data, **kwargs):
+        data['facets'] = [name for name in self.FACETS if name in data['facets'].split(',')]
+        return data
+
+class ProductExportSchema(ProductSearchSchema):
+    """Schema for catalog export: the search filters plus the output format"""
+    export_format = fields.Str(data_key='format', missing='ndjson', validate=validate.OneOf(['ndjson', 'csv']))
+    
+    class Meta:
+        exclude = ('sort_by', 'sort_order', 'page', 'per_page', 'pagination', 'cursor')
+
+class ProductSuggestSchema(Schema):
+    """Schema for typeahead suggestions"""
+    prefix = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+    limit = fields.Int(missing=8, validate=validate.Range(min=1, max=20))  # MEMO_SIZE of the suggest index
+
+class ProductRelatedSchema(ProductFieldsSchema):
+    """Schema for a product's "frequently bought together" neighbours"""
+    limit = fields.Int(missing=8, validate=validate.Range(min=1, max=50))
+
+class ProductBatchSchema(ProductFieldsSchema):
+    """Schema for a batch lookup by one of ?ids=, ?skus= or ?slugs= (comma-separated)"""
+    LOOKUPS = {'ids': 'id', 'skus': 'sku', 'slugs': 'slug'}
+    MAX_KEYS = 250
+
+    ids = fields.Str()
+    skus = fields.Str()
+    slugs = fields.Str()
+
+    @validates_schema
+    def validate_lookup(self, data, **kwargs):
+        given = [name for name in self.LOOKUPS if data.get(name)]
+        if len(given) != 1:
+            raise ValidationError('Exactly one of ids, skus or slugs is required')
+        values = {value for value in data[given[0]].split(',') if value}
+        if not values:
+            raise ValidationError(f'No {given[0]} given', given[0])
+        if len(values) > self.MAX_KEYS:
+            raise ValidationError(f'At most {self.MAX_KEYS} {given[0]} per request', given[0])
+
+    @post_load
+    def normalize_lookup(self, data, **kwargs):
+        name = next(name for name in self.LOOKUPS if data.get(name))
+        # Request order, duplicates and empty items dropped
+        data['lookup'] = self.LOOKUPS[name]
+        data['values'] = list(dict.fromkeys(value for value in data.pop(name).split(',') if value))
+        return data
+
+class CategoryProductsSchema(ProductFieldsSchema):
+    """Schema for the product listing of the category detail endpoint"""
+    include_subcategories = fields.Bool(missing=False)
+    sort_by = fields.Str(allow_none=True, validate=validate.OneOf([
+        'name', 'price', 'created_at', 'updated_at'
+    ]))
+    sort_order = fields.Str(missing='asc', validate=validate.OneOf(['asc', 'desc']))
+    page = fields.Int(missing=1, validate=validate.Range(min=1))
+    per_page = fields.Int(missing=20, validate=validate.Range(min=1, max=100))
+    pagination = fields.Str(missing='offset', validate=validate.OneOf(['offset', 'cursor']))
+    cursor = fields.Str(allow_none=True, validate=validate.Length(max=500))  # Opaque keyset cursor
+    stream = fields.Bool(missing=False)  # Stream every active product as one JSON document
+
+class BulkProductUpdateItemSchema(Schema):
+    """Schema for one row of a bulk price/inventory update, keyed by SKU"""
+    sku = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+    price = fields.Decimal(places=2, validate=validate.Range(min=0))
+    compare_price = fields.Decimal(allow_none=True, places=2, validate=validate.Range(min=0))
+    inventory_quantity = fields.Int(validate=validate.Range(min=0))
+    
+    @validates_schema
+    def validate_has_changes(self, data, **kwargs):
+        if not any(key in data for key in ('price', 'compare_price', 'inventory_quantity')):
+            raise ValidationError('At least one of price, compare_price or inventory_quantity is required')
+
+class BulkProductUpdateSchema(Schema):
+    """Schema for a bulk price/inventory update"""
+    items = fields.List(
+        fields.Nested(BulkProductUpdateItemSchema),
+        required=True,
+        validate=validate.Length(min=1, max=10000)
+    )
@@ -0,0 +1,119 @@
+"""
+Pluggable catalog search.
+
+The backend is chosen with the ``SEARCH_BACKEND`` config value: ``auto``
+(default) picks the native full-text engine of the configured database,
+``memory`` uses the in-process BM25 inverted index, ``like`` forces the
+portable ILIKE scan. Typeahead suggestions always use the in-process prefix
+index, whatever the backend.
+"""
+import click
+from flask import current_app
+from app import db
+from app.models.product import has_search_index, rebuild_search_index
+from app.search.fulltext import (
+    LikeSearchBackend, MySQLFullTextBackend, PostgresFullTextBackend, SQLiteFTS5Backend
+)
+from app.search.inverted_index import (
+    InvertedIndex, InvertedIndexBackend, product_fields, rebuild_index, reindex_rows
+)
+from app.search.suggest import SuggestIndex, active_categories, refresh_suggest_index, reindex_suggestions
+
+SEARCH_BACKENDS = {
+    LikeSearchBackend.name: LikeSearchBackend,
+    MySQLFullTextBackend.name: MySQLFullTextBackend,
+    PostgresFullTextBackend.name: PostgresFullTextBackend,
+    SQLiteFTS5Backend.name: SQLiteFTS5Backend,
+    InvertedIndexBackend.name: InvertedIndexBackend,
+}
+
+def init_search(app):
+    """Create the suggest index and the CLI command, and create (and warm) the search index when the memory backend is used"""
+    # Built on the first suggest request
+    app.extensions['suggest_index'] = SuggestIndex()
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Re-read every product into the native full-text index (SQLite FTS5, e.g. after VACUUM)"""
+        with db.engine.begin() as connection:
+            if not has_search_index(connection):
+                raise click.ClickException('No full-text index, run init_db.py to create it')
+            rebuild_search_index(connection)
+        print('Search index rebuilt')
+
+    if app.config.get('SEARCH_BACKEND') != InvertedIndexBackend.name:
+        return
+
+    index = InvertedIndex()
+    app.extensions['search_index'] = index
+    with app.app_context():
+        try:
+            rebuild_index(index)
+        except Exception:
+            # Tables may not exist yet; the first search builds the index
+            db.session.rollback()
+            app.logger.warning('Search index not built at startup')
+
+def get_search_backend():
+    """Return the search backend configured for the current app"""
+    name = current_app.config.get('SEARCH_BACKEND', 'auto')
+    if name == 'auto':
+        name = db.engine.dialect.name
+    backend_class = SEARCH_BACKENDS.get(name, LikeSearchBackend)
+    if backend_class.name == db.engine.dialect.name and not _native_index_ready():
+        backend_class = LikeSearchBackend
+    return backend_class()
+
+def _native_index_ready():
+    """Whether the native full-text index exists, checked once per app (until init_db.py adds it, search scans)"""
+    ready = current_app.extensions.get('search_native_index')
+    if ready is None:
+        with db.engine.connect() as connection:
+            ready = has_search_index(connection)
+        if not ready:
+            current_app.logger.warning('Full-text index missing, searching with LIKE; run init_db.py to create it')
+        current_app.extensions['search_native_index'] = ready
+    return ready
+
+def get_suggest_index():
+    """Return the current app's suggest index, synced with the database"""
+    index = current_app.extensions['suggest_index']
+    refresh_suggest_index(
+        index,
+        current_app.config.get('SEARCH_INDEX_REFRESH_SECONDS', 30),
+        current_app.config.get('SUGGEST_REBUILD_SECONDS', 300)
+    )
+    return index
+
+def index_product(product):
+    """Update the in-process indexes after a product write (no-op for unbuilt ones)"""
+    index = current_app.extensions.get('search_index')
+    if index is not None and index.synced_at is not None:
+        index.add(product.id, product_fields(product))
+    suggest_index = current_app.extensions.get('suggest_index')
+    if suggest_index is not None and suggest_index.built_at is not None:
+        suggest_index.add(product)
+
+def index_products(product_ids):
+    """Re-index products written in bulk by id (no-op for unbuilt in-process indexes)"""
+    index = current_app.extensions.get('search_index')
+    if index is not None and index.synced_at is not None:
+        reindex_rows(index, product_ids)
+    suggest_index = current_app.extensions.get('suggest_index')
+    if suggest_index is not None and suggest_index.built_at is not None:
+        reindex_suggestions(suggest_index, product_ids)
+
+def unindex_product(product_id):
+    """Remove a deleted product from the in-process indexes (no-op otherwise)"""
+    index = current_app.extensions.get('search_index')
+    if index is not None:
+        index.remove(product_id)
+    suggest_index = current_app.extensions.get('suggest_index')
+    if suggest_index is not None:
+        suggest_index.remove(product_id)
+
+def index_categories():
+    """Reload category suggestions after a category write (no-op if unbuilt)"""
+    suggest_index = current_app.extensions.get('suggest_index')
+    if suggest_index is not None and suggest_index.built_at is not None:
+        suggest_index.set_categories(active_categories())
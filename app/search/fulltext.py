@@ -0,0 +1,78 @@
+"""
+SQL search backends for the product catalog.
+
+Each backend narrows a ``Product`` query to the rows matching a search
+string and returns a relevance expression (higher is better) that the
+caller can order by.
+"""
+import re
+from sqlalchemy import or_, case, func, literal_column, table, column, text
+from sqlalchemy.dialects.mysql import match
+from app.models.product import Product, SEARCH_TS_CONFIG, search_document
+
+# Tokens kept for FTS5 queries; everything else is query syntax
+_FTS5_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+class LikeSearchBackend:
+    """Portable fallback: substring match with ILIKE (no index)"""
+    name = 'like'
+
+    def apply(self, query, q):
+        search_term = f"%{q}%"
+        query = query.filter(
+            or_(
+                Product.name.ilike(search_term),
+                Product.description.ilike(search_term),
+                Product.short_description.ilike(search_term),
+                Product.sku.ilike(search_term)
+            )
+        )
+        relevance = case(
+            (Product.name.ilike(search_term), 3),
+            (Product.sku.ilike(search_term), 2),
+            (Product.short_description.ilike(search_term), 1),
+            else_=0
+        )
+        return query, relevance
+
+class MySQLFullTextBackend:
+    """MySQL/InnoDB FULLTEXT index in natural language mode"""
+    name = 'mysql'
+
+    def apply(self, query, q):
+        relevance = match(
+            Product.name, Product.short_description, Product.description, Product.sku,
+            against=q
+        ).in_natural_language_mode()
+        return query.filter(relevance > 0), relevance
+
+class PostgresFullTextBackend:
+    """PostgreSQL tsvector expression served by a GIN index"""
+    name = 'postgresql'
+
+    def apply(self, query, q):
+        document = search_document()
+        ts_query = func.plainto_tsquery(literal_column(f"'{SEARCH_TS_CONFIG}'"), q)
+        return query.filter(document.op('@@')(ts_query)), func.ts_rank(document, ts_query)
+
+class SQLiteFTS5Backend:
+    """SQLite FTS5 external-content table kept in sync by triggers"""
+    name = 'sqlite'
+
+    fts = table('products_fts', column('rowid'), column('rank'))
+
+    @staticmethod
+    def to_match_expression(q):
+        """Turn free text into an FTS5 query of quoted prefix terms"""
+        tokens = _FTS5_TOKEN.findall(q)
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def apply(self, query, q):
+        expression = self.to_match_expression(q)
+        if not expression:
+            return query.filter(text('1 = 0')), None
+        query = query.join(
+            self.fts, self.fts.c.rowid == literal_column('products.rowid')
+        ).filter(text('products_fts MATCH :search_q').bindparams(search_q=expression))
+        # FTS5 rank is bm25(), where lower is better
+        return query, -self.fts.c.rank
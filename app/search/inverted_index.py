@@ -0,0 +1,245 @@
+"""
+In-process inverted index for catalog search.
+
+Products are tokenized (accent folding, Spanish/English stopwords and
+plural folding) into an in-memory posting list per term and scored with
+BM25. Queries never touch the database; matching ids are handed back to
+SQL for a single primary-key hydration together with the usual filters.
+"""
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, func, text
+from app import db
+from app.models.product import Product
+
+STOPWORDS = frozenset("""
+a al algo con de del el en es esta este la las lo los mas o para por que se sin su sus un una unos unas y
+an and are as at be by for from in is it of on or the this to with
+""".split())
+
+# Term frequency multipliers per indexed field (BM25F-style weighting)
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'sku': 3.0,
+    'short_description': 1.5,
+    'description': 1.0
+}
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+def fold(value):
+    """Lowercase and strip diacritics ("Teléfono" -> "telefono")"""
+    decomposed = unicodedata.normalize('NFKD', value)
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+def stem(token):
+    """Fold Spanish/English plurals ("camiones"/"camion", "phones"/"phone") onto one term"""
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        token = token[:-1]
+    if len(token) > 3 and token.endswith('e') and token[-2] not in 'aeiou':
+        token = token[:-1]
+    return token
+
+def tokenize(value):
+    """Split text into normalized index terms"""
+    if not value:
+        return []
+    return [stem(token) for token in _WORD.findall(fold(value)) if token not in STOPWORDS]
+
+class InvertedIndex:
+    """Thread-safe BM25 inverted index keyed by document id"""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # term -> {doc_id: weighted tf}
+        self._doc_terms = {}  # doc_id -> terms, for removal
+        self._doc_len = {}
+        self._total_len = 0.0
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()  # held while a full rebuild runs
+        self.synced_at = None  # updated_at watermark of the last sync
+        self.checked_at = None
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._doc_len
+
+    def add(self, doc_id, fields):
+        """Index (or re-index) a document given a mapping of field -> text"""
+        weights = Counter()
+        for field, value in fields.items():
+            weight = FIELD_WEIGHTS.get(field, 1.0)
+            for term in tokenize(value):
+                weights[term] += weight
+
+        with self._lock:
+            self._remove(doc_id)
+            for term, tf in weights.items():
+                self._postings[term][doc_id] = tf
+            self._doc_terms[doc_id] = tuple(weights)
+            self._doc_len[doc_id] = sum(weights.values())
+            self._total_len += self._doc_len[doc_id]
+
+    def remove(self, doc_id):
+        """Drop a document from the index"""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id)
+
+    def load_from(self, other):
+        """Take over the contents of another index built off to the side"""
+        with self._lock:
+            self._postings = other._postings
+            self._doc_terms = other._doc_terms
+            self._doc_len = other._doc_len
+            self._total_len = other._total_len
+
+    def search(self, q, limit=1000):
+        """Return up to ``limit`` (doc_id, score) pairs, best first"""
+        terms = set(tokenize(q))
+        if not terms:
+            return []
+
+        with self._lock:
+            n_docs = len(self._doc_len)
+            if not n_docs:
+                return []
+            avg_len = self._total_len / n_docs
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+# Columns read from products when (re)building the index
+_INDEXED_COLUMNS = (Product.id, Product.name, Product.sku, Product.short_description, Product.description)
+
+def product_fields(product):
+    """Indexed text fields of a Product instance or row"""
+    return {
+        'name': product.name,
+        'sku': product.sku,
+        'short_description': product.short_description,
+        'description': product.description
+    }
+
+def _index_rows(index, rows):
+    for row in rows:
+        index.add(row.id, product_fields(row))
+
+def reindex_rows(index, product_ids, batch_size=1000):
+    """Index the given products, reading them in batches by primary key"""
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        _index_rows(index, db.session.query(*_INDEXED_COLUMNS).filter(Product.id.in_(batch)))
+
+def rebuild_index(index):
+    """Rebuild the whole index from the products table"""
+    now = datetime.utcnow()
+    # Build a fresh index so searches keep using the old one meanwhile
+    fresh = InvertedIndex(index.k1, index.b)
+    _index_rows(fresh, db.session.query(*_INDEXED_COLUMNS).yield_per(2000))
+    index.load_from(fresh)
+    index.synced_at = now
+    index.checked_at = now
+
+def start_rebuild(index, rebuild):
+    """
+    Run ``rebuild(index)`` in a background thread; returns the thread.
+
+    Returns None if a rebuild of the index is already running. Readers keep
+    using the current contents until the rebuild swaps in the new ones.
+    """
+    if not index._rebuild_lock.acquire(blocking=False):
+        return None
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                try:
+                    rebuild(index)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('%s rebuild failed', type(index).__name__)
+                finally:
+                    db.session.remove()
+        finally:
+            index._rebuild_lock.release()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def refresh_index(index, interval):
+    """
+    Pick up writes made by other worker processes.
+
+    Rows updated since the last sync are re-indexed; if the row count
+    still disagrees afterwards (deletes elsewhere) the index is rebuilt in
+    the background while searches keep using the current one; returns the
+    rebuild thread if one was started.
+    """
+    now = datetime.utcnow()
+    if index.synced_at is None:
+        # Nothing to serve yet: one request builds, concurrent ones wait for it
+        with index._rebuild_lock:
+            if index.synced_at is None:
+                rebuild_index(index)
+        return None
+    if index.checked_at and now - index.checked_at < timedelta(seconds=interval):
+        return None
+
+    index.checked_at = now
+    # Small overlap guards against writes committed during the last sync
+    changed = db.session.query(*_INDEXED_COLUMNS).filter(
+        Product.updated_at >= index.synced_at - timedelta(seconds=1)
+    )
+    _index_rows(index, changed)
+    index.synced_at = now
+
+    if db.session.query(func.count(Product.id)).scalar() != len(index):
+        return start_rebuild(index, rebuild_index)
+    return None
+
+class InvertedIndexBackend:
+    """BM25 over the in-process inverted index; hydration by primary key"""
+    name = 'memory'
+
+    def apply(self, query, q):
+        index = current_app.extensions['search_index']
+        refresh_index(index, current_app.config.get('SEARCH_INDEX_REFRESH_SECONDS', 30))
+        hits = index.search(q, limit=current_app.config.get('SEARCH_MAX_HITS', 1000))
+        if not hits:
+            return query.filter(text('1 = 0')), None
+
+        scores = dict(hits)
+        query = query.filter(Product.id.in_(list(scores)))
+        return query, case(scores, value=Product.id, else_=0)
@@ -0,0 +1,237 @@
+"""
+In-process prefix index for typeahead suggestions.
+
+Product names (from every word on, so "max" finds "Smartphone Pro Max"),
+SKUs and active category names are normalized into one sorted array of
+``(key, id)`` pairs; a prefix is the contiguous run found with ``bisect``.
+Products in the run are ranked by popularity; when the run is long (short
+prefixes) products are instead walked in popularity order until enough
+match, which is quick precisely because matches are dense. The top results
+of each prefix are memoized, so repeated keystrokes are dictionary lookups.
+Writes in this process update the index in place; other workers' writes are
+picked up by ``updated_at``, and a periodic rebuild, run in a background
+thread while requests keep using the current index, refreshes popularity
+scores.
+"""
+import heapq
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from app import db
+from app.models.product import Product, Category
+from app.search.inverted_index import fold, start_rebuild, _WORD
+
+# Results memoized per prefix (the largest limit a request may ask for)
+MEMO_SIZE = 20
+MAX_MEMO_ENTRIES = 10000
+
+# Above this many matching keys, walk products by popularity instead of ranking the run
+SCAN_LIMIT = 1000
+
+# Columns read from products when (re)building the index
+_SUGGEST_COLUMNS = (Product.id, Product.name, Product.sku, Product.slug, Product.popularity_score, Product.is_active)
+
+def normalize(value):
+    """Fold accents and case and reduce punctuation to single spaces"""
+    return ' '.join(_WORD.findall(fold(value or '')))
+
+def product_keys(name, sku):
+    """Prefix keys of a product: its name from each word on, and its SKU"""
+    words = normalize(name).split()
+    keys = {' '.join(words[start:]) for start in range(len(words))}
+    keys.add(normalize(sku))
+    keys.discard('')
+    return tuple(keys)
+
+class SuggestIndex:
+    """Thread-safe sorted-array prefix index of products and categories"""
+
+    def __init__(self):
+        self._keys = []  # sorted (key, product id)
+        self._products = {}  # product id -> (rank, suggestion, keys)
+        self._ranked = []  # sorted ranks: (-popularity, name, id)
+        self._category_keys = []  # sorted (key, category id)
+        self._categories = {}  # category id -> suggestion
+        self._memo = {}  # prefix -> top product ids
+        self._lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()  # held while a full rebuild runs
+        self.synced_at = None  # updated_at watermark of the last sync
+        self.checked_at = None
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._products)
+
+    def add(self, row):
+        """Index (or re-index) a product row; inactive products are removed"""
+        if not row.is_active:
+            self.remove(row.id)
+            return
+        entry = self._entry(row)
+        with self._lock:
+            self._remove(row.id)
+            for key in entry[2]:
+                insort(self._keys, (key, row.id))
+            insort(self._ranked, entry[0])
+            self._products[row.id] = entry
+            self._forget(entry[2])
+
+    def load_rows(self, rows):
+        """Fill an empty index from active product rows with a single sort"""
+        for row in rows:
+            entry = self._products[row.id] = self._entry(row)
+            self._keys.extend((key, row.id) for key in entry[2])
+            self._ranked.append(entry[0])
+        self._keys.sort()
+        self._ranked.sort()
+
+    @staticmethod
+    def _entry(row):
+        rank = (-(row.popularity_score or 0), row.name, row.id)
+        suggestion = {'id': row.id, 'name': row.name, 'slug': row.slug, 'sku': row.sku}
+        return (rank, suggestion, product_keys(row.name, row.sku))
+
+    def remove(self, product_id):
+        """Drop a product from the index"""
+        with self._lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        entry = self._products.pop(product_id, None)
+        if entry is None:
+            return
+        for key in entry[2]:
+            _discard(self._keys, (key, product_id))
+        _discard(self._ranked, entry[0])
+        self._forget(entry[2])
+
+    def _forget(self, keys):
+        """Drop memoized results of every prefix of the given keys"""
+        for key in keys:
+            for end in range(1, len(key) + 1):
+                self._memo.pop(key[:end], None)
+
+    def set_categories(self, categories):
+        """Replace the indexed categories (there are few, so always wholesale)"""
+        keys = sorted(
+            (normalize(category.name), category.id) for category in categories if normalize(category.name)
+        )
+        suggestions = {
+            category.id: {'id': category.id, 'name': category.name, 'slug': category.slug}
+            for category in categories
+        }
+        with self._lock:
+            self._category_keys = keys
+            self._categories = suggestions
+
+    def load_from(self, other):
+        """Take over the contents of another index built off to the side"""
+        with self._lock:
+            self._keys = other._keys
+            self._products = other._products
+            self._ranked = other._ranked
+            self._category_keys = other._category_keys
+            self._categories = other._categories
+            self._memo = {}
+
+    def suggest(self, prefix, limit=8):
+        """Return ``(products, categories)`` suggestions for a typed prefix"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return [], []
+
+        with self._lock:
+            top = self._memo.get(prefix)
+            if top is None:
+                top = self._top_products(prefix)
+                if len(self._memo) >= MAX_MEMO_ENTRIES:
+                    self._memo.clear()
+                self._memo[prefix] = top
+
+            products = [self._products[product_id][1] for product_id in top[:limit]]
+            categories = [
+                self._categories[category_id]
+                for _, category_id in self._run(self._category_keys, prefix)
+            ][:limit]
+        return products, categories
+
+    def _top_products(self, prefix):
+        """Ids of the best ranked products with a key starting with ``prefix``"""
+        start = bisect_left(self._keys, (prefix,))
+        end = bisect_left(self._keys, (prefix + '\uffff',))
+        if end - start <= SCAN_LIMIT:
+            ranks = {self._products[product_id][0] for _, product_id in self._keys[start:end]}
+            return [rank[2] for rank in heapq.nsmallest(MEMO_SIZE, ranks)]
+
+        top = []
+        for rank in self._ranked:
+            if any(key.startswith(prefix) for key in self._products[rank[2]][2]):
+                top.append(rank[2])
+                if len(top) == MEMO_SIZE:
+                    break
+        return top
+
+    @staticmethod
+    def _run(keys, prefix):
+        position = bisect_left(keys, (prefix,))
+        while position < len(keys) and keys[position][0].startswith(prefix):
+            yield keys[position]
+            position += 1
+
+def _discard(items, item):
+    """Remove an item from a sorted list if present"""
+    position = bisect_left(items, item)
+    if position < len(items) and items[position] == item:
+        del items[position]
+
+def reindex_suggestions(index, product_ids, batch_size=1000):
+    """Re-index the given products, reading them in batches by primary key"""
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        for row in db.session.query(*_SUGGEST_COLUMNS).filter(Product.id.in_(batch)):
+            index.add(row)
+
+def active_categories():
+    """Categories offered as suggestions"""
+    return Category.query.filter_by(is_active=True).order_by(Category.sort_order, Category.name).all()
+
+def rebuild_suggest_index(index):
+    """Rebuild the whole index (and refresh every popularity score)"""
+    now = datetime.utcnow()
+    fresh = SuggestIndex()
+    fresh.load_rows(db.session.query(*_SUGGEST_COLUMNS).filter(Product.is_active == True).yield_per(2000))
+    fresh.set_categories(active_categories())
+    index.load_from(fresh)
+    index.synced_at = index.checked_at = index.built_at = now
+
+def refresh_suggest_index(index, interval, rebuild_interval):
+    """
+    Pick up writes made by other worker processes.
+
+    Products updated since the last sync are re-indexed and categories are
+    reloaded every ``interval`` seconds; the whole index is rebuilt in the
+    background every ``rebuild_interval`` seconds to follow popularity
+    scores and deletes. Returns the rebuild thread if one was started.
+    """
+    now = datetime.utcnow()
+    if index.built_at is None:
+        # Nothing to serve yet: one request builds, concurrent ones wait for it
+        with index._rebuild_lock:
+            if index.built_at is None:
+                rebuild_suggest_index(index)
+        return None
+    if now - index.built_at >= timedelta(seconds=rebuild_interval):
+        return start_rebuild(index, rebuild_suggest_index)
+    if index.checked_at and now - index.checked_at < timedelta(seconds=interval):
+        return None
+
+    index.checked_at = now
+    # Small overlap guards against writes committed during the last sync
+    for row in db.session.query(*_SUGGEST_COLUMNS).filter(
+        Product.updated_at >= index.synced_at - timedelta(seconds=1)
+    ):
+        index.add(row)
+    index.set_categories(active_categories())
+    index.synced_at = now
+    return None
@@ -0,0 +1,229 @@
+"""
+Bulk catalog writes: streamed CSV/JSONL product import and set-based
+price/inventory updates.
+
+Rows are validated with ``ProductSchema`` and written in chunks: one
+set-based lookup per chunk for existing SKUs/slugs and categories, then a
+bulk INSERT for new products and a bulk UPDATE (by primary key) for SKUs
+that already exist. Each chunk is its own transaction, and a bad row is
+reported without stopping the rest of the import.
+"""
+import csv
+import io
+import json
+import uuid
+from marshmallow import ValidationError
+from sqlalchemy import case, insert, or_, update
+from app import db
+from app.models.product import Product, Category, ProductImage
+from app.schemas.product import ProductSchema
+from app.utils.auth import sanitize_input
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+# Request content types mapped to an import format (?format= overrides)
+IMPORT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+    'application/jsonlines': 'jsonl'
+}
+
+# Columns the bulk update endpoint may set, keyed by sku
+BULK_UPDATE_COLUMNS = ('price', 'compare_price', 'inventory_quantity')
+
+product_schema = ProductSchema()
+
+def read_rows(stream, fmt):
+    """
+    Yield ``(row_number, data, error)`` for each record of a CSV or JSONL stream.
+
+    Row numbers count data records from 1 (the CSV header is not a row).
+    Empty CSV cells are treated as missing values.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='' if fmt == 'csv' else None)
+
+    if fmt == 'csv':
+        for number, record in enumerate(csv.DictReader(text), start=1):
+            yield number, {key: value for key, value in record.items() if key and value not in ('', None)}, None
+        return
+
+    number = 0
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, None, {'_row': ['Invalid JSON']}
+            continue
+        if not isinstance(record, dict):
+            yield number, None, {'_row': ['Expected a JSON object']}
+            continue
+        yield number, record, None
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class ImportReport:
+    """Running totals and per-row errors of an import"""
+
+    def __init__(self, max_errors=1000):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.max_errors = max_errors
+        self.product_ids = []
+
+    def fail(self, number, errors, sku=None):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': number, 'sku': sku, 'errors': errors})
+
+    def to_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors)
+        }
+
+def import_products(stream, fmt, chunk_size=500, max_errors=1000):
+    """Import products from a CSV/JSONL stream; returns an ImportReport"""
+    report = ImportReport(max_errors)
+    seen_skus = set()
+    seen_slugs = set()
+
+    for chunk in _chunks(read_rows(stream, fmt), chunk_size):
+        valid = []
+        for number, data, error in chunk:
+            if error:
+                report.fail(number, error)
+                continue
+            sku = data.get('sku')
+            try:
+                record = product_schema.load(sanitize_input(data))
+            except ValidationError as e:
+                report.fail(number, e.messages, sku)
+                continue
+            # Duplicates inside the file: the first occurrence wins
+            if record['sku'] in seen_skus:
+                report.fail(number, {'sku': ['Duplicate SKU in import']}, sku)
+                continue
+            if record['slug'] in seen_slugs:
+                report.fail(number, {'slug': ['Duplicate slug in import']}, sku)
+                continue
+            seen_skus.add(record['sku'])
+            seen_slugs.add(record['slug'])
+            valid.append((number, record, set(data)))
+
+        if valid:
+            _write_chunk(valid, report)
+
+    return report
+
+def _write_chunk(rows, report):
+    """Upsert one chunk of validated ``(number, record, provided keys)`` rows in a single transaction"""
+    skus = [record['sku'] for _, record, _ in rows]
+    slugs = [record['slug'] for _, record, _ in rows]
+    category_ids = {record['category_id'] for _, record, _ in rows}
+
+    # One set-based lookup each for existing products and categories
+    existing = db.session.query(Product.id, Product.sku, Product.slug).filter(
+        or_(Product.sku.in_(skus), Product.slug.in_(slugs))
+    ).all()
+    id_by_sku = {row.sku: row.id for row in existing}
+    id_by_slug = {row.slug: row.id for row in existing}
+    known_categories = {row.id for row in db.session.query(Category.id).filter(Category.id.in_(category_ids))}
+
+    inserts, updates, images, replaced, written = [], [], [], [], []
+    for number, record, provided in rows:
+        if record['category_id'] not in known_categories:
+            report.fail(number, {'category_id': ['Category not found']}, record['sku'])
+            continue
+
+        product_id = id_by_sku.get(record['sku'])
+        slug_owner = id_by_slug.get(record['slug'])
+        if slug_owner is not None and slug_owner != product_id:
+            report.fail(number, {'slug': ['Product slug already exists']}, record['sku'])
+            continue
+
+        image_rows = record.pop('images', [])
+        if product_id is None:
+            product_id = str(uuid.uuid4())
+            inserts.append(dict(record, id=product_id))
+        else:
+            # Fields absent from the row keep their values instead of taking schema defaults
+            updates.append(dict({key: value for key, value in record.items() if key in provided}, id=product_id))
+            if 'images' in provided:
+                replaced.append(product_id)
+        images.extend(
+            dict(image, id=str(uuid.uuid4()), product_id=product_id) for image in image_rows
+        )
+        written.append((number, record['sku'], product_id))
+
+    try:
+        if inserts:
+            db.session.execute(insert(Product), inserts)
+        if updates:
+            db.session.execute(update(Product), updates)
+        if replaced:
+            ProductImage.query.filter(ProductImage.product_id.in_(replaced)).delete(synchronize_session=False)
+        if images:
+            db.session.execute(insert(ProductImage), images)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # e.g. a concurrent write took a SKU or slug: report every row of the chunk
+        for number, sku, _ in written:
+            report.fail(number, {'_row': ['Chunk could not be written']}, sku)
+        return
+
+    report.created += len(inserts)
+    report.updated += len(updates)
+    report.product_ids.extend(product_id for _, _, product_id in written)
+
+def bulk_update_products(items, chunk_size=1000):
+    """
+    Apply (sku, price, inventory_quantity) updates with one UPDATE per chunk.
+
+    Each chunk looks up its SKUs once, then sets every column with a
+    ``CASE sku WHEN ...`` expression over ``WHERE sku IN (...)``; SKUs
+    without a new value for a column keep the current one. The caller
+    commits (or rolls back) the whole batch. Returns ``(updated ids,
+    unknown SKUs)``.
+    """
+    updated_ids, not_found = [], []
+
+    for start in range(0, len(items), chunk_size):
+        chunk = {item['sku']: item for item in items[start:start + chunk_size]}
+        found = db.session.query(Product.id, Product.sku).filter(Product.sku.in_(list(chunk))).all()
+        found_skus = {row.sku for row in found}
+        not_found.extend(sku for sku in chunk if sku not in found_skus)
+        if not found:
+            continue
+
+        values = {}
+        for column in BULK_UPDATE_COLUMNS:
+            changes = {sku: item[column] for sku, item in chunk.items() if column in item and sku in found_skus}
+            if changes:
+                values[column] = case(changes, value=Product.sku, else_=getattr(Product, column))
+
+        db.session.execute(
+            update(Product).where(Product.sku.in_(found_skus)).values(**values),
+            execution_options={'synchronize_session': False}
+        )
+        updated_ids.extend(row.id for row in found)
+
+    return updated_ids, not_found
@@ -0,0 +1,212 @@
+"""
+Response cache for catalog reads with tag-based invalidation.
+
+Entries hold encoded JSON bodies and carry tags such as ``product:<id>``,
+``category:<id>``, ``products`` (every listing) and ``categories``. Write
+endpoints invalidate the tags they affect.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from app.utils.conditional import not_modified
+from app.utils.fragments import encode_json
+
+class NullCache:
+    """Cache that never stores anything"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None, tags=()):
+        pass
+
+    def invalidate_tags(self, *tags):
+        pass
+
+    def clear(self):
+        pass
+
+class MemoryCache:
+    """Per-process LRU cache with TTL"""
+
+    def __init__(self, max_entries=1024, default_ttl=60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None, tags=()):
+        expires_at = time.monotonic() + (ttl or self.default_ttl)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (expires_at, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_tags(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+class RedisCache:
+    """Redis-backed cache shared by all workers; tags are Redis sets"""
+
+    def __init__(self, client, default_ttl=60, prefix='cache:'):
+        self.client = client
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl=None, tags=()):
+        ttl = ttl or self.default_ttl
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, value, ex=ttl)
+        for tag in tags:
+            tag_key = f'{self.prefix}tag:{tag}'
+            pipe.sadd(tag_key, self.prefix + key)
+            # Tag sets outlive their entries only briefly
+            pipe.expire(tag_key, ttl * 2)
+        pipe.execute()
+
+    def invalidate_tags(self, *tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            tag_key = f'{self.prefix}tag:{tag}'
+            keys = self.client.smembers(tag_key)
+            if keys:
+                pipe.delete(*keys)
+            pipe.delete(tag_key)
+        pipe.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+def init_cache(app):
+    """Create the response cache selected by CACHE_BACKEND"""
+    backend = app.config.get('CACHE_BACKEND', 'memory')
+    ttl = app.config.get('CACHE_DEFAULT_TTL', 60)
+
+    if backend == 'redis':
+        cache = RedisCache.from_url(app.config['CACHE_REDIS_URL'], default_ttl=ttl)
+    elif backend == 'memory':
+        cache = MemoryCache(max_entries=app.config.get('CACHE_MAX_ENTRIES', 1024), default_ttl=ttl)
+    else:
+        cache = NullCache()
+
+    app.extensions['cache'] = cache
+    return cache
+
+def get_cache():
+    """Return the response cache of the current app"""
+    cache = current_app.extensions.get('cache')
+    return cache if cache is not None else NullCache()
+
+def make_cache_key(namespace, params=None):
+    """Build a stable key from a namespace and validated parameters"""
+    if not params:
+        return namespace
+    normalized = json.dumps(
+        {key: value for key, value in params.items() if value is not None},
+        sort_keys=True, separators=(',', ':'), default=str
+    )
+    return f'{namespace}:{normalized}'
+
+def cached_json(key, tags, load, ttl=None):
+    """
+    Serve a JSON body from cache, or load, store and serve it.
+
+    ``load`` returns None when there is nothing to serve (None is returned
+    and nothing is cached), otherwise ``(etag, serialize)`` where
+    ``serialize()`` builds the payload dict. The ETag is stored with the
+    body, so a matching If-None-Match is answered with 304 without touching
+    the database on a hit, or without serializing on a miss. ``tags`` may
+    be a callable taking the payload. Exceptions propagate so callers keep
+    their usual error handling.
+    """
+    cache = get_cache()
+    try:
+        entry = cache.get(key)
+    except Exception:
+        current_app.logger.exception('Cache read failed')
+        entry = None
+
+    if entry is not None:
+        if isinstance(entry, bytes):
+            entry = entry.decode('utf-8')
+        etag, body = entry.split('\n', 1)
+        response = not_modified(etag)
+        return response if response is not None else _json_response(body, etag, 'HIT')
+
+    loaded = load()
+    if loaded is None:
+        return None
+    etag, serialize = loaded
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    payload = serialize()
+    if callable(tags):
+        tags = tags(payload)
+    body = encode_json(payload)
+    try:
+        cache.set(key, f'{etag}\n{body}', ttl=ttl, tags=tags)
+    except Exception:
+        current_app.logger.exception('Cache write failed')
+    return _json_response(body, etag, 'MISS')
+
+def _json_response(body, etag, status):
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['X-Cache'] = status
+    return response
+
+def invalidate(*tags):
+    """Drop cached responses carrying any of the given tags"""
+    try:
+        get_cache().invalidate_tags(*tags)
+    except Exception:
+        # A cache outage must not fail the write; entries expire by TTL
+        current_app.logger.exception('Cache invalidation failed')
@@ -0,0 +1,27 @@
+"""
+ETag helpers for conditional GET requests
+"""
+import hashlib
+from flask import request, current_app, jsonify
+
+def make_etag(*parts):
+    """Build a strong ETag value from row versions and request parameters"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8'))
+    return digest.hexdigest()
+
+def not_modified(etag):
+    """Return a 304 response if the client already holds ``etag``, else None"""
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def conditional_json(etag, serialize):
+    """Answer 304 for a matching If-None-Match, otherwise serialize with the ETag set"""
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    response = jsonify(serialize())
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,133 @@
+"""
+Pre-encoded product JSON fragments.
+
+Each product's serialized JSON is kept as text, keyed by the row versions
+it was built from (product and, when embedded, category ``updated_at``)
+and the fieldset. List responses splice the cached text into their body
+through ``RawJSON`` values instead of rebuilding and re-encoding every
+product dict. Entries are evicted least-recently-used by total size, and
+dropped explicitly on product and image writes.
+"""
+import re
+import secrets
+import threading
+from collections import OrderedDict
+from flask import current_app
+from app.models.product import PRODUCT_PROJECTIONS
+
+class RawJSON(str):
+    """Already-encoded JSON value, written verbatim by encode_json()"""
+    pass
+
+class FragmentCache:
+    """Per-process LRU of encoded product JSON, bounded by total characters"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # key -> encoded JSON
+        self._keys_by_product = {}  # product id -> set of keys
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+            return encoded
+
+    def set(self, key, product_id, encoded):
+        if len(encoded) > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = encoded
+            self._keys_by_product.setdefault(product_id, set()).add(key)
+            self.size += len(encoded)
+            while self.size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def evict(self, *product_ids):
+        """Drop every cached fragment of the given products"""
+        with self._lock:
+            for product_id in product_ids:
+                for key in self._keys_by_product.pop(product_id, ()):
+                    encoded = self._entries.pop(key, None)
+                    if encoded is not None:
+                        self.size -= len(encoded)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_product.clear()
+            self.size = 0
+
+    def _discard(self, key):
+        encoded = self._entries.pop(key, None)
+        if encoded is None:
+            return
+        self.size -= len(encoded)
+        keys = self._keys_by_product.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_product[key[0]]
+
+def init_fragments(app):
+    """Create the fragment cache unless FRAGMENT_CACHE_MAX_BYTES is 0"""
+    max_bytes = app.config.get('FRAGMENT_CACHE_MAX_BYTES', 0)
+    app.extensions['fragment_cache'] = FragmentCache(max_bytes) if max_bytes > 0 else None
+
+def product_json(product, fields=None):
+    """Encoded JSON of ``product.to_dict(fields=fields)``, from the cache when possible"""
+    fields = tuple(fields or PRODUCT_PROJECTIONS['full'])
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is None:
+        return RawJSON(current_app.json.dumps(product.to_dict(fields=fields)))
+
+    category_version = None
+    if 'category' in fields and product.category is not None:
+        category_version = product.category.updated_at
+    key = (product.id, product.updated_at, category_version, fields)
+
+    encoded = cache.get(key)
+    if encoded is None:
+        encoded = current_app.json.dumps(product.to_dict(fields=fields))
+        cache.set(key, product.id, encoded)
+    return RawJSON(encoded)
+
+def evict_products(*product_ids):
+    """Drop cached fragments after product or image writes"""
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is not None:
+        cache.evict(*product_ids)
+
+def encode_json(payload):
+    """Encode a payload like jsonify(), splicing RawJSON values in verbatim"""
+    fragments = []
+    # Placeholders carry a per-call nonce, so strings in the payload cannot
+    # be mistaken for them
+    nonce = secrets.token_hex(8)
+
+    def mark(value):
+        if isinstance(value, RawJSON):
+            fragments.append(value)
+            return f'\x00fragment:{nonce}:{len(fragments) - 1}\x00'
+        if isinstance(value, dict):
+            return {key: mark(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [mark(item) for item in value]
+        return value
+
+    body = current_app.json.dumps(mark(payload))
+    if not fragments:
+        return body
+    placeholder = re.compile(rf'"\\u0000fragment:{nonce}:(\d+)\\u0000"')
+    return placeholder.sub(lambda match: fragments[int(match.group(1))], body)
+
+def json_response(payload, status=200):
+    """JSON response for a payload that may contain RawJSON fragments"""
+    return current_app.response_class(encode_json(payload), status=status, mimetype='application/json')
@@ -0,0 +1,208 @@
+"""
+Uploaded product images: content-addressed storage and resized variants.
+
+Uploads are streamed to ``UPLOAD_FOLDER`` under the SHA-256 of their bytes
+(``ab/cd/<hash>.<ext>``), so identical files are stored once and a file name
+never changes meaning. Resized variants (``IMAGE_VARIANTS``) are rendered in
+a process pool, off the request thread, and their URLs are written to
+``ProductImage.variants`` when they are ready. With ``IMAGE_WORKERS = 0``
+they are rendered inline instead.
+"""
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from flask import current_app
+from app import db
+from app.models.product import Product, ProductImage
+from app.utils.cache import invalidate
+from app.utils.fragments import evict_products
+
+# Leading bytes of the accepted image formats -> file extension
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+VARIANT_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg', 'PNG': 'png'}
+
+# Content types of the stored extensions; nothing else is served
+MEDIA_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif', 'webp': 'image/webp'}
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+class UnsupportedImageError(ValueError):
+    """Raised when an upload is not a JPEG, PNG, GIF or WebP image"""
+    pass
+
+def sniff_image_type(head):
+    """File extension for the first bytes of an image, or None"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+def media_root():
+    """Absolute path of the upload directory"""
+    return os.path.join(current_app.instance_path, current_app.config['UPLOAD_FOLDER'])
+
+def media_url(relative_path):
+    """Public URL of a file under the upload directory"""
+    return f"{current_app.config.get('MEDIA_URL_PREFIX', '/media').rstrip('/')}/{relative_path}"
+
+def content_path(content_hash, extension, variant=None):
+    """Relative storage path of an original (or one of its variants)"""
+    name = f'{content_hash}-{variant}' if variant else content_hash
+    return f'{content_hash[:2]}/{content_hash[2:4]}/{name}.{extension}'
+
+def store_upload(stream):
+    """
+    Stream an uploaded image into content-addressed storage.
+
+    Returns ``(content_hash, relative path)``. The bytes are hashed while
+    they are copied to a temporary file next to their destination, which is
+    then renamed into place; an already stored copy is kept as is.
+    """
+    head = stream.read(16)
+    extension = sniff_image_type(head)
+    if extension is None:
+        raise UnsupportedImageError('Unsupported image type')
+
+    root = media_root()
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256(head)
+    fd, temp_path = tempfile.mkstemp(dir=root, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            temp.write(head)
+            for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                temp.write(chunk)
+
+        content_hash = digest.hexdigest()
+        relative_path = content_path(content_hash, extension)
+        destination = os.path.join(root, relative_path)
+        if os.path.exists(destination):
+            os.unlink(temp_path)
+        else:
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(temp_path, destination)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    return content_hash, relative_path
+
+def render_variants(root, source_path, content_hash, sizes, image_format='WEBP', quality=80):
+    """
+    Write resized copies of a stored original; returns ``{name: relative path}``.
+
+    Runs in a pool process, so it only takes plain arguments and does not
+    touch the app or the database. Variants that already exist are reused.
+    """
+    from PIL import Image, ImageOps
+
+    extension = VARIANT_EXTENSIONS[image_format]
+    rendered = {}
+    with Image.open(os.path.join(root, source_path)) as original:
+        original = ImageOps.exif_transpose(original)
+        has_alpha = original.mode in ('RGBA', 'LA', 'PA') or 'transparency' in original.info
+        mode = 'RGBA' if has_alpha and image_format != 'JPEG' else 'RGB'
+        if original.mode != mode:
+            original = original.convert(mode)
+
+        for name, size in sizes.items():
+            relative_path = content_path(content_hash, extension, name)
+            destination = os.path.join(root, relative_path)
+            if not os.path.exists(destination):
+                variant = original.copy()
+                variant.thumbnail((size, size), Image.LANCZOS)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(destination), prefix='.variant-')
+                with os.fdopen(fd, 'wb') as temp:
+                    variant.save(temp, image_format, quality=quality)
+                os.replace(temp_path, destination)
+            rendered[name] = relative_path
+    return rendered
+
+def save_variants(image_id, rendered):
+    """Record rendered variant URLs on an image and refresh the product's caches"""
+    image = db.session.get(ProductImage, image_id)
+    if image is None:  # Deleted while rendering
+        return
+    image.variants = {name: media_url(path) for name, path in rendered.items()}
+    # Images are part of the product's version
+    Product.query.filter_by(id=image.product_id).update(
+        {'updated_at': datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+    invalidate('products', f'product:{image.product_id}')
+    evict_products(image.product_id)
+
+def generate_variants(image_id, content_hash, relative_path):
+    """Render an uploaded image's variants in the pool (or inline without one)"""
+    app = current_app._get_current_object()
+    args = (
+        media_root(), relative_path, content_hash, app.config['IMAGE_VARIANTS'],
+        app.config.get('IMAGE_VARIANT_FORMAT', 'WEBP'), app.config.get('IMAGE_VARIANT_QUALITY', 80)
+    )
+
+    def record(render):
+        # A failed render leaves the image without variants; clients fall back to image_url
+        try:
+            save_variants(image_id, render())
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Rendering variants of image %s failed', image_id)
+
+    pool = get_image_pool(app)
+    if pool is None:
+        record(lambda: render_variants(*args))
+        return
+
+    def done(future):
+        with app.app_context():
+            record(future.result)
+
+    try:
+        future = pool.submit(render_variants, *args)
+    except Exception:
+        # A broken pool (a child died) refuses work: replace it on the next
+        # upload and render this one here, after the image row is committed
+        app.logger.exception('Image pool unavailable, rendering variants of image %s inline', image_id)
+        with _pool_lock:
+            if app.extensions.get('image_pool') is pool:
+                del app.extensions['image_pool']
+        pool.shutdown(wait=False)
+        record(lambda: render_variants(*args))
+        return
+    future.add_done_callback(done)
+
+_pool_lock = threading.Lock()
+
+def get_image_pool(app):
+    """
+    The app's variant rendering pool, started on first use (after any fork).
+
+    Pool processes are spawned rather than forked: the worker is
+    multi-threaded (request and background refresh threads), and a child
+    forked while another thread holds a lock can deadlock.
+    """
+    workers = app.config.get('IMAGE_WORKERS', 0)
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        pool = app.extensions.get('image_pool')
+        if pool is None:
+            pool = app.extensions['image_pool'] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return pool
@@ -0,0 +1,100 @@
+"""
+Keyset (cursor) pagination helpers
+"""
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, or_
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded or does not match the query"""
+    pass
+
+def _encode_value(value):
+    """Convert a sort key value to a JSON-safe representation"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def _decode_value(value, kind):
+    """Convert a JSON cursor value back to the column's Python type (kind: datetime, decimal or None)"""
+    if kind == 'datetime':
+        return datetime.fromisoformat(value)
+    if kind == 'decimal':
+        return Decimal(value)
+    return value
+
+def encode_cursor(sort_by, sort_order, value, row_id):
+    """Build an opaque cursor pointing just after the given row"""
+    payload = {
+        's': sort_by,
+        'o': sort_order,
+        'v': _encode_value(value),
+        'id': row_id
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, sort_by, sort_order, kind=None):
+    """Decode a cursor and check it was issued for the same sort"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if payload['s'] != sort_by or payload['o'] != sort_order:
+            raise InvalidCursorError('Cursor does not match the requested sort')
+        return _decode_value(payload['v'], kind), payload['id']
+    except InvalidCursorError:
+        raise
+    except (ValueError, KeyError, TypeError, InvalidOperation) as e:
+        raise InvalidCursorError('Invalid cursor') from e
+
+def apply_keyset(query, order_field, id_field, sort_order, after=None):
+    """Order query by (order_field, id_field) and seek past the ``after`` key"""
+    if sort_order == 'desc':
+        if after is not None:
+            value, row_id = after
+            query = query.filter(or_(
+                order_field < value,
+                and_(order_field == value, id_field < row_id)
+            ))
+        return query.order_by(order_field.desc(), id_field.desc())
+
+    if after is not None:
+        value, row_id = after
+        query = query.filter(or_(
+            order_field > value,
+            and_(order_field == value, id_field > row_id)
+        ))
+    return query.order_by(order_field.asc(), id_field.asc())
+
+def iter_keyset(query, id_field, order_field=None, sort_order='asc', batch_size=1000):
+    """
+    Yield every row of a query, reading one keyset page per round trip.
+
+    Rows are ordered by ``id_field`` alone or by ``(order_field, id_field)``.
+    Each page is a ``LIMIT`` query that seeks past the last row of the
+    previous one and is fetched in full before its rows are yielded, so eager
+    loads never run while a result set is still open on the connection.
+    """
+    after = None
+    while True:
+        if order_field is None:
+            page = query.order_by(id_field.asc())
+            if after is not None:
+                page = page.filter(id_field > after)
+        else:
+            page = apply_keyset(query, order_field, id_field, sort_order, after)
+
+        rows = page.limit(batch_size).all()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+
+        last = rows[-1]
+        if order_field is None:
+            after = getattr(last, id_field.key)
+        else:
+            after = (getattr(last, order_field.key), getattr(last, id_field.key))
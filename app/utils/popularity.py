@@ -0,0 +1,251 @@
+"""
+Precomputed product popularity for sort_by=popularity.
+
+Scores use forward exponential decay: an event at time ``t`` adds
+``weight * 2 ** ((t - epoch) / half_life)`` to the product's score. Ranking
+by that sum gives the same order as ranking by the decayed score at any
+later time, so a refresh only adds to the products with new events.
+Weights double every half-life, so once events are ``RENORMALIZE_HALF_LIVES``
+past the epoch every score is scaled down by the same power of two and the
+epoch moved forward, long before a weight could overflow a float.
+
+Sales come from ``order_items`` (cancelled and refunded orders excluded),
+read incrementally past a watermark. Views are buffered in memory by each
+worker and flushed on its next refresh.
+"""
+import threading
+import time
+import click
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import bindparam, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.product import Product, JobWatermark
+from app.models.order import Order, OrderItem, OrderStatus
+
+# Start of the sales history, and the first origin of the decay weights
+EPOCH = datetime(2024, 1, 1)
+
+WATERMARK = 'popularity'
+
+# Current origin of the decay weights (its processed_until); only score ratios matter
+EPOCH_WATERMARK = 'popularity_epoch'
+
+# Half-lives past the epoch before scores are rescaled (a weight overflows past ~1024)
+RENORMALIZE_HALF_LIVES = 64
+
+# Orders whose items do not count as sales
+EXCLUDED_STATUSES = (OrderStatus.CANCELLED, OrderStatus.REFUNDED)
+
+def decay_weight(at, half_life_days, epoch=EPOCH):
+    """Forward-decay weight of an event at ``at``"""
+    return 2 ** ((at - epoch).total_seconds() / (half_life_days * 86400))
+
+class ViewBuffer:
+    """Thread-safe per-process counter of product views awaiting a flush"""
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, product_id):
+        with self._lock:
+            self._counts[product_id] += 1
+
+    def drain(self):
+        """Return and reset the buffered counts"""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        return counts
+
+    def restore(self, counts):
+        """Put back counts that could not be flushed"""
+        with self._lock:
+            self._counts.update(counts)
+
+def record_view(product_id):
+    """Count a product detail view (flushed by the next refresh)"""
+    views = current_app.extensions.get('product_views')
+    if views is not None:
+        views.record(product_id)
+
+def _lock_epoch(now, half_life_days):
+    """
+    Lock the decay epoch for the current transaction and return it, first
+    rescaling every score and moving the epoch forward if ``now`` is
+    ``RENORMALIZE_HALF_LIVES`` or more half-lives past it.
+
+    The row lock keeps a concurrent refresh from adding weights of the old
+    scale to rescaled scores.
+    """
+    query = JobWatermark.query.filter_by(name=EPOCH_WATERMARK).with_for_update()
+    epoch = query.one_or_none()
+    if epoch is None:
+        try:
+            # Scores written before the epoch was stored are relative to EPOCH
+            epoch = JobWatermark(name=EPOCH_WATERMARK, processed_until=EPOCH)
+            db.session.add(epoch)
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            epoch = query.one()
+
+    half_lives = int((now - epoch.processed_until).total_seconds() // (half_life_days * 86400))
+    if half_lives >= RENORMALIZE_HALF_LIVES:
+        # A whole number of half-lives: scaling by a power of two is exact
+        Product.query.update({
+            'popularity_score': Product.popularity_score * 2.0 ** -half_lives,
+            'updated_at': Product.updated_at
+        }, synchronize_session=False)
+        epoch.processed_until += timedelta(days=half_life_days * half_lives)
+    return epoch.processed_until
+
+def _claim_window(now):
+    """
+    Atomically move the sales watermark to ``now``.
+
+    Returns the previous watermark, or None if another worker moved it
+    first (that worker processes the window instead).
+    """
+    watermark = JobWatermark.query.get(WATERMARK)
+    if watermark is None:
+        try:
+            db.session.add(JobWatermark(name=WATERMARK, processed_until=now))
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return EPOCH
+
+    previous = watermark.processed_until
+    claimed = JobWatermark.query.filter_by(
+        name=WATERMARK, processed_until=previous
+    ).update({'processed_until': now}, synchronize_session=False)
+    return previous if claimed else None
+
+def _sales_increments(since, until, half_life_days, epoch):
+    """Decay-weighted units sold per product in (since, until]"""
+    increments = Counter()
+    rows = db.session.query(
+        OrderItem.product_id, OrderItem.quantity, OrderItem.created_at
+    ).join(Order, Order.id == OrderItem.order_id).filter(
+        OrderItem.created_at > since,
+        OrderItem.created_at <= until,
+        Order.status.notin_(EXCLUDED_STATUSES)
+    ).yield_per(2000)
+    for row in rows:
+        increments[row.product_id] += row.quantity * decay_weight(row.created_at, half_life_days, epoch)
+    return increments
+
+def _apply_increments(scores, views):
+    """Add score and view count increments in one executemany"""
+    if not scores and not views:
+        return 0
+    products = Product.__table__
+    statement = update(products).where(
+        products.c.id == bindparam('product_id')
+    ).values(
+        popularity_score=products.c.popularity_score + bindparam('score'),
+        view_count=products.c.view_count + bindparam('views'),
+        # Popularity is not a content change: keep ETags and search watermarks
+        updated_at=products.c.updated_at
+    )
+    rows = [
+        {'product_id': product_id, 'score': scores.get(product_id, 0.0), 'views': views.get(product_id, 0)}
+        for product_id in set(scores) | set(views)
+    ]
+    db.session.execute(statement, rows)
+    return len(rows)
+
+def refresh_popularity():
+    """Flush buffered views and add sales made since the last refresh; returns rows touched"""
+    now = datetime.utcnow()
+    half_life = current_app.config.get('POPULARITY_HALF_LIFE_DAYS', 14)
+    view_weight = current_app.config.get('POPULARITY_VIEW_WEIGHT', 0.05)
+
+    buffer = current_app.extensions.get('product_views')
+    views = buffer.drain() if buffer is not None else Counter()
+
+    try:
+        epoch = _lock_epoch(now, half_life)
+        scores = Counter({
+            product_id: count * view_weight * decay_weight(now, half_life, epoch)
+            for product_id, count in views.items()
+        })
+        since = _claim_window(now)
+        if since is not None:
+            scores.update(_sales_increments(since, now, half_life, epoch))
+        touched = _apply_increments(scores, views)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Keep the views for the next attempt
+        if buffer is not None:
+            buffer.restore(views)
+        raise
+    return touched
+
+def rebuild_popularity():
+    """Recompute every score from the full order history and stored view counts"""
+    now = datetime.utcnow()
+    half_life = current_app.config.get('POPULARITY_HALF_LIFE_DAYS', 14)
+    view_weight = current_app.config.get('POPULARITY_VIEW_WEIGHT', 0.05)
+
+    epoch = _lock_epoch(now, half_life)
+
+    # Stored views carry no timestamps, so they are weighted as of now
+    Product.query.update({
+        'popularity_score': Product.view_count * (view_weight * decay_weight(now, half_life, epoch)),
+        'updated_at': Product.updated_at
+    }, synchronize_session=False)
+
+    watermark = JobWatermark.query.get(WATERMARK)
+    if watermark is None:
+        db.session.add(JobWatermark(name=WATERMARK, processed_until=now))
+    else:
+        watermark.processed_until = now
+
+    _apply_increments(_sales_increments(EPOCH, now, half_life, epoch), {})
+    db.session.commit()
+
+def _refresh_loop(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                refresh_popularity()
+            except Exception:
+                app.logger.exception('Popularity refresh failed')
+            finally:
+                db.session.remove()
+
+def init_popularity(app):
+    """Set up the view buffer, the refresh CLI command and the background refresher"""
+    app.extensions['product_views'] = ViewBuffer()
+
+    @app.cli.command('refresh-popularity')
+    @click.option('--full', is_flag=True, help='Recompute every score from the whole order history')
+    def refresh_popularity_command(full):
+        """Refresh product popularity scores"""
+        if full:
+            rebuild_popularity()
+            print('Popularity scores rebuilt')
+        else:
+            print(f'Popularity refreshed for {refresh_popularity()} products')
+
+    interval = app.config.get('POPULARITY_REFRESH_SECONDS', 0)
+    if interval <= 0 or app.testing:
+        return
+
+    # Started by the first request a worker serves, so CLI commands and
+    # scripts that only create the app never run it; the lock is taken once
+    # and never released
+    started = threading.Lock()
+
+    @app.before_request
+    def start_popularity_refresher():
+        if started.acquire(blocking=False):
+            thread = threading.Thread(target=_refresh_loop, args=(app, interval), daemon=True)
+            thread.start()
@@ -0,0 +1,192 @@
+"""
+Precomputed "frequently bought together" neighbours for product pages.
+
+A batch job streams ``order_items`` sorted by order, turns each order into a
+basket of distinct products and accumulates a sparse, symmetric co-occurrence
+matrix (only the upper triangle is stored: ``pairs[a][b]`` with ``a < b``).
+Pairs are scored by the cosine similarity of the two products' order sets,
+``orders(a, b) / sqrt(orders(a) * orders(b))``, so bestsellers do not become
+everyone's neighbour. The top ``RELATED_TOP_K`` neighbours of each product
+are written to ``related_products``, replacing the previous build in one
+transaction; ``GET /api/products/<id>/related`` reads them back as a single
+primary key range.
+
+Cancelled and refunded orders are left out, and so are pairs from unusually
+large orders (``RELATED_MAX_BASKET``), which would add quadratically many
+pairs that say little about what goes together.
+"""
+import heapq
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from itertools import groupby
+from operator import itemgetter
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.product import RelatedProduct, JobWatermark
+from app.models.order import Order, OrderItem
+from app.utils.cache import invalidate
+from app.utils.popularity import EXCLUDED_STATUSES
+
+WATERMARK = 'related'
+
+# How often a worker checks whether a rebuild is due
+CHECK_SECONDS = 600
+
+def order_baskets(batch_size=5000):
+    """Distinct product ids of each counted order, streamed in order id order"""
+    rows = db.session.query(OrderItem.order_id, OrderItem.product_id).join(
+        Order, Order.id == OrderItem.order_id
+    ).filter(
+        Order.status.notin_(EXCLUDED_STATUSES)
+    ).order_by(OrderItem.order_id).yield_per(batch_size)
+    for _, items in groupby(rows, key=itemgetter(0)):
+        yield {row[1] for row in items}
+
+def cooccurrence(baskets, max_basket=50):
+    """
+    Sparse co-occurrence counts of the given baskets.
+
+    Returns ``(pairs, orders)``: ``pairs[a][b]`` (``a < b``) is the number of
+    baskets holding both products and ``orders[a]`` the number holding ``a``.
+    """
+    pairs = defaultdict(Counter)
+    orders = Counter()
+    for basket in baskets:
+        orders.update(basket)
+        if len(basket) > max_basket:
+            continue
+        basket = sorted(basket)
+        for position, product_id in enumerate(basket):
+            row = pairs[product_id]
+            for other_id in basket[position + 1:]:
+                row[other_id] += 1
+    return pairs, orders
+
+def top_neighbours(pairs, orders, top_k=12, min_orders=2):
+    """``{product id: [(other id, score, shared orders), ...]}``, best first"""
+    candidates = defaultdict(list)
+    for product_id, row in pairs.items():
+        for other_id, shared in row.items():
+            if shared < min_orders:
+                continue
+            score = shared / math.sqrt(orders[product_id] * orders[other_id])
+            # Negated so nsmallest ranks by score, then shared orders, then id
+            candidates[product_id].append((-score, -shared, other_id))
+            candidates[other_id].append((-score, -shared, product_id))
+
+    return {
+        product_id: [(other_id, -score, -shared) for score, shared, other_id in heapq.nsmallest(top_k, items)]
+        for product_id, items in candidates.items()
+    }
+
+def rebuild_related():
+    """Recompute every product's neighbours from the order history; returns products covered"""
+    config = current_app.config
+    pairs, orders = cooccurrence(order_baskets(), config.get('RELATED_MAX_BASKET', 50))
+    neighbours = top_neighbours(
+        pairs, orders, config.get('RELATED_TOP_K', 12), config.get('RELATED_MIN_ORDERS', 2)
+    )
+    rows = [
+        {
+            'product_id': product_id,
+            'position': position,
+            'related_product_id': other_id,
+            'score': score,
+            'orders': shared
+        }
+        for product_id, ranked in neighbours.items()
+        for position, (other_id, score, shared) in enumerate(ranked, start=1)
+    ]
+
+    try:
+        table = RelatedProduct.__table__
+        db.session.execute(table.delete())
+        if rows:
+            db.session.execute(table.insert(), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    invalidate('related')
+    return len(neighbours)
+
+def _claim_run(now, interval):
+    """
+    Atomically record a rebuild starting at ``now`` if the last one is at
+    least ``interval`` seconds old.
+
+    Returns the previous start (to release the claim with), or None if a
+    rebuild is not due or another worker claimed it first.
+    """
+    watermark = JobWatermark.query.get(WATERMARK)
+    if watermark is None:
+        try:
+            db.session.add(JobWatermark(name=WATERMARK, processed_until=now))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return now - timedelta(seconds=interval)
+
+    previous = watermark.processed_until
+    claimed = JobWatermark.query.filter(
+        JobWatermark.name == WATERMARK,
+        JobWatermark.processed_until == previous,
+        JobWatermark.processed_until <= now - timedelta(seconds=interval)
+    ).update({'processed_until': now}, synchronize_session=False)
+    db.session.commit()
+    return previous if claimed else None
+
+def _release_run(now, previous):
+    """Give back a claim whose rebuild failed, so the next check retries"""
+    JobWatermark.query.filter_by(
+        name=WATERMARK, processed_until=now
+    ).update({'processed_until': previous}, synchronize_session=False)
+    db.session.commit()
+
+def _rebuild_loop(app, interval):
+    while True:
+        # Check first after a pause, not while the worker is still booting
+        time.sleep(min(interval, CHECK_SECONDS))
+        with app.app_context():
+            now = datetime.utcnow()
+            try:
+                previous = _claim_run(now, interval)
+                if previous is not None:
+                    try:
+                        rebuild_related()
+                    except Exception:
+                        _release_run(now, previous)
+                        raise
+            except Exception:
+                app.logger.exception('Related products rebuild failed')
+            finally:
+                db.session.remove()
+
+def init_related(app):
+    """Set up the rebuild CLI command and the background rebuilder"""
+
+    @app.cli.command('rebuild-related')
+    def rebuild_related_command():
+        """Rebuild "frequently bought together" neighbours"""
+        print(f'Related products rebuilt for {rebuild_related()} products')
+
+    interval = app.config.get('RELATED_REBUILD_SECONDS', 0)
+    if interval <= 0 or app.testing:
+        return
+
+    # Started by the first request a worker serves, so CLI commands and
+    # scripts that only create the app never run it; the lock is taken once
+    # and never released
+    started = threading.Lock()
+
+    @app.before_request
+    def start_related_rebuilder():
+        if started.acquire(blocking=False):
+            thread = threading.Thread(target=_rebuild_loop, args=(app, interval), daemon=True)
+            thread.start()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Catalog listing benchmark.
+
+Seeds a large catalog, then records the EXPLAIN plan and the latency of
+GET /api/products for every filter/sort combination the listing supports.
+Response and fragment caches are disabled so every request hits the database.
+
+    python benchmark_catalog.py --products 200000 --output baseline.json
+    python benchmark_catalog.py --compare baseline.json
+
+With --compare the run exits with status 1 when a combination got slower than
+the baseline by more than --threshold, or started scanning the whole products
+table or sorting rows where it used to read an index in order. Use
+--database-url to run against MySQL or PostgreSQL instead of a SQLite file.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from urllib.parse import urlencode
+from sqlalchemy import func, insert, text
+from config import config, ProductionConfig
+
+FILTERS = {
+    'all': {},
+    'category': {'category_id': None},  # Filled in with a seeded category
+    'featured': {'is_featured': 'true'},
+    'price_range': {'min_price': '50', 'max_price': '100'},
+    'in_stock': {'in_stock': 'true'},
+    'category_price': {'category_id': None, 'min_price': '50', 'max_price': '100'},
+}
+
+SORTS = (('created_at', 'desc'), ('price', 'asc'), ('name', 'asc'))
+
+def make_config(database_url):
+    class BenchmarkConfig(ProductionConfig):
+        SQLALCHEMY_DATABASE_URI = database_url
+        CACHE_BACKEND = 'none'
+        FRAGMENT_CACHE_MAX_BYTES = 0
+        SEARCH_BACKEND = 'like'
+        POPULARITY_REFRESH_SECONDS = 0
+        RELATED_REBUILD_SECONDS = 0
+    return BenchmarkConfig
+
+def seed_catalog(db, products, categories, seed=42):
+    """
+    Insert ``products`` rows spread over ``categories`` categories.
+
+    Tops up a partly seeded database: existing benchmark categories are
+    reused and new rows are numbered after the existing ones.
+    """
+    from app.models.product import Category, Product
+
+    rng = random.Random(seed)
+    category_ids = [
+        category_id for category_id, in
+        db.session.query(Category.id).filter(Category.slug.like('benchmark-category-%'))
+    ]
+    for i in range(len(category_ids), categories):
+        category = Category(name=f'Benchmark Category {i}', slug=f'benchmark-category-{i}')
+        db.session.add(category)
+        db.session.flush()
+        category_ids.append(category.id)
+    db.session.commit()
+
+    # SKUs are zero-padded, so the largest one is the last index used
+    last_sku = db.session.query(func.max(Product.sku)).filter(Product.sku.like('BENCH-%')).scalar()
+    offset = int(last_sku[len('BENCH-'):]) + 1 if last_sku else 0
+
+    start = datetime.utcnow() - timedelta(days=365)
+    batch = []
+    for i in range(offset, offset + products):
+        created_at = start + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        batch.append({
+            'id': str(uuid.uuid4()),
+            'name': f'Product {rng.randrange(10 ** 8):08d}',
+            'sku': f'BENCH-{i:08d}',
+            'slug': f'bench-{i:08d}',
+            'price': Decimal(rng.randrange(100, 100000)) / 100,
+            'category_id': rng.choice(category_ids),
+            'inventory_quantity': 0 if rng.random() < 0.1 else rng.randrange(1, 500),
+            'is_active': rng.random() < 0.95,
+            'is_featured': rng.random() < 0.05,
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+        if len(batch) >= 5000:
+            db.session.execute(insert(Product), batch)
+            db.session.commit()
+            batch = []
+    if batch:
+        db.session.execute(insert(Product), batch)
+        db.session.commit()
+
+def explain(db, query):
+    """EXPLAIN output of a query as a list of lines"""
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        return [row[3] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+    if dialect.name == 'postgresql':
+        return [row[0] for row in db.session.execute(text(f'EXPLAIN {sql}'))]
+    return [json.dumps(dict(row._mapping), default=str) for row in db.session.execute(text(f'EXPLAIN {sql}'))]
+
+def plan_flags(dialect_name, plan):
+    """(full table scan, explicit sort step) for a plan"""
+    joined = '\n'.join(plan)
+    if dialect_name == 'sqlite':
+        full_scan = any(line.strip() == 'SCAN products' for line in plan)
+        # Also "FOR RIGHT PART OF ORDER BY" / "FOR LAST TERM OF ORDER BY": a partial sort
+        sort_step = re.search(r'TEMP B-TREE FOR (RIGHT PART OF |LAST TERM OF )?ORDER BY', joined) is not None
+    elif dialect_name == 'postgresql':
+        full_scan = 'Seq Scan on products' in joined
+        sort_step = 'Sort Key' in joined and 'Incremental Sort' not in joined
+    else:
+        full_scan = '"type": "ALL"' in joined
+        sort_step = 'Using filesort' in joined
+    return full_scan, sort_step
+
+def run(app, db, repeat, per_page):
+    from app.models.product import Category, Product
+    from app.routes.products import build_product_query, product_order_field
+    from app.utils.pagination import apply_keyset
+    from app.schemas.product import ProductSearchSchema
+
+    category_id = db.session.query(Category.id).order_by(Category.slug).first()[0]
+    client = app.test_client()
+    results = []
+
+    for filter_name, filters in FILTERS.items():
+        filters = {key: value or category_id for key, value in filters.items()}
+        for sort_by, sort_order in SORTS:
+            # The page query exactly as list_products builds it
+            params = ProductSearchSchema().load(dict(filters, sort_by=sort_by, sort_order=sort_order))
+            query, _ = build_product_query(params)
+            _, order_field = product_order_field(sort_by)
+            plan = explain(db, apply_keyset(query, order_field, Product.id, sort_order).limit(per_page))
+            full_scan, sort_step = plan_flags(db.engine.dialect.name, plan)
+
+            url = '/api/products?' + urlencode(dict(filters, sort_by=sort_by, sort_order=sort_order, per_page=per_page))
+            client.get(url)  # Warm up
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{url} returned {response.status_code}')
+
+            timings.sort()
+            results.append({
+                'name': f'{filter_name}/{sort_by}_{sort_order}',
+                'url': url.replace(category_id, '{category_id}'),
+                'p50_ms': round(statistics.median(timings), 2),
+                'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+                'full_scan': full_scan,
+                'sort_step': sort_step,
+                'plan': plan,
+            })
+            print(f"{results[-1]['name']:<36} p50 {results[-1]['p50_ms']:>8.2f} ms  "
+                  f"p95 {results[-1]['p95_ms']:>8.2f} ms"
+                  f"{'  FULL SCAN' if full_scan else ''}{'  SORT' if sort_step else ''}")
+
+    return results
+
+def compare(results, baseline, threshold):
+    """Regressions of ``results`` against a baseline report"""
+    previous = {result['name']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(result['name'])
+        if before is None:
+            continue
+        if result['p50_ms'] > before['p50_ms'] * threshold:
+            regressions.append(f"{result['name']}: p50 {before['p50_ms']} -> {result['p50_ms']} ms")
+        if result['full_scan'] and not before['full_scan']:
+            regressions.append(f"{result['name']}: now scans the whole products table")
+        if result['sort_step'] and not before['sort_step']:
+            regressions.append(f"{result['name']}: now sorts rows instead of reading an index in order")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('BENCHMARK_DATABASE_URL'),
+                        help='Database to seed and query (default: a temporary SQLite file)')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20, help='Timed requests per combination')
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--output', help='Write the report as JSON')
+    parser.add_argument('--compare', help='Baseline JSON report to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.5, help='Allowed p50 slowdown factor')
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+
+    config['benchmark'] = make_config(database_url)
+    from app import create_app, db
+    from app.models.product import Product
+
+    app = create_app('benchmark')
+    with app.app_context():
+        db.create_all()
+        existing = Product.query.count()
+        if existing < args.products:
+            print(f'Seeding {args.products - existing} products...')
+            seed_catalog(db, args.products - existing, args.categories)
+        results = run(app, db, args.repeat, args.per_page)
+        dialect_name = db.engine.dialect.name
+
+    report = {
+        'database': dialect_name,
+        'products': args.products,
+        'created_at': datetime.utcnow().isoformat(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f'Report written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        if regressions:
+            print('\nRegressions:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print('\nNo regressions against the baseline')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -27,6 +27,51 @@ class Config:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Search Configuration (auto, memory, like, mysql, postgresql, sqlite)
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+    SEARCH_MAX_HITS = int(os.environ.get('SEARCH_MAX_HITS', 1000))
+    SEARCH_INDEX_REFRESH_SECONDS = int(os.environ.get('SEARCH_INDEX_REFRESH_SECONDS', 30))  # Picks up other workers' writes
+    SUGGEST_REBUILD_SECONDS = int(os.environ.get('SUGGEST_REBUILD_SECONDS', 300))  # Full suggest rebuild (popularity, deletes)
+    
+    # Response Cache Configuration (memory, redis or none)
+    # memory is per worker: writes only invalidate the worker that served them,
+    # so other workers serve stale responses for up to CACHE_DEFAULT_TTL
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or (
+        'redis' if os.environ.get('CACHE_REDIS_URL') or os.environ.get('REDIS_URL') else 'memory'
+    )
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') or os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL', 60))  # seconds
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))  # memory backend only
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 33554432))  # Encoded product JSON per worker; 0 disables
+    
+    # Facet Configuration
+    FACET_PRICE_BUCKETS = [
+        int(bound) for bound in os.environ.get('FACET_PRICE_BUCKETS', '25,50,100,250,500').split(',')
+    ]  # Upper bounds of the price buckets; the last bucket is open-ended
+    FACET_CACHE_ENABLED = os.environ.get('FACET_CACHE_ENABLED', 'true').lower() == 'true'
+    
+    # Cart Configuration
+    # Per-user cache of /cart/count and /cart/summary; only safe across workers with CACHE_BACKEND=redis
+    CART_SUMMARY_CACHE_ENABLED = os.environ.get('CART_SUMMARY_CACHE_ENABLED', 'false').lower() == 'true'
+    
+    # Popularity Configuration (sort_by=popularity)
+    POPULARITY_HALF_LIFE_DAYS = float(os.environ.get('POPULARITY_HALF_LIFE_DAYS', 14))
+    POPULARITY_VIEW_WEIGHT = float(os.environ.get('POPULARITY_VIEW_WEIGHT', 0.05))  # A view vs one unit sold
+    POPULARITY_REFRESH_SECONDS = int(os.environ.get('POPULARITY_REFRESH_SECONDS', 300))  # 0 disables the background refresher
+    
+    # Related Products Configuration ("frequently bought together")
+    RELATED_TOP_K = int(os.environ.get('RELATED_TOP_K', 12))  # Neighbours stored per product
+    RELATED_MIN_ORDERS = int(os.environ.get('RELATED_MIN_ORDERS', 2))  # Shared orders before a pair counts
+    RELATED_MAX_BASKET = int(os.environ.get('RELATED_MAX_BASKET', 50))  # Larger orders add no pairs
+    RELATED_REBUILD_SECONDS = int(os.environ.get('RELATED_REBUILD_SECONDS', 86400))  # 0 disables the background rebuild
+    
+    # Bulk Import Configuration
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))  # Rows per lookup/INSERT/commit
+    IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 1000))  # Row errors listed in the report
+    IMPORT_MAX_CONTENT_LENGTH = int(os.environ.get('IMPORT_MAX_CONTENT_LENGTH', 268435456))  # 256MB, streamed
+    BULK_UPDATE_CHUNK_SIZE = int(os.environ.get('BULK_UPDATE_CHUNK_SIZE', 1000))  # SKUs per UPDATE statement
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))  # Rows per server-side cursor fetch
+    
     # PayPal Configuration
     PAYPAL_CLIENT_ID = os.environ.get('PAYPAL_CLIENT_ID')
     PAYPAL_CLIENT_SECRET = os.environ.get('PAYPAL_CLIENT_SECRET')
@@ -36,6 +81,18 @@ class Config:
     # Upload Configuration
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or 'uploads'
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16777216))  # 16MB
+    MEDIA_URL_PREFIX = os.environ.get('MEDIA_URL_PREFIX', '/media')  # URL path of files under UPLOAD_FOLDER
+    MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE', 31536000))  # Content-hashed media are immutable
+    MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE', '')  # '', X-Sendfile or X-Accel-Redirect (proxy sends the file)
+    MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media')  # nginx internal location
+    IMAGE_VARIANTS = {
+        name: int(size) for name, size in (
+            item.split(':') for item in os.environ.get('IMAGE_VARIANTS', 'thumb:160,card:480,zoom:1600').split(',')
+        )
+    }  # Resized copies of uploaded images: name -> longest edge in pixels
+    IMAGE_VARIANT_FORMAT = os.environ.get('IMAGE_VARIANT_FORMAT', 'WEBP')
+    IMAGE_VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))  # Processes rendering variants; 0 renders in the request
     
     # CORS Configuration
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000').split(',')
@@ -60,6 +117,10 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    CACHE_BACKEND = 'memory'
+    POPULARITY_REFRESH_SECONDS = 0
+    RELATED_REBUILD_SECONDS = 0
+    IMAGE_WORKERS = 0
 
 config = {
     'development': DevelopmentConfig,
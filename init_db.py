@@ -7,8 +7,12 @@ import os
 import sys
 from app import create_app, db
 from app.models.user import User
-from app.models.product import Product, Category, ProductImage
+from app.models.product import (
+    Product, Category, CategoryClosure, ProductImage, create_search_index, has_search_index
+)
 from app.models.cart import Cart
+from sqlalchemy import text
+from sqlalchemy.schema import CreateColumn
 from werkzeug.security import generate_password_hash
 import uuid
 
@@ -125,6 +129,84 @@ def create_sample_data():
     db.session.commit()
     print("✅ Sample data created successfully!")
 
+def add_missing_columns():
+    """
+    Add columns declared on the models to tables created before them.
+
+    Returns ``(added, failed)``: added column names and ``(name, error)``
+    pairs. NOT NULL columns are only added where they have a server default
+    to fill existing rows with.
+    """
+    added, failed = [], []
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            name = f'{table.name}.{column.name}'
+            try:
+                with db.engine.begin() as connection:
+                    definition = CreateColumn(column).compile(dialect=connection.dialect)
+                    table_name = connection.dialect.identifier_preparer.format_table(table)
+                    connection.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {definition}'))
+                added.append(name)
+            except Exception as e:
+                failed.append((name, e))
+    return added, failed
+
+def create_missing_indexes():
+    """
+    Add indexes declared on the models to tables created before them.
+
+    Returns ``(created, failed)`` like add_missing_columns(); one failing
+    index does not stop the others.
+    """
+    created, failed = [], []
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {item['name'] for item in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(db.engine)
+                created.append(index.name)
+            except Exception as e:
+                failed.append((index.name, e))
+    return created, failed
+
+def upgrade_schema():
+    """Bring tables created by an earlier version up to the models; returns the failures"""
+    # create_all() skips existing tables: add their new columns, then the
+    # indexes that may cover them
+    added, failed = add_missing_columns()
+    for name in added:
+        print(f"✅ Added column {name}")
+    created, failed_indexes = create_missing_indexes()
+    for name in created:
+        print(f"✅ Created index {name}")
+
+    failed += failed_indexes
+
+    # The native full-text index is DDL outside the metadata
+    with db.engine.connect() as connection:
+        search_index_missing = not has_search_index(connection)
+    if search_index_missing:
+        try:
+            with db.engine.begin() as connection:
+                create_search_index(connection)
+            print("✅ Created full-text search index")
+        except Exception as e:
+            failed.append(('full-text search index', e))
+
+    for name, error in failed:
+        print(f"❌ Failed to add {name}: {error}")
+    return failed
+
 def init_database():
     """Initialize database with tables and optional sample data"""
     app = create_app()
@@ -132,7 +214,8 @@ def init_database():
     with app.app_context():
         try:
             # Test database connection
-            db.engine.execute('SELECT 1')
+            with db.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
             print("✅ Database connection successful!")
         except Exception as e:
             print(f"❌ Database connection failed: {e}")
@@ -146,6 +229,15 @@ def init_database():
             print(f"❌ Failed to create tables: {e}")
             sys.exit(1)
 
+        schema_failures = upgrade_schema()
+
+        # Backfill the category hierarchy index for databases that predate it
+        CategoryClosure.rebuild()
+
+        if schema_failures:
+            print("❌ Database schema is not up to date, see the errors above")
+            sys.exit(1)
+
         # Check environment - only create sample data in development
         flask_env = os.environ.get('FLASK_ENV', 'development')
         create_samples = os.environ.get('CREATE_SAMPLE_DATA', 'true').lower() == 'true'
@@ -1,9 +1,11 @@
 import pytest
 import tempfile
 import os
+from contextlib import contextmanager
+from sqlalchemy import event
 from app import create_app, db
 from app.models.user import User
-from app.models.product import Product, Category
+from app.models.product import Product, Category, ProductImage
 from app.models.cart import Cart
 from flask_jwt_extended import create_access_token
 
@@ -39,84 +41,118 @@ def runner(app):
 @pytest.fixture
 def user(app):
     """Create test user"""
-    with app.app_context():
-        user = User(
-            email='test@example.com',
-            password='TestPassword123',
-            first_name='Test',
-            last_name='User'
-        )
-        db.session.add(user)
-        db.session.commit()
-        return user
+    user = User(
+        email='test@example.com',
+        password='TestPassword123',
+        first_name='Test',
+        last_name='User'
+    )
+    db.session.add(user)
+    db.session.commit()
+    return user
 
 @pytest.fixture
 def admin_user(app):
     """Create test admin user"""
-    with app.app_context():
-        admin = User(
-            email='admin@example.com',
-            password='AdminPassword123',
-            first_name='Admin',
-            last_name='User'
-        )
-        admin.is_admin = True
-        db.session.add(admin)
-        db.session.commit()
-        return admin
+    admin = User(
+        email='admin@example.com',
+        password='AdminPassword123',
+        first_name='Admin',
+        last_name='User'
+    )
+    admin.is_admin = True
+    db.session.add(admin)
+    db.session.commit()
+    return admin
 
 @pytest.fixture
 def category(app):
     """Create test category"""
-    with app.app_context():
-        category = Category(
-            name='Test Category',
-            slug='test-category',
-            description='Test category description'
-        )
-        db.session.add(category)
-        db.session.commit()
-        return category
+    category = Category(
+        name='Test Category',
+        slug='test-category',
+        description='Test category description'
+    )
+    db.session.add(category)
+    db.session.commit()
+    return category
 
 @pytest.fixture
 def product(app, category):
     """Create test product"""
-    with app.app_context():
-        product = Product(
-            name='Test Product',
-            description='Test product description',
-            sku='TEST-001',
-            slug='test-product',
-            price=29.99,
-            category_id=category.id,
-            inventory_quantity=10
-        )
-        db.session.add(product)
-        db.session.commit()
-        return product
+    product = Product(
+        name='Test Product',
+        description='Test product description',
+        sku='TEST-001',
+        slug='test-product',
+        price=29.99,
+        category_id=category.id,
+        inventory_quantity=10
+    )
+    db.session.add(product)
+    db.session.commit()
+    return product
 
 @pytest.fixture
 def auth_headers(app, user):
     """Create authorization headers for test user"""
-    with app.app_context():
-        access_token = create_access_token(identity=user.id)
-        return {'Authorization': f'Bearer {access_token}'}
+    access_token = create_access_token(identity=user.id)
+    return {'Authorization': f'Bearer {access_token}'}
 
 @pytest.fixture
 def admin_headers(app, admin_user):
     """Create authorization headers for admin user"""
-    with app.app_context():
-        access_token = create_access_token(identity=admin_user.id)
-        return {'Authorization': f'Bearer {access_token}'}
+    access_token = create_access_token(identity=admin_user.id)
+    return {'Authorization': f'Bearer {access_token}'}
 
 @pytest.fixture
 def cart_with_items(app, user, product):
     """Create cart with items for testing"""
-    with app.app_context():
-        cart = Cart(user_id=user.id)
-        db.session.add(cart)
-        db.session.flush()
+    cart = Cart(user_id=user.id)
+    db.session.add(cart)
+    db.session.flush()
+    
+    cart.add_item(product, quantity=2)
+    db.session.commit()
+    return cart
+
+@pytest.fixture
+def count_queries(app):
+    """Context manager that records SQL statements executed inside the block"""
+    @contextmanager
+    def counter():
+        statements = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
         
-        cart.add_item(product, quantity=2)
-        db.session.commit()
-        return cart
+        # Start from a cold identity map so lazy loads are not hidden
+        db.session.expire_all()
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    return counter
+
+@pytest.fixture
+def catalog(app, category):
+    """Create a page worth of products with images"""
+    products = []
+    for i in range(10):
+        product = Product(
+            name=f'Catalog Product {i}',
+            sku=f'CAT-{i:03d}',
+            slug=f'catalog-product-{i}',
+            price=10 + i,
+            category_id=category.id,
+            inventory_quantity=10
+        )
+        product.images = [
+            ProductImage(image_url=f'https://example.com/{i}-{n}.jpg', sort_order=n, is_primary=n == 0)
+            for n in range(2)
+        ]
+        products.append(product)
+    db.session.add_all(products)
+    db.session.commit()
+    return products
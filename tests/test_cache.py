@@ -0,0 +1,95 @@
+import pytest
+import json
+import time
+from app.utils.cache import MemoryCache, RedisCache
+
+class TestCacheBackends:
+    """Test response cache backends"""
+    
+    def test_memory_cache_lru_eviction(self):
+        """Test least recently used entries are evicted first"""
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        
+        assert cache.get('a') == '1'
+        assert cache.get('b') is None
+        assert cache.get('c') == '3'
+    
+    def test_memory_cache_ttl(self):
+        """Test entries expire after their TTL"""
+        cache = MemoryCache()
+        cache.set('a', '1', ttl=0.01)
+        time.sleep(0.02)
+        
+        assert cache.get('a') is None
+    
+    def test_memory_cache_tags(self):
+        """Test invalidating a tag drops every entry carrying it"""
+        cache = MemoryCache()
+        cache.set('detail', '1', tags=['product:1'])
+        cache.set('list', '2', tags=['products'])
+        cache.set('other', '3', tags=['product:2'])
+        
+        cache.invalidate_tags('product:1', 'products')
+        
+        assert cache.get('detail') is None
+        assert cache.get('list') is None
+        assert cache.get('other') == '3'
+    
+    def test_redis_cache_tags(self):
+        """Test the Redis backend stores and invalidates by tag"""
+        fakeredis = pytest.importorskip('fakeredis')
+        cache = RedisCache(fakeredis.FakeRedis())
+        cache.set('detail', '1', tags=['product:1'])
+        cache.set('other', '2', tags=['product:2'])
+        
+        assert cache.get('detail') == b'1'
+        cache.invalidate_tags('product:1')
+        assert cache.get('detail') is None
+        assert cache.get('other') == b'2'
+
+class TestCatalogCache:
+    """Test catalog reads are cached and invalidated by writes"""
+    
+    def test_product_list_cached_until_write(self, client, admin_headers, product):
+        """Test listing is served from cache and refreshed after an update"""
+        response = client.get('/api/products?per_page=20')
+        assert response.headers['X-Cache'] == 'MISS'
+        
+        # Same normalized parameters hit the same entry
+        response = client.get('/api/products')
+        assert response.headers['X-Cache'] == 'HIT'
+        
+        client.put(f'/api/products/{product.id}',
+                   data=json.dumps({'name': 'Renamed Product'}),
+                   content_type='application/json',
+                   headers=admin_headers)
+        
+        response = client.get('/api/products')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data)['products'][0]['name'] == 'Renamed Product'
+    
+    def test_product_detail_invalidated_by_category_update(self, client, admin_headers, product, category):
+        """Test product detail embeds fresh category data after a category write"""
+        client.get(f'/api/products/{product.id}')
+        response = client.get(f'/api/products/{product.id}')
+        assert response.headers['X-Cache'] == 'HIT'
+        
+        client.put(f'/api/products/categories/{category.id}',
+                   data=json.dumps({'name': 'Renamed Category'}),
+                   content_type='application/json',
+                   headers=admin_headers)
+        
+        response = client.get(f'/api/products/{product.id}')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data)['product']['category']['name'] == 'Renamed Category'
+    
+    def test_missing_product_not_cached(self, client):
+        """Test 404s are not cached"""
+        response = client.get('/api/products/non-existent-id')
+        
+        assert response.status_code == 404
+        assert 'X-Cache' not in response.headers
@@ -1,5 +1,16 @@
 import pytest
 import json
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy.dialects import mysql
+from app import db
+from app.models.cart import Cart, CartItem, _mysql_upsert_statement, _upsert_mysql
+
+def add(client, headers, product, quantity):
+    return client.post('/api/cart/add',
+                       data=json.dumps({'product_id': product.id, 'quantity': quantity}),
+                       content_type='application/json',
+                       headers=headers)
 
 class TestCart:
     """Test cart endpoints"""
@@ -35,7 +46,7 @@ class TestCart:
     def test_add_to_cart_invalid_product(self, client, auth_headers):
         """Test adding non-existent product to cart"""
         data = {
-            'product_id': 'non-existent-id',
+            'product_id': '00000000-0000-0000-0000-000000000000',
             'quantity': 1
         }
         
@@ -132,6 +143,104 @@ class TestCart:
         assert 'count' in response_data
         assert response_data['count'] == 2
     
+    def test_cart_summary(self, client, auth_headers, cart_with_items, count_queries):
+        """Test count and summary are each one aggregate query"""
+        with count_queries() as queries:
+            count = client.get('/api/cart/count', headers=auth_headers)
+            summary = client.get('/api/cart/summary', headers=auth_headers)
+        
+        assert json.loads(count.data) == {'count': 2}
+        assert json.loads(summary.data) == {'lines': 1, 'total_items': 2, 'subtotal': 59.98, 'total_weight': 0.0}
+        assert len(queries) == 2
+    
+    def test_cart_summary_cache(self, app, client, auth_headers, cart_with_items, count_queries):
+        """Test the per-user summary cache is invalidated by cart writes"""
+        app.config['CART_SUMMARY_CACHE_ENABLED'] = True
+        item_id = cart_with_items.items[0].id
+        
+        assert json.loads(client.get('/api/cart/count', headers=auth_headers).data)['count'] == 2
+        with count_queries() as queries:
+            response = client.get('/api/cart/count', headers=auth_headers)
+        assert response.headers['X-Cache'] == 'HIT'
+        assert queries == []
+        
+        client.put(f'/api/cart/update/{item_id}', data=json.dumps({'quantity': 5}),
+                   content_type='application/json', headers=auth_headers)
+        assert json.loads(client.get('/api/cart/count', headers=auth_headers).data)['count'] == 5
+        assert json.loads(client.get('/api/cart/summary', headers=auth_headers).data)['subtotal'] == 149.95
+        
+        client.delete('/api/cart/clear', headers=auth_headers)
+        assert json.loads(client.get('/api/cart/count', headers=auth_headers).data)['count'] == 0
+        assert json.loads(client.get('/api/cart/summary', headers=auth_headers).data)['lines'] == 0
+    
+    def test_batch_items(self, client, auth_headers, user, catalog, count_queries):
+        """Test a batch of adds and sets is applied at once and returns the cart once"""
+        add(client, auth_headers, catalog[0], 2)
+        add(client, auth_headers, catalog[1], 1)
+        data = json.dumps({'items': [
+            {'product_id': catalog[0].id, 'quantity': 3},
+            {'product_id': catalog[1].id, 'quantity': 0, 'action': 'set'},
+            {'product_id': catalog[2].id, 'quantity': 4},
+            {'product_id': catalog[3].id, 'quantity': 1},
+            {'product_id': catalog[3].id, 'quantity': 2},
+        ]})
+        
+        with count_queries() as queries:
+            response = client.post('/api/cart/items:batch', data=data,
+                                   content_type='application/json', headers=auth_headers)
+        
+        assert response.status_code == 200
+        items = json.loads(response.data)['cart']['items']
+        assert sorted((item['product']['sku'], item['quantity']) for item in items) == [
+            ('CAT-000', 5), ('CAT-002', 4), ('CAT-003', 3)
+        ]
+        selects = [statement for statement in queries if statement.lstrip().startswith('SELECT')]
+        assert len(selects) <= 7
+    
+    def test_batch_items_all_or_nothing(self, client, auth_headers, product):
+        """Test one failing operation leaves the cart untouched"""
+        add(client, auth_headers, product, 2)
+        response = client.post('/api/cart/items:batch', data=json.dumps({'items': [
+            {'product_id': product.id, 'quantity': 1},
+            {'product_id': product.id, 'quantity': 8},
+            {'product_id': '00000000-0000-0000-0000-000000000000', 'quantity': 1},
+        ]}), content_type='application/json', headers=auth_headers)
+        
+        assert response.status_code == 400
+        errors = json.loads(response.data)['items']
+        assert [(error['index'], error['error']) for error in errors] == [
+            (1, 'Insufficient inventory'), (2, 'Product not found')
+        ]
+        assert [item.quantity for item in CartItem.query.all()] == [2]
+        
+        response = client.post('/api/cart/items:batch', data=json.dumps({'items': [
+            {'product_id': product.id, 'quantity': 0}
+        ]}), content_type='application/json', headers=auth_headers)
+        assert response.status_code == 400
+    
+    def test_batch_items_validated_before_writing(self, client, auth_headers, product):
+        """Test a rejected batch creates no cart and summed adds are capped"""
+        product.inventory_quantity = 5000
+        db.session.commit()
+        
+        response = client.post('/api/cart/items:batch', data=json.dumps({'items': [
+            {'product_id': product.id, 'quantity': 600},
+            {'product_id': product.id, 'quantity': 600},
+        ]}), content_type='application/json', headers=auth_headers)
+        
+        assert response.status_code == 400
+        errors = json.loads(response.data)['items']
+        assert [(error['index'], error['error'], error['max_quantity']) for error in errors] == [
+            (1, 'Quantity exceeds the maximum', 999)
+        ]
+        assert Cart.query.count() == 0
+        
+        response = client.post('/api/cart/items:batch', data=json.dumps({'items': [
+            {'product_id': product.id, 'quantity': 999},
+        ]}), content_type='application/json', headers=auth_headers)
+        assert response.status_code == 200
+        assert [item.quantity for item in CartItem.query.all()] == [999]
+    
     def test_validate_cart(self, client, auth_headers, cart_with_items):
         """Test validating cart"""
         response = client.post('/api/cart/validate',
@@ -143,6 +252,88 @@ class TestCart:
         assert 'issues' in response_data
         assert 'cart' in response_data
     
+    def test_reads_do_not_create_cart(self, client, auth_headers):
+        """Test a user without a cart reads an empty one and nothing is written"""
+        response = client.get('/api/cart', headers=auth_headers)
+        assert response.status_code == 200
+        response_data = json.loads(response.data)['cart']
+        assert response_data['id'] is None
+        assert response_data['items'] == []
+        
+        assert json.loads(client.get('/api/cart/count', headers=auth_headers).data)['count'] == 0
+        assert client.post('/api/cart/validate', headers=auth_headers).status_code == 200
+        assert client.delete('/api/cart/clear', headers=auth_headers).status_code == 200
+        assert Cart.query.count() == 0
+    
+    def test_add_upserts_with_stock_check(self, client, auth_headers, product):
+        """Test adds accumulate into one item and the total is checked against stock"""
+        assert add(client, auth_headers, product, 4).status_code == 200
+        response = add(client, auth_headers, product, 6)
+        assert response.status_code == 200
+        assert json.loads(response.data)['cart']['total_items'] == 10
+        
+        # 10 in stock, all of them already in the cart
+        response = add(client, auth_headers, product, 1)
+        assert response.status_code == 400
+        response_data = json.loads(response.data)
+        assert response_data['error'] == 'Insufficient inventory'
+        assert response_data['current_in_cart'] == 10
+        
+        assert Cart.query.count() == 1
+        assert [item.quantity for item in CartItem.query.all()] == [10]
+    
+    def test_add_caps_summed_quantity(self, client, auth_headers, product):
+        """Test repeated adds of an untracked product cannot pass the cart maximum"""
+        product.track_inventory = False
+        db.session.commit()
+        assert add(client, auth_headers, product, 999).status_code == 200
+        
+        response = add(client, auth_headers, product, 999)
+        assert response.status_code == 400
+        response_data = json.loads(response.data)
+        assert response_data['error'] == 'Quantity exceeds the maximum'
+        assert response_data['current_in_cart'] == 999
+        assert [item.quantity for item in CartItem.query.all()] == [999]
+    
+    def test_mysql_upsert(self, app, monkeypatch):
+        """Test the MySQL upsert reads the new row from a derived table and tells its affected rows apart"""
+        sql = str(_mysql_upsert_statement('user', 'product', 1, 'item', datetime.utcnow()).compile(dialect=mysql.dialect()))
+        outer_select, derived = sql.split('FROM (SELECT', 1)
+        assert 'carts' not in outer_select and 'products' not in outer_select
+        assert ') AS new_item ON DUPLICATE KEY UPDATE updated_at = CASE' in derived
+        
+        # (affected rows with CLIENT_FOUND_ROWS, new id found) -> written
+        for affected, new_row, written in ((0, None, False), (2, None, True), (1, ('item',), True), (1, None, False)):
+            results = iter([SimpleNamespace(rowcount=affected), SimpleNamespace(first=lambda: new_row)])
+            monkeypatch.setattr(db.session, 'execute', lambda statement: next(results))
+            assert _upsert_mysql('user', 'product', 1, 'item', datetime.utcnow()) is written
+    
+    def test_add_unavailable_product(self, client, auth_headers, product):
+        """Test inactive products and untracked inventory"""
+        product.track_inventory = False
+        db.session.commit()
+        assert add(client, auth_headers, product, 50).status_code == 200
+        
+        product.is_active = False
+        db.session.commit()
+        response = add(client, auth_headers, product, 1)
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'Product is not available'
+    
+    def test_add_query_budget(self, client, auth_headers, product, count_queries):
+        """Test adding to an existing cart is one write plus the cart reload"""
+        add(client, auth_headers, product, 1)
+        data = json.dumps({'product_id': product.id, 'quantity': 1})
+        
+        with count_queries() as queries:
+            response = client.post('/api/cart/add', data=data,
+                                   content_type='application/json', headers=auth_headers)
+        
+        assert response.status_code == 200
+        writes = [statement for statement in queries if not statement.lstrip().startswith('SELECT')]
+        assert len(writes) == 1
+        assert len(queries) <= 5
+    
     def test_cart_unauthorized(self, client):
         """Test cart operations without authentication"""
         response = client.get('/api/cart')
@@ -153,3 +344,43 @@ class TestCart:
         
         response = client.delete('/api/cart/clear')
         assert response.status_code == 401
+    
+    def test_get_cart_query_budget(self, client, auth_headers, user, catalog, count_queries):
+        """Test cart serialization stays within its query budget"""
+        cart = Cart(user_id=user.id)
+        db.session.add(cart)
+        db.session.flush()
+        for product in catalog:
+            cart.add_item(product, quantity=1)
+        db.session.commit()
+        
+        with count_queries() as queries:
+            response = client.get('/api/cart', headers=auth_headers)
+        
+        assert response.status_code == 200
+        assert len(json.loads(response.data)['cart']['items']) == len(catalog)
+        assert len(queries) <= 4
+    
+    def test_cart_embeds_product_cards(self, client, auth_headers, user, catalog):
+        """Test cart items embed a compact product card and totals cover every item"""
+        catalog[0].weight = 1.5
+        catalog[1].weight = 0.25
+        cart = Cart(user_id=user.id)
+        db.session.add(cart)
+        db.session.flush()
+        cart.add_item(catalog[0], quantity=2)
+        cart.add_item(catalog[1], quantity=4)
+        cart.add_item(catalog[2], quantity=1)
+        db.session.commit()
+        
+        response = client.get('/api/cart', headers=auth_headers)
+        
+        response_data = json.loads(response.data)['cart']
+        assert response_data['total_items'] == 7
+        assert response_data['subtotal'] == 10 * 2 + 11 * 4 + 12
+        assert response_data['total_weight'] == 4.0
+        
+        product = next(item['product'] for item in response_data['items'] if item['quantity'] == 2)
+        assert set(product) == {'id', 'name', 'slug', 'sku', 'price', 'is_active', 'is_in_stock', 'primary_image'}
+        assert product['sku'] == 'CAT-000'
+        assert product['primary_image']['image_url'] == 'https://example.com/0-0.jpg'
@@ -0,0 +1,97 @@
+import pytest
+import json
+from app.utils.fragments import FragmentCache, RawJSON, encode_json
+
+class TestFragmentCache:
+    """Test the pre-encoded product fragment cache"""
+
+    def test_lru_bounded_by_size(self):
+        """Test least recently used fragments are dropped past max_bytes"""
+        cache = FragmentCache(max_bytes=10)
+        cache.set(('a', 1), 'a', '"aaaa"')
+        cache.set(('b', 1), 'b', '"bb"')
+        cache.get(('a', 1))
+        cache.set(('c', 1), 'c', '"cc"')
+
+        assert cache.get(('b', 1)) is None
+        assert cache.get(('a', 1)) == '"aaaa"'
+        assert cache.size == 10
+
+    def test_evict_by_product(self):
+        """Test evicting a product drops all of its fieldsets"""
+        cache = FragmentCache()
+        cache.set(('a', 1, ('id',)), 'a', '{"id":"a"}')
+        cache.set(('a', 1, ('id', 'name')), 'a', '{"id":"a","name":"A"}')
+        cache.set(('b', 1, ('id',)), 'b', '{"id":"b"}')
+
+        cache.evict('a')
+
+        assert len(cache) == 1
+        assert cache.size == len('{"id":"b"}')
+
+    def test_encode_json_splices_fragments(self, app):
+        """Test RawJSON values are written verbatim, everything else as usual"""
+        payload = {
+            'products': [RawJSON('{"id": "a"}'), RawJSON('{"id": "b"}')],
+            'note': 'fragment\x00text'
+        }
+
+        assert json.loads(encode_json(payload)) == {
+            'products': [{'id': 'a'}, {'id': 'b'}],
+            'note': 'fragment\x00text'
+        }
+
+    def test_encode_json_ignores_placeholder_lookalikes(self, app):
+        """Test strings shaped like placeholders are encoded as data, not spliced"""
+        payload = {
+            'products': [RawJSON('{"id": "a"}')],
+            'names': ['\x00fragment:0\x00', '\x00fragment:7\x00']
+        }
+
+        assert json.loads(encode_json(payload)) == {
+            'products': [{'id': 'a'}],
+            'names': ['\x00fragment:0\x00', '\x00fragment:7\x00']
+        }
+
+    def test_listing_reuses_fragments(self, app, client, catalog):
+        """Test a second listing with other filters reuses cached fragments"""
+        cache = app.extensions['fragment_cache']
+        cache.clear()
+
+        first = json.loads(client.get('/api/products?per_page=20').data)['products']
+        cached = len(cache)
+        second = json.loads(client.get('/api/products?per_page=20&min_price=0').data)['products']
+
+        assert cached == len(catalog)
+        assert len(cache) == cached
+        assert first == second
+        assert set(first[0]) == {'id', 'name', 'slug', 'price', 'primary_image'}
+
+    def test_fragments_follow_writes(self, client, admin_headers, product, category):
+        """Test product and category updates are reflected in listings"""
+        client.get('/api/products?fields=full')
+
+        client.put(f'/api/products/{product.id}',
+                   data=json.dumps({'name': 'Fresh Name'}),
+                   content_type='application/json',
+                   headers=admin_headers)
+        client.put(f'/api/products/categories/{category.id}',
+                   data=json.dumps({'name': 'Fresh Category'}),
+                   content_type='application/json',
+                   headers=admin_headers)
+
+        listed = json.loads(client.get('/api/products?fields=full').data)['products'][0]
+        assert listed['name'] == 'Fresh Name'
+        assert listed['category']['name'] == 'Fresh Category'
+
+    def test_cart_embeds_fragments(self, client, auth_headers, product):
+        """Test cart responses splice product fragments correctly"""
+        response = client.post('/api/cart/add',
+                               data=json.dumps({'product_id': product.id, 'quantity': 2}),
+                               content_type='application/json',
+                               headers=auth_headers)
+
+        assert response.mimetype == 'application/json'
+        item = json.loads(response.data)['cart']['items'][0]
+        assert item['product']['sku'] == product.sku
+        assert item['quantity'] == 2
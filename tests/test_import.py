@@ -0,0 +1,225 @@
+import pytest
+import csv
+import io
+import json
+from app import db
+from app.models.product import Product
+
+def csv_body(category, rows):
+    lines = ['sku,name,slug,price,inventory_quantity,category_id']
+    lines += [f'{sku},{name},{slug},{price},5,{category_id or category.id}' for sku, name, slug, price, category_id in rows]
+    return '\n'.join(lines) + '\n'
+
+class TestProductImport:
+    """Test bulk product import"""
+
+    def test_import_csv(self, client, admin_headers, category, product):
+        """Test CSV rows are created and bad rows reported individually"""
+        body = csv_body(category, [
+            ('IMP-001', 'Imported One', 'imported-one', '10.50', None),
+            ('IMP-002', 'Imported Two', 'imported-two', 'abc', None),
+            ('IMP-003', 'Imported Three', 'imported-three', '12', '00000000-0000-0000-0000-000000000000'),
+            ('IMP-001', 'Imported Again', 'imported-again', '11', None),
+            ('IMP-004', 'Imported Four', 'imported-four', '8', None),
+            ('IMP-005', 'Imported Five', product.slug, '8', None),
+        ])
+
+        response = client.post('/api/products/import', data=body,
+                               content_type='text/csv', headers=admin_headers)
+
+        assert response.status_code == 200
+        report = json.loads(response.data)
+        assert (report['created'], report['updated'], report['failed']) == (2, 0, 4)
+        assert {error['row']: error['sku'] for error in report['errors']} == {
+            2: 'IMP-002', 3: 'IMP-003', 4: 'IMP-001', 6: 'IMP-005'
+        }
+        assert 'price' in report['errors'][0]['errors']
+
+        product = Product.query.filter_by(sku='IMP-001').one()
+        assert product.name == 'Imported One'
+        assert float(product.price) == 10.5
+        assert product.inventory_quantity == 5
+
+    def test_import_jsonl_upserts(self, client, admin_headers, product):
+        """Test JSONL rows update existing SKUs and replace their images"""
+        rows = [
+            {'sku': product.sku, 'name': 'Updated By Import', 'slug': product.slug, 'price': 45,
+             'category_id': product.category_id,
+             'images': [{'image_url': 'https://example.com/new.jpg', 'is_primary': True}]},
+            {'sku': 'NEW-001', 'name': 'New Product', 'slug': product.slug, 'price': 5,
+             'category_id': product.category_id},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+
+        response = client.post('/api/products/import', data=body,
+                               content_type='application/x-ndjson', headers=admin_headers)
+
+        report = json.loads(response.data)
+        assert (report['created'], report['updated'], report['failed']) == (0, 1, 2)
+        assert report['errors'][0]['errors'] == {'slug': ['Duplicate slug in import']}
+        assert report['errors'][1] == {'row': 3, 'sku': None, 'errors': {'_row': ['Invalid JSON']}}
+
+        db.session.expire_all()
+        updated = db.session.get(Product, product.id)
+        assert updated.name == 'Updated By Import'
+        assert [image.image_url for image in updated.images] == ['https://example.com/new.jpg']
+
+    def test_import_update_keeps_missing_fields(self, client, admin_headers, product):
+        """Test columns missing from a row that updates a product are left alone"""
+        product.inventory_quantity = 50
+        product.is_featured = True
+        db.session.commit()
+        body = f'sku,name,slug,price,category_id\n{product.sku},Renamed,{product.slug},12,{product.category_id}\n'
+
+        response = client.post('/api/products/import', data=body,
+                               content_type='text/csv', headers=admin_headers)
+
+        assert json.loads(response.data)['updated'] == 1
+        db.session.expire_all()
+        updated = db.session.get(Product, product.id)
+        assert (updated.name, float(updated.price)) == ('Renamed', 12)
+        assert (updated.inventory_quantity, updated.is_featured) == (50, True)
+
+    def test_import_is_chunked(self, app, client, admin_headers, category, count_queries):
+        """Test statements per import grow with chunks, not rows"""
+        app.config['IMPORT_CHUNK_SIZE'] = 10
+        rows = [(f'BULK-{i:03d}', f'Bulk {i}', f'bulk-{i}', '3', None) for i in range(40)]
+        body = csv_body(category, rows)
+
+        with count_queries() as queries:
+            response = client.post('/api/products/import', data=body,
+                                   content_type='text/csv', headers=admin_headers)
+
+        assert json.loads(response.data)['created'] == 40
+        assert Product.query.filter(Product.sku.like('BULK-%')).count() == 40
+        # Auth lookup plus lookups and inserts for 4 chunks (with FTS triggers in SQLite)
+        assert len([q for q in queries if q.lstrip().upper().startswith(('SELECT', 'INSERT'))]) <= 1 + 4 * 3
+
+    def test_import_invalidates_listing(self, client, admin_headers, category):
+        """Test imported products show up in cached listings"""
+        client.get('/api/products')
+        body = csv_body(category, [('IMP-100', 'Fresh Import', 'fresh-import', '9', None)])
+        client.post('/api/products/import', data=body, content_type='text/csv', headers=admin_headers)
+
+        response = client.get('/api/products')
+        assert [p['name'] for p in json.loads(response.data)['products']] == ['Fresh Import']
+
+    def test_import_rejects_unknown_format(self, client, admin_headers):
+        """Test the body format must be CSV or JSONL"""
+        response = client.post('/api/products/import', data='{}',
+                               content_type='application/json', headers=admin_headers)
+        assert response.status_code == 400
+
+    def test_import_requires_admin(self, client, auth_headers, category):
+        """Test regular users cannot import"""
+        response = client.post('/api/products/import', data=csv_body(category, []),
+                               content_type='text/csv', headers=auth_headers)
+        assert response.status_code == 403
+
+class TestBulkUpdate:
+    """Test bulk price/inventory updates"""
+
+    def test_bulk_update_by_sku(self, client, admin_headers, catalog, count_queries):
+        """Test rows are applied by SKU with one UPDATE per chunk"""
+        items = [
+            {'sku': 'CAT-000', 'price': '99.99', 'inventory_quantity': 0},
+            {'sku': 'CAT-001', 'inventory_quantity': 42},
+            {'sku': 'CAT-002', 'price': 5},
+            {'sku': 'NOPE-1', 'price': 1},
+        ]
+        with count_queries() as queries:
+            response = client.post('/api/products/bulk-update',
+                                   data=json.dumps({'items': items}),
+                                   content_type='application/json',
+                                   headers=admin_headers)
+
+        assert response.status_code == 200
+        summary = json.loads(response.data)
+        assert summary['updated'] == 3
+        assert summary['not_found'] == ['NOPE-1']
+        assert len([q for q in queries if q.lstrip().upper().startswith('UPDATE')]) == 1
+
+        db.session.expire_all()
+        by_sku = {p.sku: p for p in Product.query.filter(Product.sku.in_(['CAT-000', 'CAT-001', 'CAT-002']))}
+        assert (float(by_sku['CAT-000'].price), by_sku['CAT-000'].inventory_quantity) == (99.99, 0)
+        assert (float(by_sku['CAT-001'].price), by_sku['CAT-001'].inventory_quantity) == (11, 42)
+        assert (float(by_sku['CAT-002'].price), by_sku['CAT-002'].inventory_quantity) == (5, 10)
+
+    def test_bulk_update_invalidates_cache(self, client, admin_headers, catalog):
+        """Test cached detail and listing responses are dropped once per batch"""
+        url = f'/api/products/{catalog[0].id}'
+        client.get(url)
+        client.get('/api/products')
+
+        client.post('/api/products/bulk-update',
+                    data=json.dumps({'items': [{'sku': 'CAT-000', 'price': 77}]}),
+                    content_type='application/json',
+                    headers=admin_headers)
+
+        response = client.get(url)
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data)['product']['price'] == 77
+        assert client.get('/api/products').headers['X-Cache'] == 'MISS'
+
+    def test_bulk_update_validation_is_all_or_nothing(self, client, admin_headers, catalog):
+        """Test an invalid row rejects the whole batch"""
+        items = [{'sku': 'CAT-000', 'price': 1}, {'sku': 'CAT-001', 'price': -1}, {'sku': 'CAT-002'}]
+        response = client.post('/api/products/bulk-update',
+                               data=json.dumps({'items': items}),
+                               content_type='application/json',
+                               headers=admin_headers)
+
+        assert response.status_code == 400
+        assert set(json.loads(response.data)['details']['items']) == {'1', '2'}
+        db.session.expire_all()
+        assert float(Product.query.filter_by(sku='CAT-000').one().price) == 10
+
+class TestCatalogExport:
+    """Test streaming catalog export"""
+
+    def test_export_ndjson(self, client, admin_headers, catalog):
+        """Test NDJSON export streams one full product per line"""
+        response = client.get('/api/products/export', headers=admin_headers)
+
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.mimetype == 'application/x-ndjson'
+        assert 'attachment' in response.headers['Content-Disposition']
+        lines = response.get_data(as_text=True).splitlines()
+        products = [json.loads(line) for line in lines]
+        assert sorted(p['sku'] for p in products) == [p.sku for p in catalog]
+        assert products[0]['category']['name'] == 'Test Category'
+        assert len(products[0]['images']) == 2
+
+    def test_export_reads_keyset_pages(self, app, client, admin_headers, catalog, count_queries):
+        """Test export pages through the catalog by id, one LIMIT query per page"""
+        app.config['EXPORT_BATCH_SIZE'] = 3
+
+        with count_queries() as queries:
+            response = client.get('/api/products/export', headers=admin_headers)
+            products = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+        assert [p['id'] for p in products] == sorted(p.id for p in catalog)
+        assert all(len(p['images']) == 2 for p in products)
+        pages = [q for q in queries if 'FROM products' in q and 'LIMIT' in q]
+        assert len(pages) == 4
+
+    def test_export_csv_with_filters(self, client, admin_headers, catalog):
+        """Test CSV export reuses the search filters and sparse fieldsets"""
+        response = client.get('/api/products/export?format=csv&min_price=15&fields=sku,price,primary_image',
+                              headers=admin_headers)
+
+        assert response.mimetype == 'text/csv'
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+        assert sorted(row['sku'] for row in rows) == ['CAT-005', 'CAT-006', 'CAT-007', 'CAT-008', 'CAT-009']
+        assert json.loads(rows[0]['primary_image'])['is_primary'] is True
+
+        response = client.get('/api/products/export?format=csv', headers=admin_headers)
+        header = response.get_data(as_text=True).splitlines()[0].split(',')
+        assert 'meta_title' in header and 'images' not in header and 'category' not in header
+
+    def test_export_validation_and_auth(self, client, admin_headers, auth_headers):
+        """Test export is admin only and validates its parameters"""
+        assert client.get('/api/products/export', headers=auth_headers).status_code == 403
+        assert client.get('/api/products/export?format=xml', headers=admin_headers).status_code == 400
+        assert client.get('/api/products/export?page=2', headers=admin_headers).status_code == 400
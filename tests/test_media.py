@@ -0,0 +1,176 @@
+import pytest
+import io
+import json
+import os
+from concurrent.futures.process import BrokenProcessPool
+from app.models.product import ProductImage
+from app.utils.media import get_image_pool, render_variants, sniff_image_type
+
+Image = pytest.importorskip('PIL.Image')
+
+def png_bytes(size=(800, 600), color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+@pytest.fixture
+def media_root(app, tmp_path):
+    """Keep uploads in a temporary directory"""
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    return tmp_path
+
+def upload(client, headers, product, data, **form):
+    form['file'] = (io.BytesIO(data), 'photo.png')
+    return client.post(f'/api/products/{product.id}/images', data=form,
+                       content_type='multipart/form-data', headers=headers)
+
+class TestImageUpload:
+    """Test product image uploads"""
+
+    def test_sniff_image_type(self):
+        """Test formats are recognized by their leading bytes, not the file name"""
+        assert sniff_image_type(png_bytes()[:16]) == 'png'
+        assert sniff_image_type(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'webp'
+        assert sniff_image_type(b'<svg xmlns=') is None
+
+    def test_upload_stores_original_and_variants(self, client, admin_headers, product, media_root):
+        """Test an upload is content-addressed and gets resized variants"""
+        data = png_bytes()
+        response = upload(client, admin_headers, product, data, alt_text='Front', is_primary='true')
+
+        assert response.status_code == 201
+        image = json.loads(response.data)['image']
+        assert image['image_url'].startswith('/media/')
+        assert image['is_primary'] is True
+        assert set(image['variants']) == {'thumb', 'card', 'zoom'}
+
+        stored = media_root / image['image_url'][len('/media/'):]
+        assert stored.read_bytes() == data
+        with Image.open(media_root / image['variants']['thumb'][len('/media/'):]) as thumb:
+            assert thumb.format == 'WEBP'
+            assert max(thumb.size) == 160
+        # Never upscaled past the original
+        with Image.open(media_root / image['variants']['zoom'][len('/media/'):]) as zoom:
+            assert zoom.size == (800, 600)
+
+        detail = json.loads(client.get(f'/api/products/{product.id}?include=primary_image').data)['product']
+        assert detail['primary_image']['variants'] == image['variants']
+
+    def test_identical_uploads_share_files(self, client, admin_headers, product, media_root):
+        """Test the same bytes are stored once"""
+        data = png_bytes()
+        first = json.loads(upload(client, admin_headers, product, data).data)['image']
+        second = json.loads(upload(client, admin_headers, product, data).data)['image']
+
+        assert first['id'] != second['id']
+        assert first['image_url'] == second['image_url']
+        files = [name for _, _, names in os.walk(media_root) for name in names]
+        assert len(files) == 4
+
+    def test_render_variants_in_pool_process(self, app, media_root):
+        """Test rendering runs in a spawned pool process with plain, picklable arguments"""
+        app.config['IMAGE_WORKERS'] = 1
+        (media_root / 'source.png').write_bytes(png_bytes((300, 100)))
+        with get_image_pool(app) as pool:
+            assert pool._mp_context.get_start_method() == 'spawn'
+            rendered = pool.submit(render_variants, str(media_root), 'source.png', 'ab' * 32, {'thumb': 60}).result()
+
+        with Image.open(media_root / rendered['thumb']) as thumb:
+            assert thumb.size == (60, 20)
+
+    def test_broken_pool_renders_inline(self, app, client, admin_headers, product, media_root):
+        """Test an upload still succeeds, with variants, when the pool refuses work"""
+        class BrokenPool:
+            def submit(self, *args):
+                raise BrokenProcessPool('A child process terminated abruptly')
+
+            def shutdown(self, wait=True):
+                pass
+
+        app.config['IMAGE_WORKERS'] = 1
+        app.extensions['image_pool'] = BrokenPool()
+        response = upload(client, admin_headers, product, png_bytes())
+
+        assert response.status_code == 201
+        assert set(json.loads(response.data)['image']['variants']) == {'thumb', 'card', 'zoom'}
+        # Replaced on the next upload
+        assert 'image_pool' not in app.extensions
+
+    def test_upload_rejects_non_images(self, client, admin_headers, product, media_root):
+        """Test non-image uploads and missing files are refused"""
+        response = upload(client, admin_headers, product, b'<html>not an image</html>')
+        assert response.status_code == 400
+
+        response = client.post(f'/api/products/{product.id}/images', data={'alt_text': 'x'},
+                               content_type='multipart/form-data', headers=admin_headers)
+        assert response.status_code == 400
+        assert ProductImage.query.count() == 0
+        assert not any(names for _, _, names in os.walk(media_root))
+
+    def test_upload_requires_admin(self, client, auth_headers, product, media_root):
+        """Test regular users cannot upload"""
+        assert upload(client, auth_headers, product, png_bytes()).status_code == 403
+
+class TestMediaServing:
+    """Test serving of uploaded media"""
+
+    @pytest.fixture
+    def stored(self, client, admin_headers, product, media_root):
+        """Upload an image and return it as serialized by the API"""
+        return json.loads(upload(client, admin_headers, product, png_bytes()).data)['image']
+
+    def test_serves_with_immutable_caching(self, client, stored, media_root):
+        """Test content-hashed files are sent with far-future immutable caching"""
+        response = client.get(stored['image_url'])
+
+        assert response.status_code == 200
+        assert response.mimetype == 'image/png'
+        assert response.data == (media_root / stored['image_url'][len('/media/'):]).read_bytes()
+        assert response.cache_control.max_age == 31536000
+        assert response.cache_control.immutable
+        assert response.cache_control.public
+
+        assert client.get(stored['variants']['thumb']).mimetype == 'image/webp'
+
+    def test_range_and_conditional_requests(self, client, stored):
+        """Test partial content and revalidation"""
+        full = client.get(stored['image_url'])
+
+        response = client.get(stored['image_url'], headers={'Range': 'bytes=0-9'})
+        assert response.status_code == 206
+        assert response.data == full.data[:10]
+        assert response.headers['Content-Range'] == f'bytes 0-9/{len(full.data)}'
+
+        response = client.get(stored['image_url'], headers={'If-None-Match': full.headers['ETag']})
+        assert response.status_code == 304
+
+    def test_unknown_and_unsafe_paths(self, client, stored, media_root):
+        """Test only stored image types inside the upload folder are served"""
+        (media_root / 'notes.txt').write_text('secret')
+        assert client.get('/media/notes.txt').status_code == 404
+        assert client.get('/media/../conftest.png').status_code == 404
+        assert client.get('/media/00/00/missing.png').status_code == 404
+
+    def test_non_hashed_names_revalidate(self, client, media_root):
+        """Test files without a content hash are not cached as immutable"""
+        (media_root / 'legacy.png').write_bytes(png_bytes((10, 10)))
+
+        response = client.get('/media/legacy.png')
+        assert response.status_code == 200
+        assert response.cache_control.no_cache
+        assert not response.cache_control.immutable
+
+    def test_proxy_sendfile(self, app, client, stored, media_root):
+        """Test X-Accel-Redirect and X-Sendfile hand the body to the proxy"""
+        relative = stored['image_url'][len('/media/'):]
+
+        app.config['MEDIA_SENDFILE'] = 'X-Accel-Redirect'
+        response = client.get(stored['image_url'])
+        assert response.headers['X-Accel-Redirect'] == f'/protected-media/{relative}'
+        assert response.data == b''
+        assert response.cache_control.immutable
+        assert client.get('/media/00/00/missing.png').status_code == 404
+
+        app.config['MEDIA_SENDFILE'] = 'X-Sendfile'
+        response = client.get(stored['image_url'])
+        assert response.headers['X-Sendfile'] == str(media_root / relative)
@@ -0,0 +1,144 @@
+import pytest
+import json
+from datetime import datetime, timedelta
+from app import db
+from app.models.order import Order, OrderItem, OrderStatus
+from app.models.product import JobWatermark
+from app.utils.popularity import (
+    EPOCH, EPOCH_WATERMARK, RENORMALIZE_HALF_LIVES, decay_weight, refresh_popularity, rebuild_popularity
+)
+
+def make_order(user, items, status=OrderStatus.CONFIRMED, created_at=None):
+    """Create an order with (product, quantity) items"""
+    order = Order(
+        user.id,
+        status=status,
+        subtotal=0,
+        total_amount=0,
+        shipping_first_name='Test', shipping_last_name='User',
+        shipping_address_line_1='Street 1', shipping_city='Managua',
+        shipping_state='Managua', shipping_postal_code='10000', shipping_country='NI',
+        billing_first_name='Test', billing_last_name='User',
+        billing_address_line_1='Street 1', billing_city='Managua',
+        billing_state='Managua', billing_postal_code='10000', billing_country='NI'
+    )
+    for product, quantity in items:
+        order.items.append(OrderItem(
+            product_id=product.id,
+            product_name=product.name,
+            product_sku=product.sku,
+            product_price=product.price,
+            quantity=quantity,
+            total_price=product.price * quantity,
+            created_at=created_at or datetime.utcnow()
+        ))
+    db.session.add(order)
+    db.session.commit()
+    return order
+
+def score_of(product):
+    db.session.refresh(product)
+    return product.popularity_score
+
+def popularity_order(client):
+    response = client.get('/api/products?sort_by=popularity&sort_order=desc&per_page=3&include=sku')
+    return [p['sku'] for p in json.loads(response.data)['products']]
+
+class TestPopularity:
+    """Test precomputed popularity scores"""
+
+    def test_decay_weight_halves_per_half_life(self):
+        """Test an event one half-life older weighs half as much"""
+        now = datetime(2025, 6, 1)
+        ratio = decay_weight(now - timedelta(days=14), 14) / decay_weight(now, 14)
+        assert ratio == pytest.approx(0.5)
+
+    def test_scores_rescaled_before_weights_overflow(self, app, user, catalog):
+        """Test a short half-life moves the epoch forward instead of overflowing"""
+        app.config['POPULARITY_HALF_LIFE_DAYS'] = 1
+        # A score built against the original epoch, some thousand days ago
+        catalog[5].popularity_score = 2.0 ** 1000
+        db.session.commit()
+        make_order(user, [(catalog[3], 1)])
+
+        refresh_popularity()
+
+        epoch = JobWatermark.query.get(EPOCH_WATERMARK).processed_until
+        assert datetime.utcnow() - epoch < timedelta(days=RENORMALIZE_HALF_LIVES)
+        assert score_of(catalog[5]) == 2.0 ** (1000 - (epoch - EPOCH).days)
+        assert score_of(catalog[3]) == pytest.approx(decay_weight(datetime.utcnow(), 1, epoch), rel=1e-3)
+
+    def test_sort_by_popularity(self, client, user, catalog):
+        """Test sales drive sort_by=popularity once refreshed"""
+        make_order(user, [(catalog[3], 5), (catalog[7], 1)])
+        make_order(user, [(catalog[5], 50)], status=OrderStatus.CANCELLED)
+
+        refresh_popularity()
+
+        assert popularity_order(client)[:2] == ['CAT-003', 'CAT-007']
+
+    def test_refresh_is_incremental(self, client, user, catalog):
+        """Test a refresh only adds sales past the watermark"""
+        make_order(user, [(catalog[1], 2)])
+        refresh_popularity()
+        first = score_of(catalog[1])
+
+        # Nothing new: scores stay put
+        assert refresh_popularity() == 0
+        assert score_of(catalog[1]) == first
+
+        make_order(user, [(catalog[2], 3)])
+        assert refresh_popularity() == 1
+        assert popularity_order(client)[:2] == ['CAT-002', 'CAT-001']
+
+    def test_recent_sales_outweigh_old_sales(self, client, user, catalog):
+        """Test older sales decay"""
+        make_order(user, [(catalog[4], 3)], created_at=datetime.utcnow() - timedelta(days=60))
+        make_order(user, [(catalog[6], 1)])
+
+        refresh_popularity()
+
+        assert popularity_order(client)[0] == 'CAT-006'
+
+    def test_views_are_buffered_until_refresh(self, client, catalog):
+        """Test product detail views count once flushed"""
+        for _ in range(3):
+            client.get(f'/api/products/{catalog[8].id}')
+
+        db.session.refresh(catalog[8])
+        assert catalog[8].view_count == 0
+
+        updated_at = catalog[8].updated_at
+        refresh_popularity()
+        db.session.refresh(catalog[8])
+
+        assert catalog[8].view_count == 3
+        assert catalog[8].updated_at == updated_at
+        assert popularity_order(client)[0] == 'CAT-008'
+
+    def test_rebuild_matches_refresh(self, user, catalog):
+        """Test a full rebuild reproduces incrementally built scores"""
+        make_order(user, [(catalog[1], 2), (catalog[2], 1)])
+        refresh_popularity()
+        make_order(user, [(catalog[2], 4)])
+        refresh_popularity()
+        incremental = score_of(catalog[2])
+
+        rebuild_popularity()
+
+        assert score_of(catalog[2]) == pytest.approx(incremental)
+
+    def test_popularity_cursor_pagination(self, client, user, catalog):
+        """Test keyset pagination over popularity"""
+        make_order(user, [(catalog[i], i + 1) for i in range(len(catalog))])
+        refresh_popularity()
+
+        seen = []
+        url = '/api/products?sort_by=popularity&sort_order=desc&pagination=cursor&per_page=4&include=sku'
+        while url:
+            response_data = json.loads(client.get(url).data)
+            seen.extend(p['sku'] for p in response_data['products'])
+            cursor = response_data['pagination']['next_cursor']
+            url = f'/api/products?sort_by=popularity&sort_order=desc&per_page=4&include=sku&cursor={cursor}' if cursor else None
+
+        assert seen == [f'CAT-{i:03d}' for i in reversed(range(len(catalog)))]
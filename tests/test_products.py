@@ -1,5 +1,9 @@
 import pytest
 import json
+from datetime import timedelta
+from app import db
+from app.models.product import Product, Category, CategoryClosure
+from app.search.suggest import refresh_suggest_index
 
 class TestProducts:
     """Test product endpoints"""
@@ -155,3 +159,481 @@ class TestProducts:
         assert response.status_code == 400
         response_data = json.loads(response.data)
         assert 'slug already exists' in response_data['error']
+    
+    def test_get_products_query_budget(self, client, catalog, count_queries):
+        """Test product listing stays within its query budget"""
+        with count_queries() as queries:
+            response = client.get('/api/products')
+        
+        assert response.status_code == 200
+        assert len(json.loads(response.data)['products']) == len(catalog)
+        assert len(queries) <= 4
+    
+    def test_get_product_query_budget(self, client, catalog, count_queries):
+        """Test product detail stays within its query budget"""
+        url = f'/api/products/{catalog[0].id}'
+        with count_queries() as queries:
+            response = client.get(url)
+        
+        assert response.status_code == 200
+        assert len(queries) <= 3
+    
+    def test_get_category_query_budget(self, client, catalog, category, count_queries):
+        """Test category detail with products stays within its query budget"""
+        url = f'/api/products/categories/{category.id}'
+        with count_queries() as queries:
+            response = client.get(url)
+        
+        assert response.status_code == 200
+        response_data = json.loads(response.data)
+        assert len(response_data['category']['products']) == len(catalog)
+        assert response_data['pagination']['total'] == len(catalog)
+        assert len(queries) <= 5
+        
+        # Cursor mode skips the COUNT
+        with count_queries() as queries:
+            response = client.get(f'{url}?pagination=cursor')
+        
+        assert response.status_code == 200
+        assert len(queries) <= 4
+    
+    def test_get_products_cursor_pagination(self, client, catalog):
+        """Test walking the catalog with keyset cursors"""
+        seen = []
+        url = '/api/products?pagination=cursor&sort_by=price&sort_order=desc&per_page=3'
+        cursor = None
+        while True:
+            response = client.get(url + (f'&cursor={cursor}' if cursor else ''))
+            assert response.status_code == 200
+            response_data = json.loads(response.data)
+            assert 'total' not in response_data['pagination']
+            seen.extend(p['id'] for p in response_data['products'])
+            cursor = response_data['pagination']['next_cursor']
+            if not response_data['pagination']['has_next']:
+                break
+        
+        expected = [p.id for p in sorted(catalog, key=lambda p: p.price, reverse=True)]
+        assert seen == expected
+    
+    def test_get_products_desc_ties_follow_sort_order(self, client, catalog):
+        """Test descending pages break ties by id descending, like cursor pages"""
+        for product in catalog:
+            product.price = 20
+        db.session.commit()
+        expected = sorted((p.id for p in catalog), reverse=True)
+        
+        response = client.get('/api/products?sort_by=price&sort_order=desc&per_page=20')
+        assert [p['id'] for p in json.loads(response.data)['products']] == expected
+        response = client.get('/api/products?pagination=cursor&sort_by=price&sort_order=desc&per_page=20')
+        assert [p['id'] for p in json.loads(response.data)['products']] == expected
+    
+    def test_get_products_cursor_skips_count(self, client, catalog, count_queries):
+        """Test cursor pagination does not run a COUNT query"""
+        with count_queries() as queries:
+            response = client.get('/api/products?pagination=cursor&per_page=5')
+        
+        assert response.status_code == 200
+        assert not any('count(' in statement.lower() for statement in queries)
+    
+    def test_get_products_invalid_cursor(self, client, catalog):
+        """Test a malformed or mismatched cursor is rejected"""
+        response = client.get('/api/products?cursor=not-a-cursor')
+        assert response.status_code == 400
+        
+        response = client.get('/api/products?pagination=cursor&sort_by=price&per_page=2')
+        cursor = json.loads(response.data)['pagination']['next_cursor']
+        response = client.get(f'/api/products?sort_by=name&cursor={cursor}')
+        assert response.status_code == 400
+    
+    def test_search_relevance_sort(self, client, category):
+        """Test full-text search ranks stronger matches first"""
+        db.session.add_all([
+            Product(name='Cable organizer', description='Keeps a laptop desk tidy',
+                    sku='REL-001', slug='cable-organizer', price=5, category_id=category.id),
+            Product(name='Laptop stand', description='Aluminium laptop stand for any laptop',
+                    sku='REL-002', slug='laptop-stand', price=25, category_id=category.id),
+        ])
+        db.session.commit()
+        
+        response = client.get('/api/products?q=laptop&sort_by=relevance')
+        
+        assert response.status_code == 200
+        names = [p['name'] for p in json.loads(response.data)['products']]
+        assert names == ['Laptop stand', 'Cable organizer']
+    
+    def test_search_index_follows_updates(self, client, admin_headers, product):
+        """Test the search index reflects product updates"""
+        client.put(f'/api/products/{product.id}',
+                   data=json.dumps({'name': 'Mechanical keyboard'}),
+                   content_type='application/json',
+                   headers=admin_headers)
+        
+        response = client.get('/api/products?q=keyboard')
+        assert [p['id'] for p in json.loads(response.data)['products']] == [product.id]
+    
+    def test_search_like_backend(self, app, client, product):
+        """Test the portable LIKE backend can be selected"""
+        app.config['SEARCH_BACKEND'] = 'like'
+        
+        response = client.get('/api/products?q=est Prod&sort_by=relevance')
+        
+        assert response.status_code == 200
+        assert len(json.loads(response.data)['products']) == 1
+    
+    def test_product_etag_not_modified(self, client, admin_headers, product):
+        """Test conditional GET returns 304 until the product changes"""
+        response = client.get(f'/api/products/{product.id}')
+        etag = response.headers['ETag']
+        
+        response = client.get(f'/api/products/{product.id}', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        
+        client.post(f'/api/products/{product.id}/images',
+                    data=json.dumps({'image_url': 'https://example.com/new.jpg'}),
+                    content_type='application/json',
+                    headers=admin_headers)
+        
+        response = client.get(f'/api/products/{product.id}', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+    
+    def test_list_etag_not_modified(self, client, admin_headers, catalog, category):
+        """Test list and category endpoints honour If-None-Match"""
+        for url in ['/api/products', '/api/products/categories', f'/api/products/categories/{category.id}']:
+            etag = client.get(url).headers['ETag']
+            response = client.get(url, headers={'If-None-Match': etag})
+            assert response.status_code == 304
+        
+        etag = client.get('/api/products').headers['ETag']
+        client.put(f'/api/products/{catalog[0].id}',
+                   data=json.dumps({'price': 99.5}),
+                   content_type='application/json',
+                   headers=admin_headers)
+        response = client.get('/api/products', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+    
+    def test_category_subtree_filter(self, client, category):
+        """Test include_subcategories matches products anywhere below the category"""
+        child = Category(name='Child', slug='child', parent=category)
+        grandchild = Category(name='Grandchild', slug='grandchild', parent=child)
+        db.session.add_all([child, grandchild])
+        db.session.add(Product(name='Deep Product', sku='DEEP-001', slug='deep-product',
+                               price=5, category=grandchild))
+        db.session.commit()
+        
+        response = client.get(f'/api/products?category_id={category.id}')
+        assert json.loads(response.data)['products'] == []
+        
+        response = client.get(f'/api/products?category_id={category.id}&include_subcategories=true&include=sku')
+        products = json.loads(response.data)['products']
+        assert [p['sku'] for p in products] == ['DEEP-001']
+        
+        response = client.get(f'/api/products?category_id={child.id}&include_subcategories=true')
+        assert len(json.loads(response.data)['products']) == 1
+    
+    def test_category_tree(self, client, category, count_queries):
+        """Test the subtree endpoint nests descendants from a single query"""
+        child = Category(name='Child', slug='child', parent=category)
+        grandchild = Category(name='Grandchild', slug='grandchild', parent=child)
+        db.session.add_all([child, grandchild])
+        db.session.commit()
+        
+        url = f'/api/products/categories/{category.id}/tree'
+        with count_queries() as queries:
+            response = client.get(url)
+        
+        assert response.status_code == 200
+        assert len(queries) == 1
+        tree = json.loads(response.data)['category']
+        assert tree['id'] == category.id
+        assert tree['children'][0]['name'] == 'Child'
+        assert tree['children'][0]['children'][0]['name'] == 'Grandchild'
+        
+        response = client.get('/api/products/categories/tree')
+        roots = json.loads(response.data)['categories']
+        assert [root['id'] for root in roots] == [category.id]
+        
+        response = client.get('/api/products/categories/00000000-0000-0000-0000-000000000000/tree')
+        assert response.status_code == 404
+    
+    def test_move_category_updates_hierarchy(self, client, admin_headers, category):
+        """Test moving a category re-links its subtree and rejects cycles"""
+        other = Category(name='Other', slug='other')
+        child = Category(name='Child', slug='child', parent=category)
+        grandchild = Category(name='Grandchild', slug='grandchild', parent=child)
+        db.session.add_all([other, child, grandchild])
+        db.session.commit()
+        
+        response = client.put(f'/api/products/categories/{category.id}',
+                              data=json.dumps({'parent_id': grandchild.id}),
+                              content_type='application/json',
+                              headers=admin_headers)
+        assert response.status_code == 400
+        
+        response = client.put(f'/api/products/categories/{child.id}',
+                              data=json.dumps({'parent_id': other.id}),
+                              content_type='application/json',
+                              headers=admin_headers)
+        assert response.status_code == 200
+        
+        assert {row.descendant_id for row in CategoryClosure.subtree_ids(other.id)} == {
+            other.id, child.id, grandchild.id
+        }
+        assert {row.descendant_id for row in CategoryClosure.subtree_ids(category.id)} == {category.id}
+        depth = CategoryClosure.query.filter_by(ancestor_id=other.id, descendant_id=grandchild.id).one().depth
+        assert depth == 2
+        
+        response = client.get(f'/api/products/categories/{other.id}/tree')
+        tree = json.loads(response.data)['category']
+        assert tree['children'][0]['children'][0]['id'] == grandchild.id
+    
+    def test_get_category_paginates_products(self, client, catalog, category):
+        """Test category detail pages through active products in SQL"""
+        catalog[0].is_active = False
+        db.session.commit()
+        
+        response = client.get(f'/api/products/categories/{category.id}?per_page=4&sort_by=price&include=sku')
+        assert response.status_code == 200
+        response_data = json.loads(response.data)
+        assert [p['sku'] for p in response_data['category']['products']] == ['CAT-001', 'CAT-002', 'CAT-003', 'CAT-004']
+        assert response_data['pagination']['total'] == len(catalog) - 1
+        assert response_data['pagination']['has_next'] is True
+        
+        response = client.get(f'/api/products/categories/{category.id}?per_page=500')
+        assert response.status_code == 400
+    
+    def test_get_category_stream(self, client, catalog, category):
+        """Test streaming mode returns every active product in one document"""
+        catalog[0].is_active = False
+        db.session.commit()
+        
+        response = client.get(f'/api/products/categories/{category.id}?stream=true&sort_by=price&fields=sku')
+        assert response.status_code == 200
+        assert response.is_streamed
+        response_data = json.loads(response.get_data())
+        assert response_data['category']['id'] == category.id
+        assert [p['sku'] for p in response_data['category']['products']] == [
+            f'CAT-{i:03d}' for i in range(1, len(catalog))
+        ]
+        
+        response = client.get('/api/products/categories/00000000-0000-0000-0000-000000000000?stream=true')
+        assert response.status_code == 404
+    
+    def test_get_category_stream_pages(self, client, catalog, category, monkeypatch):
+        """Test the stream reads keyset pages, ties included, in the requested order"""
+        monkeypatch.setattr('app.routes.products.CATEGORY_STREAM_BATCH', 3)
+        for product in catalog[2:7]:
+            product.price = 15
+        db.session.commit()
+        expected = [p.id for p in sorted(catalog, key=lambda p: (float(p.price), p.id), reverse=True)]
+        
+        response = client.get(f'/api/products/categories/{category.id}?stream=true&sort_by=price&sort_order=desc')
+        products = json.loads(response.get_data())['category']['products']
+        
+        assert [p['id'] for p in products] == expected
+        assert all(p['primary_image'] for p in products)
+    
+    def test_product_facets(self, client, catalog, category, count_queries):
+        """Test facet counts come from a single aggregate query"""
+        other = Category(name='Other', slug='other')
+        db.session.add(other)
+        catalog[0].category = other
+        catalog[1].is_featured = True
+        catalog[2].inventory_quantity = 0
+        db.session.commit()
+        
+        with count_queries() as queries:
+            response = client.get('/api/products/facets')
+        
+        assert response.status_code == 200
+        assert len(queries) == 1
+        response_data = json.loads(response.data)
+        facets = response_data['facets']
+        assert response_data['total'] == len(catalog)
+        assert facets['category'][0] == {'category_id': category.id, 'name': category.name, 'count': 9}
+        assert facets['category'][1]['count'] == 1
+        assert facets['featured'] == {'featured': 1, 'not_featured': 9}
+        assert facets['in_stock'] == {'in_stock': 9, 'out_of_stock': 1}
+        # Prices 10..19 all fall in the first bucket
+        assert facets['price'][0] == {'min': 0, 'max': 25, 'count': 10}
+        assert facets['price'][-1]['max'] is None
+        
+        response = client.get(f'/api/products/facets?facets=featured&category_id={category.id}')
+        response_data = json.loads(response.data)
+        assert response_data['total'] == 9
+        assert list(response_data['facets']) == ['featured']
+        
+        response = client.get('/api/products/facets?facets=in_stock&q=catalog')
+        assert json.loads(response.data)['facets']['in_stock'] == {'in_stock': 9, 'out_of_stock': 1}
+        
+        response = client.get('/api/products/facets?facets=colour')
+        assert response.status_code == 400
+    
+    def test_product_facets_cache_invalidation(self, client, admin_headers, catalog):
+        """Test cached facet counts are dropped on product writes"""
+        response = client.get('/api/products/facets?facets=featured')
+        assert json.loads(response.data)['facets']['featured']['featured'] == 0
+        assert client.get('/api/products/facets?facets=featured').headers['X-Cache'] == 'HIT'
+        
+        client.put(f'/api/products/{catalog[0].id}',
+                   data=json.dumps({'is_featured': True}),
+                   content_type='application/json',
+                   headers=admin_headers)
+        
+        response = client.get('/api/products/facets?facets=featured')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data)['facets']['featured']['featured'] == 1
+    
+    def test_list_defaults_to_card_projection(self, client, catalog, count_queries):
+        """Test listings serialize the slim card and skip unneeded columns"""
+        with count_queries() as queries:
+            response = client.get('/api/products?sort_by=price')
+        
+        product = json.loads(response.data)['products'][0]
+        assert set(product) == {'id', 'name', 'slug', 'price', 'primary_image'}
+        assert product['primary_image']['image_url'] == 'https://example.com/0-0.jpg'
+        
+        product_select = next(q for q in queries if q.lstrip().startswith('SELECT products.id'))
+        assert 'products.description' not in product_select
+        assert 'products.meta_title' not in product_select
+        # No category lookup for the card
+        assert not any('FROM categories' in q for q in queries)
+    
+    def test_list_sparse_fieldsets(self, client, catalog):
+        """Test fields= and include= select the serialized keys"""
+        response = client.get('/api/products?fields=id,sku,is_in_stock')
+        product = json.loads(response.data)['products'][0]
+        assert set(product) == {'id', 'sku', 'is_in_stock'}
+        
+        response = client.get('/api/products?include=category,description')
+        product = json.loads(response.data)['products'][0]
+        assert set(product) == {'id', 'name', 'slug', 'price', 'primary_image', 'category', 'description'}
+        assert product['category']['name'] == 'Test Category'
+        
+        response = client.get('/api/products?fields=full')
+        assert 'meta_description' in json.loads(response.data)['products'][0]
+        
+        response = client.get('/api/products?fields=id,password')
+        assert response.status_code == 400
+    
+    def test_product_detail_fieldsets(self, client, product):
+        """Test product detail stays full by default and honours fields="""
+        response = client.get(f'/api/products/{product.id}')
+        full = json.loads(response.data)['product']
+        assert full == product.to_dict()
+        
+        response = client.get(f'/api/products/{product.id}?fields=card&include=sku')
+        assert set(json.loads(response.data)['product']) == {'id', 'name', 'slug', 'price', 'primary_image', 'sku'}
+        assert response.headers['ETag'] != client.get(f'/api/products/{product.id}').headers['ETag']
+    
+    def test_batch_lookup_by_ids(self, client, catalog, count_queries):
+        """Test a batch lookup keeps request order and reports misses in one round trip"""
+        ids = [catalog[5].id, 'missing-id', catalog[1].id, catalog[5].id]
+        with count_queries() as queries:
+            response = client.get(f"/api/products/batch?ids={','.join(ids)}")
+        
+        assert response.status_code == 200
+        response_data = json.loads(response.data)
+        assert [p['sku'] for p in response_data['products']] == ['CAT-005', 'CAT-001']
+        assert response_data['missing'] == ['missing-id']
+        assert len(response_data['products'][0]['images']) == 2
+        assert response_data['products'][0]['category']['name'] == 'Test Category'
+        # Products, then select-in loads of images and categories
+        assert len(queries) <= 3
+    
+    def test_batch_lookup_by_skus_and_slugs(self, client, catalog):
+        """Test the skus and slugs variants with a sparse fieldset"""
+        response = client.get('/api/products/batch?skus=CAT-009,CAT-000&fields=card')
+        products = json.loads(response.data)['products']
+        assert [p['slug'] for p in products] == ['catalog-product-9', 'catalog-product-0']
+        assert 'images' not in products[0]
+        
+        response = client.get('/api/products/batch?slugs=catalog-product-3')
+        assert json.loads(response.data)['products'][0]['sku'] == 'CAT-003'
+    
+    def test_batch_lookup_sees_writes(self, client, admin_headers, product):
+        """Test cached batch responses are invalidated by product writes"""
+        url = f'/api/products/batch?ids={product.id}'
+        client.get(url)
+        client.put(f'/api/products/{product.id}',
+                   data=json.dumps({'name': 'Batch Renamed'}),
+                   content_type='application/json',
+                   headers=admin_headers)
+        
+        assert json.loads(client.get(url).data)['products'][0]['name'] == 'Batch Renamed'
+    
+    def test_batch_lookup_validation(self, client):
+        """Test exactly one lookup with a bounded number of keys is required"""
+        assert client.get('/api/products/batch').status_code == 400
+        assert client.get('/api/products/batch?ids=a&skus=b').status_code == 400
+        assert client.get('/api/products/batch?ids=,').status_code == 400
+        
+        too_many = ','.join(f'SKU-{i}' for i in range(251))
+        response = client.get(f'/api/products/batch?skus={too_many}')
+        assert response.status_code == 400
+        assert 'skus' in json.loads(response.data)['details']
+    
+    def test_suggest_by_prefix(self, client, catalog, category):
+        """Test typeahead matches name words, SKUs and categories, most popular first"""
+        catalog[3].popularity_score = 5
+        db.session.commit()
+        
+        response = client.get('/api/products/suggest?prefix=Catalog%20Prod&limit=3')
+        assert response.status_code == 200
+        response_data = json.loads(response.data)
+        assert [p['sku'] for p in response_data['products']] == ['CAT-003', 'CAT-000', 'CAT-001']
+        assert set(response_data['products'][0]) == {'id', 'name', 'slug', 'sku'}
+        
+        # Later words of the name, SKUs (punctuation-insensitive) and categories
+        response_data = json.loads(client.get('/api/products/suggest?prefix=product 7').data)
+        assert [p['sku'] for p in response_data['products']] == ['CAT-007']
+        response_data = json.loads(client.get('/api/products/suggest?prefix=cat-00').data)
+        assert len(response_data['products']) == 8
+        response_data = json.loads(client.get('/api/products/suggest?prefix=tést').data)
+        assert [c['name'] for c in response_data['categories']] == ['Test Category']
+    
+    def test_suggest_follows_writes(self, client, admin_headers, product, category):
+        """Test product and category writes update the built index in place"""
+        assert json.loads(client.get('/api/products/suggest?prefix=test prod').data)['products'][0]['id'] == product.id
+        
+        client.put(f'/api/products/{product.id}',
+                   data=json.dumps({'name': 'Renamed Gadget'}),
+                   content_type='application/json',
+                   headers=admin_headers)
+        client.put(f'/api/products/categories/{category.id}',
+                   data=json.dumps({'name': 'Gadgets'}),
+                   content_type='application/json',
+                   headers=admin_headers)
+        
+        response_data = json.loads(client.get('/api/products/suggest?prefix=gadg').data)
+        assert [p['name'] for p in response_data['products']] == ['Renamed Gadget']
+        assert [c['name'] for c in response_data['categories']] == ['Gadgets']
+        assert json.loads(client.get('/api/products/suggest?prefix=test prod').data)['products'] == []
+        
+        client.delete(f'/api/products/{product.id}', headers=admin_headers)
+        assert json.loads(client.get('/api/products/suggest?prefix=gadg').data)['products'] == []
+    
+    def test_suggest_rebuilds_in_background(self, app, client, catalog):
+        """Test the periodic rebuild runs off the request path and picks up popularity"""
+        client.get('/api/products/suggest?prefix=catalog')
+        index = app.extensions['suggest_index']
+        catalog[9].popularity_score = 5
+        db.session.commit()
+        index.built_at -= timedelta(seconds=app.config['SUGGEST_REBUILD_SECONDS'])
+        
+        # Requests during a rebuild get the current index
+        with index._rebuild_lock:
+            response_data = json.loads(client.get('/api/products/suggest?prefix=catalog&limit=1').data)
+            assert [p['sku'] for p in response_data['products']] == ['CAT-000']
+        
+        thread = refresh_suggest_index(index, 30, app.config['SUGGEST_REBUILD_SECONDS'])
+        thread.join(timeout=10)
+        response_data = json.loads(client.get('/api/products/suggest?prefix=catalog&limit=1').data)
+        assert [p['sku'] for p in response_data['products']] == ['CAT-009']
+    
+    def test_suggest_validation(self, client):
+        """Test a prefix is required and the limit bounded"""
+        assert client.get('/api/products/suggest').status_code == 400
+        assert client.get('/api/products/suggest?prefix=a&limit=50').status_code == 400
+        assert json.loads(client.get('/api/products/suggest?prefix=%20-').data) == {'products': [], 'categories': []}
@@ -0,0 +1,96 @@
+import pytest
+import json
+from datetime import datetime, timedelta
+from app import db
+from app.models.order import OrderStatus
+from app.models.product import RelatedProduct
+from app.utils.related import cooccurrence, top_neighbours, rebuild_related, _claim_run, _release_run
+from tests.test_popularity import make_order
+
+def related_skus(client, product):
+    response = client.get(f'/api/products/{product.id}/related?include=sku')
+    assert response.status_code == 200
+    return [p['sku'] for p in json.loads(response.data)['products']]
+
+@pytest.fixture
+def baskets(user, catalog):
+    """Orders over the first products of the catalog"""
+    for _ in range(2):
+        make_order(user, [(catalog[0], 1), (catalog[1], 1), (catalog[2], 1)])
+    make_order(user, [(catalog[0], 1), (catalog[1], 2)])
+    # Bought together once: below RELATED_MIN_ORDERS
+    make_order(user, [(catalog[0], 1), (catalog[3], 1)])
+    # Cancelled orders do not count
+    for _ in range(3):
+        make_order(user, [(catalog[0], 1), (catalog[4], 1)], status=OrderStatus.CANCELLED)
+    return catalog
+
+class TestRelatedProducts:
+    """Test "frequently bought together" neighbours"""
+
+    def test_cooccurrence_matrix(self):
+        """Test pair counts, per-product order counts and cosine ranking"""
+        pairs, orders = cooccurrence([{'a', 'b', 'c'}, {'a', 'b'}, {'a', 'c'}, {'b', 'd'}, {'a', 'b', 'c', 'd'}], max_basket=3)
+
+        assert pairs['a'] == {'b': 2, 'c': 2}
+        assert pairs['b'] == {'c': 1, 'd': 1}
+        assert orders == {'a': 4, 'b': 4, 'c': 3, 'd': 2}
+
+        neighbours = top_neighbours(pairs, orders, top_k=1, min_orders=2)
+        # a-c (2 of 4 and 3 orders) beats a-b (2 of 4 and 4 orders)
+        assert [other for other, _, _ in neighbours['a']] == ['c']
+        assert 'd' not in neighbours
+
+    def test_related_endpoint(self, client, baskets):
+        """Test neighbours are served best first from the rebuilt table"""
+        assert rebuild_related() == 3
+
+        assert related_skus(client, baskets[0]) == ['CAT-001', 'CAT-002']
+        assert related_skus(client, baskets[1]) == ['CAT-000', 'CAT-002']
+        assert related_skus(client, baskets[2]) == ['CAT-001', 'CAT-000']
+        assert related_skus(client, baskets[5]) == []
+
+        response = client.get(f'/api/products/{baskets[0].id}/related?limit=1&fields=id,name')
+        assert [set(p) for p in json.loads(response.data)['products']] == [{'id', 'name'}]
+
+    def test_related_query_budget(self, client, baskets, count_queries):
+        """Test neighbours are one indexed read (plus the card's images)"""
+        rebuild_related()
+        url = f'/api/products/{baskets[0].id}/related'
+
+        with count_queries() as queries:
+            response = client.get(url)
+
+        assert response.status_code == 200
+        assert len(queries) <= 2
+
+    def test_rebuild_replaces_neighbours(self, client, user, baskets):
+        """Test a rebuild replaces the previous one and refreshes cached responses"""
+        rebuild_related()
+        assert related_skus(client, baskets[3]) == []
+
+        make_order(user, [(baskets[0], 1), (baskets[3], 1)])
+        rebuild_related()
+
+        assert related_skus(client, baskets[3]) == ['CAT-000']
+        assert RelatedProduct.query.filter_by(product_id=baskets[0].id).count() == 3
+
+    def test_inactive_and_unknown_products(self, client, baskets):
+        """Test inactive neighbours are hidden and unknown products are 404"""
+        rebuild_related()
+        baskets[1].is_active = False
+        db.session.commit()
+
+        assert related_skus(client, baskets[0]) == ['CAT-002']
+        assert client.get('/api/products/missing/related').status_code == 404
+        assert client.get(f'/api/products/{baskets[0].id}/related?limit=0').status_code == 400
+
+    def test_failed_rebuild_releases_claim(self, app):
+        """Test a claim is held for an interval unless its rebuild gives it back"""
+        now = datetime.utcnow()
+        previous = _claim_run(now, 3600)
+        assert previous is not None
+        assert _claim_run(now + timedelta(minutes=10), 3600) is None
+
+        _release_run(now, previous)
+        assert _claim_run(now + timedelta(minutes=10), 3600) is not None
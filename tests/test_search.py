@@ -0,0 +1,101 @@
+import pytest
+import json
+from app import db
+from app.models.product import Product, ProductImage
+from app.search.inverted_index import InvertedIndex, refresh_index, tokenize
+
+class TestInvertedIndex:
+    """Test the in-process search index"""
+    
+    def test_tokenize_spanish_english(self):
+        """Test accents, stopwords and plurals are normalized"""
+        assert tokenize('Teléfonos y Cámaras para el hogar') == ['telefono', 'camara', 'hogar']
+        assert tokenize('Wireless headphones for the gym') == ['wireless', 'headphon', 'gym']
+        assert tokenize('camión') == tokenize('camiones')
+    
+    def test_bm25_ranking(self):
+        """Test name matches outrank description matches"""
+        index = InvertedIndex()
+        index.add('a', {'name': 'Cable organizer', 'description': 'Keeps a laptop desk tidy'})
+        index.add('b', {'name': 'Laptop stand', 'description': 'Aluminium stand'})
+        index.add('c', {'name': 'Desk lamp', 'description': 'LED lamp'})
+        
+        assert [doc_id for doc_id, _ in index.search('laptops')] == ['b', 'a']
+    
+    def test_incremental_update_and_remove(self):
+        """Test documents can be re-indexed and removed"""
+        index = InvertedIndex()
+        index.add('a', {'name': 'Red shirt'})
+        index.add('a', {'name': 'Blue shirt'})
+        
+        assert index.search('red') == []
+        assert [doc_id for doc_id, _ in index.search('blue')] == ['a']
+        
+        index.remove('a')
+        assert len(index) == 0
+        assert index.search('shirt') == []
+
+class TestMemorySearchBackend:
+    """Test product search through the memory backend"""
+    
+    @pytest.fixture(autouse=True)
+    def memory_backend(self, app):
+        app.config['SEARCH_BACKEND'] = 'memory'
+        app.extensions['search_index'] = InvertedIndex()
+    
+    def test_search_follows_writes(self, client, admin_headers, category):
+        """Test create, update and delete keep the index current"""
+        data = {
+            'name': 'Cámara digital',
+            'sku': 'CAM-001',
+            'slug': 'camara-digital',
+            'price': 199.99,
+            'category_id': category.id
+        }
+        client.get('/api/products?q=warmup')
+        response = client.post('/api/products', data=json.dumps(data),
+                               content_type='application/json', headers=admin_headers)
+        product_id = json.loads(response.data)['product']['id']
+        
+        response = client.get('/api/products?q=camaras&sort_by=relevance')
+        assert [p['id'] for p in json.loads(response.data)['products']] == [product_id]
+        
+        client.put(f'/api/products/{product_id}', data=json.dumps({'name': 'Reloj inteligente'}),
+                   content_type='application/json', headers=admin_headers)
+        response = client.get('/api/products?q=reloj')
+        assert [p['id'] for p in json.loads(response.data)['products']] == [product_id]
+        
+        client.delete(f'/api/products/{product_id}', headers=admin_headers)
+        response = client.get('/api/products?q=reloj')
+        assert json.loads(response.data)['products'] == []
+    
+    def test_search_hydrates_in_one_query(self, client, catalog, count_queries):
+        """Test hits are loaded with a single primary-key lookup"""
+        client.get('/api/products?q=warmup')
+        
+        with count_queries() as queries:
+            response = client.get('/api/products?q=catalog&pagination=cursor')
+        
+        assert len(json.loads(response.data)['products']) == len(catalog)
+        assert len(queries) <= 3
+    
+    def test_deletes_elsewhere_rebuild_in_background(self, app, client, catalog):
+        """Test another worker's deletes rebuild the index off the request path"""
+        app.config['SEARCH_INDEX_REFRESH_SECONDS'] = 0
+        index = app.extensions['search_index']
+        client.get('/api/products?q=warmup')
+        deleted = catalog[0].id
+        ProductImage.query.filter_by(product_id=deleted).delete()
+        Product.query.filter_by(id=deleted).delete()
+        db.session.commit()
+        
+        # While a rebuild runs, no other starts and searches use the old index
+        with index._rebuild_lock:
+            assert refresh_index(index, 0) is None
+            assert deleted in index
+        
+        thread = refresh_index(index, 0)
+        thread.join(timeout=10)
+        
+        assert deleted not in index
+        assert len(index) == len(catalog) - 1
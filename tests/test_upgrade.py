@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import text
+from app import db
+from init_db import upgrade_schema
+
+def drop(*statements):
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+def indexes(table):
+    return {index['name'] for index in db.inspect(db.engine).get_indexes(table)}
+
+def columns(table):
+    return {column['name'] for column in db.inspect(db.engine).get_columns(table)}
+
+class TestSchemaUpgrade:
+    """Test init_db brings tables created by an earlier version up to the models"""
+
+    def test_adds_missing_columns_then_indexes(self, app, product):
+        """Test new columns are added before the indexes that cover them"""
+        drop(
+            'DROP INDEX ix_products_updated',
+            'DROP INDEX ix_products_active_name',
+            'ALTER TABLE product_images DROP COLUMN variants',
+        )
+
+        assert upgrade_schema() == []
+
+        assert {'ix_products_updated', 'ix_products_active_name'} <= indexes('products')
+        assert 'variants' in columns('product_images')
+        assert upgrade_schema() == []
+
+    def test_failures_are_reported_per_item(self, app, product, monkeypatch):
+        """Test one failing index does not stop the others"""
+        drop('DROP INDEX ix_products_updated', 'DROP INDEX ix_products_active_name')
+        original = db.Index.create
+
+        def create(index, bind, **kwargs):
+            if index.name == 'ix_products_updated':
+                raise RuntimeError('disk full')
+            return original(index, bind, **kwargs)
+
+        monkeypatch.setattr(db.Index, 'create', create)
+        failed = upgrade_schema()
+
+        assert [name for name, _ in failed] == ['ix_products_updated']
+        assert 'ix_products_active_name' in indexes('products')
+
+    def test_backfills_popularity_columns(self, app, client, catalog):
+        """Test a catalog that predates popularity gets the columns filled and sorts by them"""
+        drop(
+            'DROP INDEX ix_products_popularity',
+            'ALTER TABLE products DROP COLUMN popularity_score',
+            'ALTER TABLE products DROP COLUMN view_count',
+        )
+
+        assert upgrade_schema() == []
+
+        assert db.session.execute(text('SELECT DISTINCT view_count, popularity_score FROM products')).all() == [(0, 0)]
+        assert 'ix_products_popularity' in indexes('products')
+        response = client.get('/api/products?sort_by=popularity&per_page=50')
+        assert response.status_code == 200
+        assert len(response.get_json()['products']) == len(catalog)
+
+    def test_creates_search_index(self, app, client, product):
+        """Test a catalog without the full-text index is searched with LIKE until the upgrade creates it"""
+        drop(
+            'DROP TRIGGER products_fts_ai',
+            'DROP TRIGGER products_fts_ad',
+            'DROP TRIGGER products_fts_au',
+            'DROP TABLE products_fts',
+        )
+
+        response = client.get('/api/products?q=Test')
+        assert response.status_code == 200
+        assert [item['id'] for item in response.get_json()['products']] == [product.id]
+
+        assert upgrade_schema() == []
+
+        matches = db.session.execute(text("SELECT rowid FROM products_fts WHERE products_fts MATCH 'test'")).all()
+        assert len(matches) == 1
+        result = app.test_cli_runner().invoke(args=['rebuild-search-index'])
+        assert result.exit_code == 0
+        assert 'Search index rebuilt' in result.output